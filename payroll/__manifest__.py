@@ -2,7 +2,7 @@
 
 {
     "name": "Payroll",
-    "version": "16.0.1.2.1",
+    "version": "16.0.1.7.0",
     "category": "Payroll",
     "website": "https://github.com/OCA/payroll",
     "sequence": 38,
@@ -19,6 +19,7 @@
         "security/ir.model.access.csv",
         "data/hr_payroll_sequence.xml",
         "data/hr_payroll_data.xml",
+        "data/hr_payroll_cron.xml",
         "wizard/hr_payroll_contribution_register_report_views.xml",
         "wizard/hr_payroll_payslips_by_employees_views.xml",
         "views/menus.xml",
@@ -30,6 +31,8 @@
         "views/hr_payslip_line_views.xml",
         "views/hr_payslip_views.xml",
         "views/hr_payslip_run_views.xml",
+        "views/hr_payslip_archive_views.xml",
+        "views/hr_payslip_rule_profile_views.xml",
         "views/hr_employee_views.xml",
         "views/report_contributionregister.xml",
         "views/report_payslip.xml",
@@ -0,0 +1,9 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # fill the ledger with the payslips confirmed before it existed
+    env["hr.payslip.ledger"]._rebuild()
@@ -0,0 +1,40 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from openupgradelib import openupgrade
+
+from odoo.addons.payroll.models.hr_salary_rule_revision import REVISION_FIELDS
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    env["hr.salary.rule"].with_context(active_test=False).search([])._update_revision()
+    # the source of the rules copied on the payslip lines is moved to
+    # revisions: the distinct sources are read in one scan of the lines, and
+    # the lines are linked to their revision with a single join. Empty and
+    # NULL sources are the same for the revisions.
+    env.cr.execute(
+        "CREATE TEMP TABLE payroll_line_source ON COMMIT DROP AS "
+        "SELECT DISTINCT %s, NULL::integer AS revision_id "
+        "FROM hr_payslip_line WHERE revision_id IS NULL"
+        % ", ".join("COALESCE(%s, '') AS %s" % (name, name) for name in REVISION_FIELDS)
+    )
+    env.cr.execute(
+        "SELECT ctid, %s FROM payroll_line_source" % ", ".join(REVISION_FIELDS)
+    )
+    Revision = env["hr.salary.rule.revision"]
+    for row in env.cr.fetchall():
+        values = dict(zip(REVISION_FIELDS, row[1:]))
+        env.cr.execute(
+            "UPDATE payroll_line_source SET revision_id = %s WHERE ctid = %s",
+            (Revision._get_revision(values).id, row[0]),
+        )
+    env.cr.execute(
+        "UPDATE hr_payslip_line line SET revision_id = source.revision_id "
+        "FROM payroll_line_source source WHERE line.revision_id IS NULL AND %s"
+        % " AND ".join(
+            "COALESCE(line.%s, '') = source.%s" % (name, name)
+            for name in REVISION_FIELDS
+        )
+    )
+    for name in REVISION_FIELDS:
+        openupgrade.drop_columns(env.cr, [("hr_payslip_line", name)])
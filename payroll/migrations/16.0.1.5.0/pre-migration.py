@@ -0,0 +1,20 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # date_from of the worked days and inputs, the key of their partitions
+    for table in ("hr_payslip_worked_days", "hr_payslip_input"):
+        if not openupgrade.column_exists(env.cr, table, "date_from"):
+            openupgrade.logged_query(
+                env.cr, "ALTER TABLE %s ADD COLUMN date_from DATE" % table
+            )
+            openupgrade.logged_query(
+                env.cr,
+                """
+                UPDATE %s AS detail SET date_from = hp.date_from
+                FROM hr_payslip AS hp WHERE hp.id = detail.payslip_id"""
+                % table,
+            )
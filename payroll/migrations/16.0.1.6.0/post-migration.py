@@ -0,0 +1,11 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # parent_path of the payslip lines, inherited from the salary rules, is
+    # not stored anymore
+    if openupgrade.column_exists(env.cr, "hr_payslip_line", "parent_path"):
+        openupgrade.drop_columns(env.cr, [("hr_payslip_line", "parent_path")])
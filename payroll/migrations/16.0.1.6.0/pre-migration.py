@@ -0,0 +1,53 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    if not openupgrade.table_exists(env.cr, "hr_payslip_rule_profile"):
+        return
+    # the unique constraint of the rule profiles is replaced by a unique index
+    # which also covers the profiles without batch: their duplicates are
+    # merged into the first profile of the rule
+    openupgrade.logged_query(
+        env.cr,
+        "ALTER TABLE hr_payslip_rule_profile "
+        "DROP CONSTRAINT IF EXISTS hr_payslip_rule_profile_run_rule_uniq",
+    )
+    openupgrade.logged_query(
+        env.cr,
+        """
+        WITH merged AS (
+            SELECT rule_id, MIN(id) AS id,
+                SUM(evaluation_count) AS evaluation_count,
+                SUM(compute_count) AS compute_count,
+                SUM(condition_time) AS condition_time,
+                SUM(amount_time) AS amount_time,
+                SUM(total_time) AS total_time,
+                MAX(max_time) AS max_time,
+                SUM(query_count) AS query_count
+            FROM hr_payslip_rule_profile
+            WHERE run_id IS NULL
+            GROUP BY rule_id
+            HAVING COUNT(*) > 1
+        )
+        UPDATE hr_payslip_rule_profile profile
+        SET evaluation_count = merged.evaluation_count,
+            compute_count = merged.compute_count,
+            condition_time = merged.condition_time,
+            amount_time = merged.amount_time,
+            total_time = merged.total_time,
+            max_time = merged.max_time,
+            query_count = merged.query_count
+        FROM merged
+        WHERE profile.id = merged.id""",
+    )
+    openupgrade.logged_query(
+        env.cr,
+        """
+        DELETE FROM hr_payslip_rule_profile profile
+        USING hr_payslip_rule_profile other
+        WHERE profile.run_id IS NULL AND other.run_id IS NULL
+        AND other.rule_id = profile.rule_id AND other.id < profile.id""",
+    )
@@ -0,0 +1,10 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from openupgradelib import openupgrade
+
+
+@openupgrade.migrate()
+def migrate(env, version):
+    # fill the greatest and lowest line totals, the inputs and the worked days of
+    # the ledger, archives included
+    env["hr.payslip.ledger"]._rebuild()
@@ -4,6 +4,7 @@ from . import hr_contract
 from . import hr_employee
 from . import hr_leave_type
 from . import hr_payroll_structure
+from . import hr_salary_rule_revision
 from . import hr_salary_rule
 from . import hr_salary_rule_category
 from . import hr_rule_input
@@ -14,4 +15,8 @@ from . import hr_payslip_line
 from . import hr_payslip_input
 from . import hr_payslip_worked_days
 from . import hr_payslip_run
+from . import hr_payslip_compute_queue
+from . import hr_payslip_ledger
+from . import hr_payslip_archive
+from . import hr_payslip_rule_profile
 from . import res_config_settings
@@ -33,72 +33,251 @@ class BrowsableObject(BaseBrowsableObject):
         self.employee_id = employee_id
         self.env = env
 
+    def _get_history(self, query, aggregate, params):
+        """
+        @param params: parameters of the query, but the employees
+        @return: the aggregate of the employee, computed for all the
+                 employees of the PayslipsHistory of the context if any
+        """
+        history = self.env.context.get("payroll_history")
+        if not history or self.employee_id not in history.employee_ids:
+            self.env.cr.execute(
+                query.format(aggregate=aggregate),
+                dict(params, employee_ids=(self.employee_id,)),
+            )
+            return dict(self.env.cr.fetchall()).get(self.employee_id) or 0.0
+        key = (query, aggregate) + tuple(
+            (name, tuple(value) if isinstance(value, list) else value)
+            for name, value in sorted(params.items())
+        )
+        if key not in history.results:
+            self.env.cr.execute(
+                query.format(aggregate=aggregate),
+                dict(params, employee_ids=history.employee_ids),
+            )
+            history.results[key] = dict(self.env.cr.fetchall())
+        return history.results[key].get(self.employee_id) or 0.0
+
+    def _get_ledger_history(
+        self, kind, aggregate, codes, from_date, to_date, monthly=False
+    ):
+        """
+        @param aggregate: sum, avg, max or min
+        @param monthly: aggregate the sums by month instead of the lines
+        """
+        if to_date is None:
+            to_date = fields.Date.today()
+        params = {
+            "kind": kind,
+            "codes": list(codes),
+            "date_from": from_date,
+            "date_to": to_date,
+        }
+        if monthly:
+            return self._get_history(LEDGER_MONTHLY_QUERY, aggregate, params)
+        query, ledger_aggregate = LEDGER_AGGREGATES[aggregate]
+        return self._get_history(query, ledger_aggregate, params)
+
 
 class InputLine(BrowsableObject):
     """a class that will be used into the python code, mainly for
     usability purposes"""
 
     def sum(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """
-            SELECT sum(amount) as sum
-            FROM hr_payslip as hp, hr_payslip_input as pi
-            WHERE hp.employee_id = %s AND hp.state = 'done'
-            AND hp.date_from >= %s AND hp.date_to <= %s
-            AND hp.id = pi.payslip_id AND pi.code = %s""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        return self.env.cr.fetchone()[0] or 0.0
+        return self._get_ledger_history("input", "sum", (code,), from_date, to_date)
 
 
 class WorkedDays(BrowsableObject):
     """a class that will be used into the python code, mainly for
     usability purposes"""
 
-    def _sum(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """
-            SELECT sum(number_of_days) as number_of_days,
-             sum(number_of_hours) as number_of_hours
-            FROM hr_payslip as hp, hr_payslip_worked_days as pi
-            WHERE hp.employee_id = %s AND hp.state = 'done'
-            AND hp.date_from >= %s AND hp.date_to <= %s
-            AND hp.id = pi.payslip_id AND pi.code = %s""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        return self.env.cr.fetchone()
-
     def sum(self, code, from_date, to_date=None):
-        res = self._sum(code, from_date, to_date)
-        return res and res[0] or 0.0
+        return self._get_ledger_history(
+            "worked_days", "sum", (code,), from_date, to_date
+        )
 
     def sum_hours(self, code, from_date, to_date=None):
-        res = self._sum(code, from_date, to_date)
-        return res and res[1] or 0.0
+        return self._get_ledger_history(
+            "worked_hours", "sum", (code,), from_date, to_date
+        )
+
+
+# Queries of the history lookups on the lines, inputs and worked days of the
+# payslips, for a tuple of employees. The bounds on the date_from of the lines
+# prune the partitions of their table. The lookups of the Payslips, InputLine
+# and WorkedDays objects read the same aggregates from hr.payslip.ledger, see
+# the LEDGER queries below.
+INPUT_QUERY = """
+    SELECT hp.employee_id, {aggregate}
+    FROM hr_payslip as hp, hr_payslip_input as pi
+    WHERE hp.employee_id IN %(employee_ids)s AND hp.state = 'done'
+    AND pi.date_from >= %(date_from)s AND pi.date_from <= %(date_to)s
+    AND hp.date_to <= %(date_to)s
+    AND hp.id = pi.payslip_id AND pi.code = %(code)s
+    GROUP BY hp.employee_id"""
+WORKED_DAYS_QUERY = """
+    SELECT hp.employee_id, {aggregate}
+    FROM hr_payslip as hp, hr_payslip_worked_days as pi
+    WHERE hp.employee_id IN %(employee_ids)s AND hp.state = 'done'
+    AND pi.date_from >= %(date_from)s AND pi.date_from <= %(date_to)s
+    AND hp.date_to <= %(date_to)s
+    AND hp.id = pi.payslip_id AND pi.code = %(code)s
+    GROUP BY hp.employee_id"""
+RULE_QUERY = """
+    SELECT hp.employee_id, {aggregate}(case when hp.credit_note = False then
+        (pl.total) else (-pl.total) end)
+    FROM hr_payslip as hp, hr_payslip_line as pl
+    WHERE hp.employee_id IN %(employee_ids)s AND hp.state = 'done'
+    AND pl.date_from >= %(date_from)s AND pl.date_from <= %(date_to)s
+    AND hp.date_to <= %(date_to)s
+    AND hp.id = pl.slip_id AND pl.code = %(code)s
+    GROUP BY hp.employee_id"""
+CATEGORY_QUERY = """
+    SELECT hp.employee_id, {aggregate}(case when hp.credit_note is not True then
+        (pl.total) else (-pl.total) end)
+    FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
+    WHERE hp.employee_id IN %(employee_ids)s AND hp.state = 'done'
+    AND pl.date_from >= %(date_from)s AND pl.date_from <= %(date_to)s
+    AND hp.date_to <= %(date_to)s
+    AND hp.id = pl.slip_id AND rc.id = pl.category_id AND rc.code in %(codes)s
+    GROUP BY hp.employee_id"""
+RULE_MONTHLY_QUERY = """
+    SELECT employee_id, {aggregate}(total) FROM (
+        SELECT hp.employee_id, DATE_TRUNC('month',hp.date_from) AS date_month,
+            sum(case when hp.credit_note = False then
+                (pl.total) else (-pl.total) end) AS total
+        FROM hr_payslip as hp, hr_payslip_line as pl
+        WHERE hp.employee_id IN %(employee_ids)s AND hp.state = 'done'
+        AND pl.date_from >= %(date_from)s AND pl.date_from <= %(date_to)s
+        AND hp.date_to <= %(date_to)s
+        AND hp.id = pl.slip_id AND pl.code = %(code)s
+        GROUP BY hp.employee_id, date_month) AS monthly_sum
+    GROUP BY employee_id"""
+CATEGORY_MONTHLY_QUERY = """
+    SELECT employee_id, {aggregate}(total) FROM (
+        SELECT hp.employee_id, DATE_TRUNC('month',hp.date_from) AS date_month,
+            sum(case when hp.credit_note is not True then
+                (pl.total) else (-pl.total) end) AS total
+        FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
+        WHERE hp.employee_id IN %(employee_ids)s AND hp.state = 'done'
+        AND pl.date_from >= %(date_from)s AND pl.date_from <= %(date_to)s
+        AND hp.date_to <= %(date_to)s
+        AND hp.id = pl.slip_id AND rc.id = pl.category_id AND rc.code in %(codes)s
+        GROUP BY hp.employee_id, date_month) AS monthly_sum
+    GROUP BY employee_id"""
+# Same lookups read from hr.payslip.ledger, archived payslips included. Sums
+# and averages: the running total up to date_to, minus the running total
+# before date_from, minus the payslips starting before date_from and ending in
+# the window. {aggregate} is an expression of amount and line_count.
+LEDGER_QUERY = """
+    SELECT employee_id, {aggregate} FROM (
+        SELECT e.id AS employee_id,
+            coalesce(upto.cumulative_amount, 0)
+                - coalesce(before.cumulative_amount, 0)
+                - coalesce(straddle.amount, 0) AS amount,
+            coalesce(upto.cumulative_count, 0)
+                - coalesce(before.cumulative_count, 0)
+                - coalesce(straddle.line_count, 0) AS line_count
+        FROM hr_employee AS e
+        CROSS JOIN unnest(%(codes)s::varchar[]) AS c(code)
+        LEFT JOIN LATERAL (
+            SELECT cumulative_amount, cumulative_count FROM hr_payslip_ledger
+            WHERE employee_id = e.id AND kind = %(kind)s AND code = c.code
+            AND date_to <= %(date_to)s
+            ORDER BY date_to DESC, id DESC LIMIT 1
+        ) AS upto ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT cumulative_amount, cumulative_count FROM hr_payslip_ledger
+            WHERE employee_id = e.id AND kind = %(kind)s AND code = c.code
+            AND date_to < %(date_from)s
+            ORDER BY date_to DESC, id DESC LIMIT 1
+        ) AS before ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT sum(amount) AS amount, sum(line_count) AS line_count
+            FROM hr_payslip_ledger
+            WHERE employee_id = e.id AND kind = %(kind)s AND code = c.code
+            AND date_to >= %(date_from)s AND date_to <= %(date_to)s
+            AND date_from < %(date_from)s
+        ) AS straddle ON TRUE
+        WHERE e.id IN %(employee_ids)s
+    ) AS windows
+    GROUP BY employee_id"""
+# Maximum and minimum: the rows of the payslips of the window, {aggregate} is
+# an aggregate of max_amount or min_amount.
+LEDGER_RANGE_QUERY = """
+    SELECT employee_id, {aggregate} FROM hr_payslip_ledger
+    WHERE employee_id IN %(employee_ids)s AND kind = %(kind)s
+    AND code = ANY(%(codes)s)
+    AND date_from >= %(date_from)s AND date_from <= %(date_to)s
+    AND date_to <= %(date_to)s
+    GROUP BY employee_id"""
+# Monthly lookups: the rows of the payslips of the window, summed by month
+LEDGER_MONTHLY_QUERY = """
+    SELECT employee_id, {aggregate}(amount) FROM (
+        SELECT employee_id, DATE_TRUNC('month', date_from) AS date_month,
+            sum(amount) AS amount
+        FROM hr_payslip_ledger
+        WHERE employee_id IN %(employee_ids)s AND kind = %(kind)s
+        AND code = ANY(%(codes)s)
+        AND date_from >= %(date_from)s AND date_from <= %(date_to)s
+        AND date_to <= %(date_to)s
+        GROUP BY employee_id, date_month) AS monthly_sum
+    GROUP BY employee_id"""
+# {aggregate of the lines: (ledger query, aggregate of the ledger rows)}
+LEDGER_AGGREGATES = {
+    "sum": (LEDGER_QUERY, "sum(amount)"),
+    "avg": (LEDGER_QUERY, "sum(amount) / nullif(sum(line_count), 0)"),
+    "max": (LEDGER_RANGE_QUERY, "max(max_amount)"),
+    "min": (LEDGER_RANGE_QUERY, "min(min_amount)"),
+}
+
+
+class PayslipsHistory(object):
+    """Results of the history lookups of the Payslips, InputLine and
+    WorkedDays objects, shared by all the payslips computed together (see
+    hr.payslip._compute_lines_dicts()). Each lookup is done once for all the
+    employees, so the number of queries does not depend on the number of
+    payslips."""
+
+    def __init__(self, employee_ids):
+        self.employee_ids = tuple(employee_ids)
+        self.results = {}
 
 
 class Payslips(BrowsableObject):
     """a class that will be used into the python code, mainly for
     usability purposes"""
 
-    def sum_rule(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT sum(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s""",
-            (self.employee_id, from_date, to_date, code),
+    def _get_rule_history(self, aggregate, code, from_date, to_date, monthly=False):
+        return self._get_ledger_history(
+            "rule", aggregate, (code,), from_date, to_date, monthly
+        )
+
+    def _get_category_history(self, aggregate, code, from_date, to_date, monthly=False):
+        codes = self._get_hierarchy_codes(code)
+        return self._get_ledger_history(
+            "category", aggregate, codes, from_date, to_date, monthly
         )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+
+    def _get_hierarchy_codes(self, code):
+        history = self.env.context.get("payroll_history")
+        key = ("hierarchy_codes", code)
+        if history and key in history.results:
+            return history.results[key]
+
+        # the category and all its descendants, at any depth
+        categories = self.env["hr.salary.rule.category"].search([("code", "=", code)])
+        hierarchy_codes = set(
+            categories.search([("id", "child_of", categories.ids)]).mapped("code")
+        )
+        hierarchy_codes = tuple(sorted(hierarchy_codes - {False}) or (code,))
+
+        if history:
+            history.results[key] = hierarchy_codes
+        return hierarchy_codes
+
+    def sum_rule(self, code, from_date, to_date=None):
+        return self._get_rule_history("sum", code, from_date, to_date)
 
     def sum(self, code, from_date, to_date=None):
         _logger.warning(
@@ -107,261 +286,40 @@ class Payslips(BrowsableObject):
         return self.sum_rule(code, from_date, to_date)
 
     def average_rule(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT avg(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_rule_history("avg", code, from_date, to_date)
 
     def average_rule_monthly(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT avg(total) FROM (SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s) AS monthly_sum""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_rule_history("avg", code, from_date, to_date, monthly=True)
 
     def max_rule(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_rule_history("max", code, from_date, to_date)
 
     def max_rule_monthly(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT max(total) FROM (SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s) AS monthly_sum""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_rule_history("max", code, from_date, to_date, monthly=True)
 
     def min_rule(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT min(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_rule_history("min", code, from_date, to_date)
 
     def min_rule_monthly(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-        self.env.cr.execute(
-            """SELECT min(total) FROM (SELECT max(case when hp.credit_note = False then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND
-                     hp.id = pl.slip_id AND pl.code = %s) AS monthly_sum""",
-            (self.employee_id, from_date, to_date, code),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_rule_history("min", code, from_date, to_date, monthly=True)
 
     def sum_category(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT sum(case when hp.credit_note is not True then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                    AND rc.id = pl.category_id AND rc.code in %s""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("sum", code, from_date, to_date)
 
     def average_category(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT avg(case when hp.credit_note is not True then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                    AND rc.id = pl.category_id AND rc.code in %s""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("avg", code, from_date, to_date)
 
     def average_category_monthly(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT avg(total) FROM (
-                SELECT DATE_TRUNC('month',hp.date_from) AS date_month,
-                    sum(case when hp.credit_note is not True then
-                        (pl.total) else (-pl.total) end) AS total
-                FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                WHERE hp.employee_id = %s AND hp.state = 'done'
-                AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                AND rc.id = pl.category_id AND rc.code in %s
-                GROUP BY date_month) AS monthly_sum""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("avg", code, from_date, to_date, monthly=True)
 
     def max_category(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT max(case when hp.credit_note is not True then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                    AND rc.id = pl.category_id AND rc.code in %s""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("max", code, from_date, to_date)
 
     def max_category_monthly(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT max(total) FROM (
-                SELECT DATE_TRUNC('month',hp.date_from) AS date_month,
-                    sum(case when hp.credit_note is not True then
-                        (pl.total) else (-pl.total) end) AS total
-                FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                WHERE hp.employee_id = %s AND hp.state = 'done'
-                AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                AND rc.id = pl.category_id AND rc.code in %s
-                GROUP BY date_month) AS monthly_sum""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("max", code, from_date, to_date, monthly=True)
 
     def min_category(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT min(case when hp.credit_note is not True then
-            (pl.total) else (-pl.total) end)
-                    FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                    WHERE hp.employee_id = %s AND hp.state = 'done'
-                    AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                    AND rc.id = pl.category_id AND rc.code in %s""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("min", code, from_date, to_date)
 
     def min_category_monthly(self, code, from_date, to_date=None):
-        if to_date is None:
-            to_date = fields.Date.today()
-
-        hierarchy_codes = (
-            self.env["hr.salary.rule.category"]
-            .search([("code", "=", code)])
-            .children_ids.mapped("code")
-        )
-        hierarchy_codes.append(code)
-
-        self.env.cr.execute(
-            """SELECT min(total) FROM (
-                SELECT DATE_TRUNC('month',hp.date_from) AS date_month,
-                    sum(case when hp.credit_note is not True then
-                        (pl.total) else (-pl.total) end) AS total
-                FROM hr_payslip as hp, hr_payslip_line as pl, hr_salary_rule_category as rc
-                WHERE hp.employee_id = %s AND hp.state = 'done'
-                AND hp.date_from >= %s AND hp.date_to <= %s AND hp.id = pl.slip_id
-                AND rc.id = pl.category_id AND rc.code in %s
-                GROUP BY date_month) AS monthly_sum""",
-            (self.employee_id, from_date, to_date, tuple(hierarchy_codes)),
-        )
-        res = self.env.cr.fetchone()
-        return res and res[0] or 0.0
+        return self._get_category_history("min", code, from_date, to_date, monthly=True)
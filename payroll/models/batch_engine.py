@@ -0,0 +1,443 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import ast
+import logging
+from collections.abc import MutableMapping
+
+from .base_browsable import BaseBrowsableObject, BrowsableObject, InputLine, WorkedDays
+
+_logger = logging.getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    _logger.debug("numpy is not installed, the payroll batch engine is disabled")
+
+NUMERIC_FIELD_TYPES = ("float", "integer", "monetary")
+# Browsable objects of the localdict whose attributes can be vectorized
+NAMESPACES = {
+    "categories": BrowsableObject,
+    "worked_days": WorkedDays,
+    "inputs": InputLine,
+}
+LINE_FIELDS = {
+    "worked_days": ("number_of_days", "number_of_hours"),
+    "inputs": ("amount", "amount_qty"),
+}
+
+
+class ColumnStore(object):
+    """Values of a localdict object (e.g. categories) for all the rows of a
+    batch, stored as one numpy array per key."""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = {}
+        self.present = {}
+
+    def _init_column(self, key):
+        if key not in self.values:
+            self.values[key] = numpy.zeros(self.size)
+            self.present[key] = numpy.zeros(self.size, dtype=bool)
+
+    def get_column(self, key):
+        if key in self.values:
+            return self.values[key]
+        return numpy.zeros(self.size)
+
+    def add(self, key, amounts, mask):
+        self._init_column(key)
+        self.values[key] += numpy.where(mask, amounts, 0.0)
+        self.present[key] |= mask
+
+    def row(self, index):
+        return RowMapping(self, index)
+
+
+class RowMapping(MutableMapping):
+    """dict-like view on one row of a ColumnStore. It is used as the dict of
+    the browsable objects of the rules computed row by row, so their results
+    are directly stored in the columns."""
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, key):
+        present = self.store.present.get(key)
+        if present is None or not present[self.index]:
+            raise KeyError(key)
+        return float(self.store.values[key][self.index])
+
+    def __setitem__(self, key, value):
+        self.store._init_column(key)
+        self.store.values[key][self.index] = value
+        self.store.present[key][self.index] = True
+
+    def __delitem__(self, key):
+        self[key]  # raise KeyError when the key is not set
+        self.store.values[key][self.index] = 0.0
+        self.store.present[key][self.index] = False
+
+    def __iter__(self):
+        return (
+            key for key, present in self.store.present.items() if present[self.index]
+        )
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+
+class VectorExpression(object):
+    """Evaluation of a simple rule expression for all the rows of a batch at
+    once. Supported expressions are made of numbers, the + - * / operators,
+    "and" / "or", rule codes, numeric contract fields, categories.CODE,
+    worked_days.CODE[.number_of_days|.number_of_hours] and
+    inputs.CODE[.amount|.amount_qty].
+
+    Values which can not be computed are set to NaN, the rule is then
+    computed row by row so that the errors are raised as usual.
+    """
+
+    def __init__(self, node):
+        self.node = node
+
+    @classmethod
+    def compile(cls, source, contract_fields, rule_codes):
+        """
+        @return: a VectorExpression, or None when the expression is not
+                 supported and has to be evaluated row by row
+        """
+        try:
+            tree = ast.parse((source or "").strip(), mode="eval")
+        except SyntaxError:
+            return None
+        if not cls._is_supported(tree.body, contract_fields, rule_codes):
+            return None
+        return cls(tree.body)
+
+    @classmethod
+    def _is_supported(cls, node, contract_fields, rule_codes):
+        if isinstance(node, ast.Constant):
+            return isinstance(node.value, (int, float))
+        if isinstance(node, ast.UnaryOp):
+            return isinstance(node.op, (ast.UAdd, ast.USub)) and cls._is_supported(
+                node.operand, contract_fields, rule_codes
+            )
+        if isinstance(node, ast.BinOp):
+            return (
+                isinstance(node.op, (ast.Add, ast.Sub, ast.Mult, ast.Div))
+                and cls._is_supported(node.left, contract_fields, rule_codes)
+                and cls._is_supported(node.right, contract_fields, rule_codes)
+            )
+        if isinstance(node, ast.BoolOp):
+            return all(
+                cls._is_supported(value, contract_fields, rule_codes)
+                for value in node.values
+            )
+        if isinstance(node, ast.Name):
+            return node.id in rule_codes
+        if isinstance(node, ast.Attribute):
+            value = node.value
+            if isinstance(value, ast.Name):
+                if value.id == "contract":
+                    return node.attr in contract_fields
+                # attributes of the object itself are not values
+                namespace = NAMESPACES.get(value.id)
+                return (
+                    namespace is not None
+                    and node.attr not in ("dict", "employee_id", "env")
+                    and not hasattr(namespace, node.attr)
+                )
+            return (
+                isinstance(value, ast.Attribute)
+                and isinstance(value.value, ast.Name)
+                and node.attr in LINE_FIELDS.get(value.value.id, ())
+            )
+        return False
+
+    def evaluate(self, engine):
+        """
+        @return: the array of the values of the expression for every row
+        @raise KeyError: when a rule code is not computed for all the rows
+        """
+        with numpy.errstate(all="ignore"):
+            return self._evaluate(self.node, engine)[0]
+
+    def _evaluate(self, node, engine):
+        """
+        @return: a tuple of arrays (values, truth values) of the node
+        """
+        if isinstance(node, ast.Constant):
+            values = numpy.full(engine.size, float(node.value))
+        elif isinstance(node, ast.UnaryOp):
+            values = self._evaluate(node.operand, engine)[0]
+            if isinstance(node.op, ast.USub):
+                values = -values
+        elif isinstance(node, ast.BinOp):
+            left = self._evaluate(node.left, engine)[0]
+            right = self._evaluate(node.right, engine)[0]
+            if isinstance(node.op, ast.Add):
+                values = left + right
+            elif isinstance(node.op, ast.Sub):
+                values = left - right
+            elif isinstance(node.op, ast.Mult):
+                values = left * right
+            else:
+                values = left / right
+        elif isinstance(node, ast.BoolOp):
+            return self._evaluate_bool_op(node, engine)
+        elif isinstance(node, ast.Name):
+            values = engine.get_rule_column(node.id)
+        elif isinstance(node.value, ast.Name) and node.value.id == "contract":
+            values = engine.get_contract_column(node.attr)
+        elif isinstance(node.value, ast.Name) and node.value.id == "categories":
+            values = engine.categories.get_column(node.attr)
+        elif isinstance(node.value, ast.Name):
+            # a worked days or input line, only usable as a truth value
+            present = engine.get_line_mask(node.value.id, node.attr)
+            return numpy.where(present, numpy.nan, 0.0), present
+        else:
+            values = engine.get_line_column(
+                node.value.value.id, node.value.attr, node.attr
+            )
+        return values, values != 0
+
+    def _evaluate_bool_op(self, node, engine):
+        values, truth = self._evaluate(node.values[-1], engine)
+        for operand in reversed(node.values[:-1]):
+            operand_values, operand_truth = self._evaluate(operand, engine)
+            if isinstance(node.op, ast.And):
+                values = numpy.where(operand_truth, values, operand_values)
+                truth = operand_truth & truth
+            else:
+                values = numpy.where(operand_truth, operand_values, values)
+                truth = operand_truth | truth
+        return values, truth
+
+
+class BatchEngine(object):
+    """Compute the payslips of a batch sharing the same execution plan.
+
+    Every (payslip, contract) pair is a row. Rules with a fixed or percentage
+    amount, and no python condition, are evaluated for all the rows at once
+    with numpy. The other rules are computed row by row as in
+    hr.payslip.get_lines_dict(). The sums of the categories are stored in
+    numpy columns shared by both paths.
+    """
+
+    def __init__(self, plan, rows):
+        """
+        @param plan: the ExecutionPlan of the payslips
+        @param rows: list of (payslip, contract) tuples, payslips must have a
+                     single contract
+        """
+        self.plan = plan
+        self.size = len(rows)
+        self.payslips = [payslip for payslip, contract in rows]
+        self.contracts = [contract for payslip, contract in rows]
+        self.env = self.payslips[0].env
+        self.categories = ColumnStore(self.size)
+        self.blocked = {}
+        self.localdicts = []
+        self.lines_dicts = [{} for payslip in self.payslips]
+        contract_fields = self.env["hr.contract"]._fields
+        self.contract_fields = {
+            name
+            for name, field in contract_fields.items()
+            if field.type in NUMERIC_FIELD_TYPES
+        }
+        self.rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+        self.rule_codes = set(self.rules.filtered("code").mapped("code"))
+        self._vector_rules = {}
+
+    def compute(self):
+        """
+        @return: a dict {payslip id: lines dict}, the lines dicts being the
+                 same as the ones returned by hr.payslip.get_lines_dict()
+        """
+        self._init_localdicts()
+        for rule in self.rules:
+            vector_rule = self._get_vector_rule(rule)
+            if vector_rule is None or not self._compute_vector_rule(rule, *vector_rule):
+                self._compute_rule_by_row(rule)
+        res = {}
+        for index, payslip in enumerate(self.payslips):
+            payslip.localdict_hook(self.localdicts[index])
+            res[payslip.id] = self.lines_dicts[index]
+        return res
+
+    def _init_localdicts(self):
+        for index, (payslip, contract) in enumerate(zip(self.payslips, self.contracts)):
+            baselocaldict = payslip._get_baselocaldict(contract)
+            baselocaldict["categories"] = BrowsableObject(
+                payslip.employee_id.id, self.categories.row(index), payslip.env
+            )
+            baselocaldict["current_contract"] = BrowsableObject(
+                payslip.employee_id.id,
+                payslip.get_current_contract_dict(contract, contract),
+                payslip.env,
+            )
+            self.localdicts.append(
+                dict(
+                    baselocaldict,
+                    employee=contract.employee_id,
+                    contract=contract,
+                    payslip=payslip,
+                )
+            )
+
+    def get_rule_column(self, code):
+        return numpy.array([float(localdict[code]) for localdict in self.localdicts])
+
+    def get_contract_column(self, fname):
+        return numpy.array([float(contract[fname]) for contract in self.contracts])
+
+    def get_line_mask(self, namespace, code):
+        return numpy.array(
+            [code in localdict[namespace].dict for localdict in self.localdicts],
+            dtype=bool,
+        )
+
+    def get_line_column(self, namespace, code, fname):
+        return numpy.array(
+            [
+                localdict[namespace].dict[code][fname]
+                if code in localdict[namespace].dict
+                else numpy.nan
+                for localdict in self.localdicts
+            ]
+        )
+
+    def _get_blocked(self, rule_id):
+        if rule_id not in self.blocked:
+            self.blocked[rule_id] = numpy.zeros(self.size, dtype=bool)
+        return self.blocked[rule_id]
+
+    def _get_vector_rule(self, rule):
+        """
+        @return: a tuple (amount expressions, condition expressions) of the
+                 rule, or None when it can not be computed for all the rows
+                 at once
+        """
+        if rule.id not in self._vector_rules:
+            self._vector_rules[rule.id] = self._compile_rule(rule)
+        return self._vector_rules[rule.id]
+
+    def _compile_expression(self, source):
+        return VectorExpression.compile(source, self.contract_fields, self.rule_codes)
+
+    def _compile_rule(self, rule):
+        if rule.amount_select not in ("fix", "percentage"):
+            return None
+        fnames = ["quantity"]
+        if rule.amount_select == "percentage":
+            fnames.append("amount_percentage_base")
+        expressions = {}
+        for fname in fnames:
+            expressions[fname] = self._compile_expression(rule[fname])
+            if expressions[fname] is None:
+                return None
+        # the conditions of the parent rules are checked with the rule one
+        conditions = []
+        parent = rule
+        while parent:
+            if parent.condition_select == "python":
+                return None
+            if parent.condition_select == "range":
+                expression = self._compile_expression(parent.condition_range)
+                if expression is None:
+                    return None
+                conditions.append((parent, expression))
+            parent = parent.parent_rule_id
+        return expressions, conditions
+
+    def _compute_vector_rule(self, rule, expressions, conditions):
+        """Compute the rule for all the rows at once.
+        @return: False when the rule has to be computed row by row instead
+        """
+        try:
+            satisfied = numpy.ones(self.size, dtype=bool)
+            for parent, expression in conditions:
+                result = expression.evaluate(self)
+                if not numpy.isfinite(result).all():
+                    return False
+                satisfied &= (parent.condition_range_min <= result) & (
+                    result <= parent.condition_range_max
+                )
+            applied = satisfied & ~self._get_blocked(rule.id)
+            quantity = expressions["quantity"].evaluate(self)
+            if rule.amount_select == "percentage":
+                rate = rule.amount_percentage
+                amount = expressions["amount_percentage_base"].evaluate(self)
+            else:
+                rate = 100.0
+                amount = numpy.full(self.size, rule.amount_fix)
+        except KeyError:
+            return False
+        if not (
+            numpy.isfinite(quantity[applied]).all()
+            and numpy.isfinite(amount[applied]).all()
+        ):
+            return False
+        # blacklist the rule and its children for the rows where it is not
+        # applied, as done by get_lines_dict()
+        for rule_id in self.plan.blacklists[rule.id]:
+            self.blocked[rule_id] = self._get_blocked(rule_id) | ~applied
+        total = quantity * rate * amount / 100.0
+        self._set_vector_results(rule, applied, quantity, rate, amount, total)
+        return True
+
+    def _set_vector_results(self, rule, applied, quantity, rate, amount, total):
+        indexes = numpy.flatnonzero(applied).tolist()
+        previous_amounts = numpy.zeros(self.size)
+        if rule.code:
+            for index in indexes:
+                localdict = self.localdicts[index]
+                previous_amounts[index] = (
+                    rule.code in localdict and localdict[rule.code] or 0.0
+                )
+        for code in self.plan.category_codes.get(rule.category_id.id, ()):
+            self.categories.add(code, total - previous_amounts, applied)
+        rule_values = self.payslips[0]._get_rule_line_values(rule)
+        quantities, amounts, totals = quantity.tolist(), amount.tolist(), total.tolist()
+        for index in indexes:
+            localdict = self.localdicts[index]
+            values = {
+                "name": rule.name,
+                "quantity": quantities[index],
+                "rate": rate,
+                "amount": amounts[index],
+                "total": totals[index],
+            }
+            if rule.code:
+                localdict[rule.code] = totals[index]
+                localdict["rules"].dict[rule.code] = rule
+                localdict["result_rules"].dict[rule.code] = BaseBrowsableObject(
+                    values
+                )
+            key = (rule.code or "id" + str(rule.id)) + "-" + str(
+                self.contracts[index].id
+            )
+            line_dict = dict(
+                rule_values,
+                employee_id=localdict["employee"].id,
+                contract_id=localdict["contract"].id,
+            )
+            line_dict.update(values)
+            self.lines_dicts[index][key] = line_dict
+
+    def _compute_rule_by_row(self, rule):
+        blocked = self._get_blocked(rule.id)
+        for index, payslip in enumerate(self.payslips):
+            localdict = rule._reset_localdict_values(self.localdicts[index])
+            if rule._satisfy_condition(localdict) and not blocked[index]:
+                localdict, _dict = payslip._compute_payslip_line(
+                    rule, localdict, self.lines_dicts[index]
+                )
+                self.lines_dicts[index].update(_dict)
+            else:
+                for rule_id in self.plan.blacklists[rule.id]:
+                    self._get_blocked(rule_id)[index] = True
+            self.localdicts[index] = localdict
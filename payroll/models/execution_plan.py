@@ -0,0 +1,254 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import ast
+from types import MappingProxyType
+
+from odoo.tools.safe_eval import _BUILTINS
+
+# Objects of the rule localdict holding values that can change between two
+# computations of a payslip. "result_rules" values are the ones of "rules".
+DEPENDENCY_NAMESPACES = {
+    "rules": "rules",
+    "result_rules": "rules",
+    "categories": "categories",
+    "inputs": "inputs",
+    "worked_days": "worked_days",
+}
+# Objects that give access to the inputs and worked days in any other way
+OPAQUE_NAMES = ("payslip",)
+# Other names of the rule localdict. Modifying the records behind them
+# computes the whole payslip again, see hr.payslip._force_full_recompute()
+LOCALDICT_NAMES = (
+    "employee",
+    "contract",
+    "current_contract",
+    "payslips",
+    "payroll",
+    "tools",
+    "result",
+    "result_name",
+    "result_qty",
+    "result_rate",
+)
+
+
+def get_code_dependencies(source, mode="exec"):
+    """Find the values a piece of salary rule code depends on.
+
+    @return: a set of keys like "inputs.SALEURO", "categories.BASIC" or
+             "rules.NET". A key "inputs.*" means the code depends on all the
+             inputs. Bare names are returned as "rules.<name>", because the
+             total of every computed rule is also available by its code, but
+             they can also be variables assigned by other rules, see
+             ExecutionPlan.
+    """
+    if mode == "eval":
+        source = source.strip()
+    try:
+        tree = ast.parse(source or "", mode=mode)
+    except SyntaxError:
+        return {"%s.*" % namespace for namespace in ("inputs", "worked_days")}
+    dependencies = set()
+    names = []
+    attribute_names = set()
+    for node in ast.walk(tree):
+        if (
+            isinstance(node, ast.Attribute)
+            and isinstance(node.value, ast.Name)
+            and node.value.id in DEPENDENCY_NAMESPACES
+        ):
+            attribute_names.add(id(node.value))
+            attr = "*" if node.attr == "dict" else node.attr
+            namespace = DEPENDENCY_NAMESPACES[node.value.id]
+            dependencies.add("%s.%s" % (namespace, attr))
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            names.append(node)
+    assigned = get_assigned_names(source, mode)
+    for node in names:
+        if id(node) in attribute_names or node.id in assigned:
+            continue
+        if node.id in LOCALDICT_NAMES or node.id in _BUILTINS:
+            continue
+        if node.id in DEPENDENCY_NAMESPACES:
+            dependencies.add("%s.*" % DEPENDENCY_NAMESPACES[node.id])
+        elif node.id in OPAQUE_NAMES:
+            dependencies.update(("inputs.*", "worked_days.*"))
+        else:
+            dependencies.add("rules.%s" % node.id)
+    return dependencies
+
+
+def get_assigned_names(source, mode="exec"):
+    """
+    @return: the set of the variables assigned by a piece of salary rule
+             code, including the arguments of its lambdas and comprehensions
+    """
+    if mode == "eval":
+        source = source.strip()
+    try:
+        tree = ast.parse(source or "", mode=mode)
+    except SyntaxError:
+        return set()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            names.add(node.name)
+    return names
+
+
+class ExecutionPlan(object):
+    """Resolved salary rules of a set of salary structures.
+
+    The plan only holds ids and plain values, so it is safe to cache it per
+    registry and to share it between all the payslips of a batch. It is built
+    by hr.payroll.structure._get_execution_plan().
+
+    - structure_ids: ids of the structures the plan was built for
+    - rule_ids: ids of the rules to compute, in computation order
+    - blacklists: rule id -> ids of the rule and all its children, which are
+      skipped when the rule condition is not satisfied
+    - category_codes: category id -> codes of the category and its parents
+    - inputs: (name, code) of the inputs defined on the rules
+    - dependencies: rule id -> keys of the values used by the rule code and
+      conditions, see get_code_dependencies(). "*" means the rule depends on
+      everything: it reads variables which are not rule codes, or assigns
+      variables read by other rules, as the localdict is shared by the rules
+    - outputs: rule id -> keys of the values set by the rule
+    - parent_ids: rule id -> id of its parent rule
+    """
+
+    __slots__ = (
+        "structure_ids",
+        "rule_ids",
+        "blacklists",
+        "category_codes",
+        "inputs",
+        "dependencies",
+        "outputs",
+        "parent_ids",
+    )
+
+    def __init__(self, structures, rules):
+        # a rule and all its descendants, read from the parent paths
+        blacklists = {rule.id: {rule.id} for rule in rules}
+        for rule in rules.search([("id", "child_of", rules.ids)]):
+            for id in rule.parent_path.split("/")[:-1]:
+                if int(id) in blacklists:
+                    blacklists[int(id)].add(rule.id)
+        blacklists = {id: frozenset(ids) for id, ids in blacklists.items()}
+        category_codes = {}
+        for category in rules.mapped("category_id"):
+            category_codes[category.id] = category._get_ancestor_codes()[::-1]
+        dependencies = {}
+        assigned = {}
+        outputs = {}
+        for rule in rules:
+            rule_dependencies = set()
+            assigned[rule.id] = set()
+            for fname in rule._get_rule_code_fields():
+                mode = rule._get_rule_code_mode(fname)
+                rule_dependencies |= get_code_dependencies(rule[fname], mode)
+                assigned[rule.id] |= get_assigned_names(rule[fname], mode)
+            dependencies[rule.id] = rule_dependencies
+            rule_outputs = {
+                "categories.%s" % code
+                for code in category_codes.get(rule.category_id.id, ())
+            }
+            if rule.code:
+                rule_outputs.add("rules.%s" % rule.code)
+            outputs[rule.id] = frozenset(rule_outputs)
+        # bare names which are not rule codes are variables shared between
+        # rules through the localdict, or unknown values
+        codes = {"rules.%s" % code for code in rules.mapped("code")}
+        shared = {
+            rule_id: {
+                key
+                for key in rule_dependencies
+                if key.startswith("rules.") and key not in codes
+            }
+            for rule_id, rule_dependencies in dependencies.items()
+        }
+        shared_names = {key[6:] for keys in shared.values() for key in keys}
+        for rule_id in dependencies:
+            if shared[rule_id] or assigned[rule_id] & shared_names:
+                dependencies[rule_id] = {"*"}
+        dependencies = {
+            rule_id: frozenset(rule_dependencies)
+            for rule_id, rule_dependencies in dependencies.items()
+        }
+        setattr_ = super().__setattr__
+        setattr_("structure_ids", tuple(structures.ids))
+        setattr_("rule_ids", tuple(rules.ids))
+        setattr_("blacklists", MappingProxyType(blacklists))
+        setattr_("category_codes", MappingProxyType(category_codes))
+        setattr_(
+            "inputs",
+            tuple(
+                (rule_input.name, rule_input.code)
+                for rule_input in rules.mapped("input_ids")
+            ),
+        )
+        setattr_("dependencies", MappingProxyType(dependencies))
+        setattr_("outputs", MappingProxyType(outputs))
+        setattr_(
+            "parent_ids",
+            MappingProxyType(
+                {
+                    rule.id: rule.parent_rule_id.id
+                    for rule in rules.filtered("parent_rule_id")
+                }
+            ),
+        )
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("Execution plans are read-only")
+
+    def get_affected_rule_ids(self, keys):
+        """
+        @param keys: keys of the modified values, like "inputs.SALEURO" or
+                     "worked_days.WORK100"
+        @return: ids of the rules that have to be computed again, which are
+                 the rules depending on the modified values, directly or
+                 through other rules, categories or parent rules
+        """
+        changed = set(keys)
+        wildcards = {key[:-2] for key in changed if key.endswith(".*")}
+        affected = set()
+        # rules of a contract see the results of the rules of previous
+        # contracts, loop until the set of affected rules is stable
+        while True:
+            count = len(affected)
+            namespaces = {key.split(".", 1)[0] for key in changed}
+            for rule_id in self.rule_ids:
+                if rule_id in affected:
+                    continue
+                if self.parent_ids.get(rule_id) in affected or self._depends_on(
+                    rule_id, changed, namespaces, wildcards
+                ):
+                    affected.add(rule_id)
+                    changed |= self.outputs[rule_id]
+            if len(affected) == count:
+                return frozenset(affected)
+
+    def _depends_on(self, rule_id, changed, namespaces, wildcards):
+        if "*" in self.dependencies[rule_id]:
+            return True
+        for dependency in self.dependencies[rule_id]:
+            namespace, name = dependency.split(".", 1)
+            if (
+                dependency in changed
+                or namespace in wildcards
+                or (name == "*" and namespace in namespaces)
+            ):
+                return True
+        return False
+
+    def __repr__(self):
+        return "<ExecutionPlan structures=%s rules=%s>" % (
+            list(self.structure_ids),
+            len(self.rule_ids),
+        )
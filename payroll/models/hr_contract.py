@@ -1,6 +1,48 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models
+from collections import defaultdict
+
+from odoo import api, fields, models
+
+
+class ContractIndex(object):
+    """Running contracts of employees over a period, loaded with one query on
+    first use and indexed by employee, shared by the payslips resolved
+    together (see hr.payslip._get_employee_contracts()). Any period within
+    the loaded one is answered from the index."""
+
+    def __init__(self, employees, date_from, date_to):
+        self.employees = employees
+        self.employee_ids = set(employees.ids)
+        self.date_from = date_from
+        self.date_to = date_to
+        self.contracts = None
+
+    def get_contracts(self, employee, date_from, date_to):
+        """
+        @return: the contracts of the employee running between the dates, as
+                 returned by employee._get_contracts(), or None when they are
+                 not in the index
+        """
+        if (
+            employee.id not in self.employee_ids
+            or date_from < self.date_from
+            or date_to > self.date_to
+        ):
+            return None
+        if self.contracts is None:
+            self.contracts = defaultdict(list)
+            for contract in self.employees._get_contracts(self.date_from, self.date_to):
+                self.contracts[contract.employee_id.id].append(
+                    (contract.id, contract.date_start, contract.date_end)
+                )
+        return employee.env["hr.contract"].browse(
+            [
+                id
+                for id, date_start, date_end in self.contracts[employee.id]
+                if date_start <= date_to and (not date_end or date_end >= date_from)
+            ]
+        )
 
 
 class HrContract(models.Model):
@@ -32,6 +74,29 @@ class HrContract(models.Model):
         required=True, help="Employee's working schedule."
     )
 
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        res._force_payslips_recompute()
+        return res
+
+    def write(self, vals):
+        if "employee_id" in vals:
+            self._force_payslips_recompute()
+        res = super().write(vals)
+        self._force_payslips_recompute()
+        return res
+
+    def unlink(self):
+        self._force_payslips_recompute()
+        return super().unlink()
+
+    def _force_payslips_recompute(self):
+        # the contracts are read by the rules, see hr.payslip.recompute_keys
+        self.env["hr.payslip"]._force_full_recompute(
+            [("employee_id", "in", self.mapped("employee_id").ids)]
+        )
+
     def get_all_structures(self):
         """
         @return: the structures linked to the given contracts, ordered by
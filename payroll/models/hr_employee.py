@@ -1,6 +1,6 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class HrEmployee(models.Model):
@@ -18,3 +18,29 @@ class HrEmployee(models.Model):
     def _compute_payslip_count(self):
         for employee in self:
             employee.payslip_count = len(employee.slip_ids)
+
+    def write(self, vals):
+        res = super().write(vals)
+        if set(vals) & set(self._get_rule_fields()):
+            # the employees are read by the rules, see hr.payslip.recompute_keys
+            self.env["hr.payslip"]._force_full_recompute(
+                [("employee_id", "in", self.ids)]
+            )
+        return res
+
+    @api.model
+    def _get_rule_fields(self):
+        """
+        @return: the names of the fields of the employees which the salary
+                 rules can read: the stored fields, except the images and the
+                 fields of the messages and activities
+        """
+        ignored = set()
+        for model in ("mail.thread", "mail.activity.mixin", "avatar.mixin"):
+            if model in self.env:
+                ignored.update(self.env[model]._fields)
+        return [
+            name
+            for name, field in self._fields.items()
+            if field.store and field.type != "binary" and name not in ignored
+        ]
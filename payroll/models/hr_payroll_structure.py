@@ -1,8 +1,10 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
+from .execution_plan import ExecutionPlan
+
 
 class HrPayrollStructure(models.Model):
     """
@@ -14,6 +16,7 @@ class HrPayrollStructure(models.Model):
 
     _name = "hr.payroll.structure"
     _description = "Salary Structure"
+    _parent_store = True
 
     @api.model
     def _get_parent(self):
@@ -32,6 +35,7 @@ class HrPayrollStructure(models.Model):
     parent_id = fields.Many2one(
         "hr.payroll.structure", string="Parent", default=_get_parent
     )
+    parent_path = fields.Char(index=True, unaccent=False)
     children_ids = fields.One2many(
         "hr.payroll.structure", "parent_id", string="Children", copy=True
     )
@@ -62,6 +66,15 @@ class HrPayrollStructure(models.Model):
         if not self._check_recursion():
             raise ValidationError(_("You cannot create a recursive salary structure."))
 
+    def write(self, vals):
+        res = super().write(vals)
+        if "rule_ids" in vals:
+            # rules of the structures are part of the cached execution plans
+            self.clear_caches()
+        if {"rule_ids", "parent_id"} & set(vals):
+            self.env["hr.payslip"]._force_full_recompute()
+        return res
+
     @api.returns("self", lambda value: value.id)
     def copy(self, default=None):
         self.ensure_one()
@@ -79,7 +92,31 @@ class HrPayrollStructure(models.Model):
         return all_rules
 
     def _get_parent_structure(self):
-        parent = self.mapped("parent_id")
-        if parent:
-            parent = parent._get_parent_structure()
-        return parent + self
+        """
+        @return: the structures and their parents, the farthest parents first
+        """
+        # parents by distance to the structures, read from the parent paths
+        levels = []
+        for struct in self:
+            parent_ids = [int(id) for id in struct.parent_path.split("/")[-3::-1]]
+            for distance, parent_id in enumerate(parent_ids):
+                if distance == len(levels):
+                    levels.append([])
+                if parent_id not in levels[distance]:
+                    levels[distance].append(parent_id)
+        return self.browse([id for level in reversed(levels) for id in level]) + self
+
+    @tools.ormcache("tuple(sorted(self.ids))", "tuple(self.env.companies.ids)")
+    def _get_execution_plan(self):
+        """
+        @return: the ExecutionPlan of the rules to apply for these structures.
+                 The plan is cached per registry and invalidated whenever
+                 rules, categories, inputs or structure rules are modified.
+        """
+        structures = self.browse(sorted(self.ids))
+        rule_ids = [
+            id
+            for id, sequence in sorted(structures.get_all_rules(), key=lambda x: x[1])
+        ]
+        rules = self.env["hr.salary.rule"].browse(list(dict.fromkeys(rule_ids)))
+        return ExecutionPlan(structures, rules)
@@ -1,15 +1,18 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import json
 import logging
 import math
-from datetime import date, datetime, time
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
 
 import babel
 from dateutil.relativedelta import relativedelta
-from pytz import timezone
+from pytz import timezone, utc
 
 from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import split_every
 from odoo.tools.safe_eval import safe_eval
 
 from .base_browsable import (
@@ -17,8 +20,16 @@ from .base_browsable import (
     BrowsableObject,
     InputLine,
     Payslips,
+    PayslipsHistory,
     WorkedDays,
 )
+from . import parallel_compute, partitioning
+from .batch_engine import BatchEngine, numpy
+from .hr_contract import ContractIndex
+from .hr_salary_rule import HrSalaryRule
+from .payslip_capture import PayslipCapture
+from .query_count import count_queries
+from .rule_profiler import RuleProfiler
 
 _logger = logging.getLogger(__name__)
 
@@ -173,6 +184,12 @@ class HrPayslip(models.Model):
     prevent_compute_on_confirm = fields.Boolean(
         "Prevent Compute on Confirm", compute="_compute_prevent_compute_on_confirm"
     )
+    recompute_keys = fields.Text(
+        readonly=True,
+        copy=False,
+        help="Values modified since the last computation of the payslip, like "
+        "inputs.SALEURO. '*' means the whole payslip has to be computed again.",
+    )
 
     def _compute_allow_cancel_payslips(self):
         self.allow_cancel_payslips = (
@@ -274,31 +291,312 @@ class HrPayslip(models.Model):
         payslip.write({"refunded_id": safe_eval(res["domain"])[0][2][0] or False})
         return res
 
+    @api.model
+    def _get_full_recompute_fields(self):
+        # Modifying these fields requires to compute all the rules again
+        return [
+            "employee_id",
+            "contract_id",
+            "struct_id",
+            "date_from",
+            "date_to",
+            "credit_note",
+            "company_id",
+        ]
+
+    @api.model
+    def _get_ledger_fields(self):
+        # Modifying these fields on confirmed payslips updates the ledger
+        return [
+            "state",
+            "employee_id",
+            "date_from",
+            "date_to",
+            "credit_note",
+            "line_ids",
+            "input_line_ids",
+            "worked_days_line_ids",
+        ]
+
+    def write(self, vals):
+        if "recompute_keys" not in vals and set(vals) & set(
+            self._get_full_recompute_fields()
+        ):
+            vals = dict(vals, recompute_keys="*")
+        if not set(vals) & set(self._get_ledger_fields()):
+            return super().write(vals)
+        ledger_payslips = self.filtered(lambda payslip: payslip.state == "done")
+        res = super().write(vals)
+        ledger_payslips |= self.filtered(lambda payslip: payslip.state == "done")
+        self.env["hr.payslip.ledger"]._update_payslips(ledger_payslips)
+        if ledger_payslips:
+            # the confirmed payslips are read by the rules (payslips.sum...)
+            self._force_full_recompute(
+                [("employee_id", "in", ledger_payslips.mapped("employee_id").ids)]
+            )
+        return res
+
+    def _add_recompute_keys(self, keys):
+        """Record values modified on computed payslips, so the next
+        computation only evaluates the rules depending on them.
+        @param keys: keys like "inputs.SALEURO" or "worked_days.WORK100"
+        """
+        for payslip in self:
+            if payslip.state not in ("draft", "verify") or not payslip.line_ids:
+                continue
+            current = set((payslip.recompute_keys or "").split())
+            if "*" in current or set(keys) <= current:
+                continue
+            payslip.recompute_keys = " ".join(sorted(current | set(keys)))
+
+    @api.model
+    def _force_full_recompute(self, domain=None):
+        """Mark the payslips which are not confirmed to be computed entirely
+        at their next computation, after a modification of records read by
+        the rules which is not tracked in recompute_keys: contracts,
+        employees, salary rules, structures, categories, confirmed payslips.
+        Nothing is marked when the incremental recomputation is disabled, all
+        the payslips are marked when it is enabled, see res.config.settings.
+        @param domain: the payslips to mark, all of them by default
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        if not get_param("payroll.incremental_recompute"):
+            return
+        payslips = self.sudo().search(
+            [("state", "in", ("draft", "verify")), ("recompute_keys", "!=", "*")]
+            + (domain or [])
+        )
+        if payslips:
+            payslips.write({"recompute_keys": "*"})
+
+    def _get_incremental_lines(self, plan):
+        """
+        @return: None when all the rules of the payslip have to be computed,
+                 otherwise a tuple (affected rule ids, lines) where lines are
+                 the current payslip lines by (rule id, contract id), reused
+                 as they are for the rules which are not affected.
+        """
+        self.ensure_one()
+        keys = (self.recompute_keys or "").split()
+        if not self.env.context.get("payroll_incremental") or not keys or "*" in keys:
+            return None
+        return (
+            plan.get_affected_rule_ids(keys),
+            {
+                (line.salary_rule_id.id, line.contract_id.id): line
+                for line in self.line_ids
+            },
+        )
+
     def unlink(self):
-        if any(self.filtered(lambda payslip: payslip.state not in ("draft", "cancel"))):
+        # confirmed payslips are deleted once archived, see hr.payslip.archive
+        if not self.env.context.get("payroll_archive") and any(
+            self.filtered(lambda payslip: payslip.state not in ("draft", "cancel"))
+        ):
             raise UserError(
                 _("You cannot delete a payslip which is not draft or cancelled")
             )
         return super(HrPayslip, self).unlink()
 
+    @count_queries("compute_sheet", lambda self: self)
     def compute_sheet(self):
+        payslips = self.with_context(**self._get_compute_context())
+        lines_dicts = payslips._compute_lines_dicts()
+        payslips._write_lines_dicts(lines_dicts)
+        profiler = payslips.env.context.get("payroll_profiler")
+        if profiler:
+            self.env["hr.payslip.rule.profile"]._add_profiler(profiler)
+        return True
+
+    @api.model
+    def _get_compute_context(self):
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        context = {
+            "payroll_incremental": bool(get_param("payroll.incremental_recompute"))
+        }
+        if get_param("payroll.profile_rules") and not self.env.context.get(
+            "payroll_profiler"
+        ):
+            # timings of the rules, see hr.payslip.rule.profile
+            context["payroll_profiler"] = RuleProfiler()
+        return context
+
+    def _compute_lines_dicts(self):
+        """
+        @return: a dict {payslip id: lines dict} of the computed payslips,
+                 without writing them
+        """
+        payslips = self
+        if len(self) > 1 and "payroll_history" not in self.env.context:
+            # history lookups of the rules are done for all employees at once
+            history = PayslipsHistory(self.mapped("employee_id").ids)
+            payslips = self.with_context(payroll_history=history)
+        if len(self) > 1 and "payroll_contracts" not in self.env.context:
+            payslips = payslips.with_context(
+                payroll_contracts=self._get_contract_index()
+            )
+        res = payslips._get_batch_lines_dicts()
+        for payslip in payslips:
+            if payslip.id not in res:
+                res[payslip.id] = payslip.get_lines_dict()
+        return res
+
+    def _write_lines_dicts(self, lines_dicts):
+        """
+        Write the computed lines of the payslips. When enabled in the settings,
+        the lines of the payslips without lines yet are inserted in bulk, see
+        hr.payslip.line._insert_lines().
+        @param lines_dicts: a dict {payslip id: lines dict}
+        """
+        bulk_insert = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.bulk_insert_lines")
+        )
+        new_payslips = self.browse()
+        if bulk_insert:
+            new_payslips = self.filtered(lambda payslip: not payslip.line_ids)
+            self.env["hr.payslip.line"]._insert_lines(
+                [
+                    dict(vals, slip_id=payslip.id)
+                    for payslip in new_payslips
+                    for vals in lines_dicts[payslip.id].values()
+                ]
+            )
         for payslip in self:
-            # delete old payslip lines
-            payslip.line_ids.unlink()
-            # write payslip lines
-            number = payslip.number or self.env["ir.sequence"].next_by_code(
-                "salary.slip"
+            if payslip in new_payslips:
+                payslip.write(payslip._get_computed_values())
+            else:
+                payslip._write_lines_dict(lines_dicts[payslip.id])
+
+    def _write_lines_dict(self, lines_dict):
+        self.ensure_one()
+        self.write(
+            dict(
+                self._get_computed_values(),
+                line_ids=self._get_line_commands(lines_dict),
             )
-            lines = [(0, 0, line) for line in list(payslip.get_lines_dict().values())]
-            payslip.write(
-                {
-                    "line_ids": lines,
-                    "number": number,
-                    "state": "verify",
-                    "compute_date": fields.Date.today(),
-                }
+        )
+
+    def _get_computed_values(self):
+        """
+        @return: the values written on the payslip when its lines are computed
+        """
+        self.ensure_one()
+        number = self.number or self.env["ir.sequence"].next_by_code("salary.slip")
+        return {
+            "number": number,
+            "state": "verify",
+            "compute_date": fields.Date.today(),
+            "recompute_keys": False,
+        }
+
+    def _compute_sheet_parallel(self, workers, chunk_size):
+        """Compute the payslips in chunks, in parallel worker processes. The
+        computed lines are written in the order of the payslips, chunks that
+        failed are not written.
+        @return: a list of tuples (payslips, exception) of the failed chunks
+        """
+        payslips = self.with_context(**self._get_compute_context())
+        failures = []
+        for payslip_ids, result in parallel_compute.compute_chunks(
+            payslips.env, payslips.ids, workers, chunk_size
+        ):
+            chunk = payslips.browse(payslip_ids)
+            if isinstance(result, Exception):
+                failures.append((chunk, result))
+                continue
+            chunk._write_lines_dicts(result)
+        profiler = payslips.env.context.get("payroll_profiler")
+        if profiler:
+            # the measures of the workers, see parallel_compute.compute_chunks()
+            self.env["hr.payslip.rule.profile"]._add_profiler(profiler)
+        return failures
+
+    def _get_batch_lines_dicts(self):
+        """Compute the payslips with the vectorized batch engine when it is
+        enabled in the settings, see batch_engine.BatchEngine.
+
+        Payslips with several contracts, or recomputed incrementally, are not
+        computed by the engine.
+        @return: a dict {payslip id: lines dict} of the computed payslips
+        """
+        batch_engine = (
+            self.env["ir.config_parameter"].sudo().get_param("payroll.batch_engine")
+        )
+        if len(self) < 2 or not batch_engine or not self._can_use_batch_engine():
+            return {}
+        if self.env.context.get("payroll_profiler"):
+            # the rules are profiled one by one in get_lines_dict()
+            return {}
+        rows_by_plan = {}
+        for payslip in self:
+            contracts = payslip._get_employee_contracts()
+            if len(contracts) != 1:
+                continue
+            plan = payslip._get_execution_plan(contracts)
+            if payslip._get_incremental_lines(plan) is not None:
+                continue
+            rows_by_plan.setdefault(plan, []).append((payslip, contracts))
+        res = {}
+        for plan, rows in rows_by_plan.items():
+            res.update(BatchEngine(plan, rows).compute())
+        return res
+
+    @api.model
+    def _can_use_batch_engine(self):
+        """The batch engine reimplements the computation of the fixed and
+        percentage rules, it is not used when numpy is missing or when the
+        methods it replaces are overridden."""
+        if numpy is None:
+            return False
+        rule_class = type(self.env["hr.salary.rule"])
+        return all(
+            getattr(type(self), name) is getattr(HrPayslip, name)
+            for name in (
+                "get_lines_dict",
+                "_compute_payslip_line",
+                "_get_lines_dict",
+                "_sum_salary_rule_category",
             )
-        return True
+        ) and all(
+            getattr(rule_class, name) is getattr(HrSalaryRule, name)
+            for name in (
+                "_satisfy_condition",
+                "_satisfy_condition_range",
+                "_compute_rule",
+                "_compute_rule_fix",
+                "_compute_rule_percentage",
+                "_eval_rule_code",
+            )
+        )
+
+    def _get_line_commands(self, lines_dict):
+        """
+        @param lines_dict: the computed lines, as returned by get_lines_dict()
+        @return: the commands to write on line_ids. Current lines are matched
+                 with the computed lines by rule and contract: only lines with
+                 different values are updated, new lines are created and the
+                 lines which were not computed again are deleted.
+        """
+        self.ensure_one()
+        current_lines = {}
+        for line in self.line_ids:
+            key = (line.salary_rule_id.id, line.contract_id.id)
+            current_lines.setdefault(key, line)
+        kept_lines = self.env["hr.payslip.line"]
+        update_commands = []
+        for vals in lines_dict.values():
+            key = (vals["salary_rule_id"], vals["contract_id"])
+            line = current_lines.pop(key, None)
+            if not line:
+                update_commands.append((0, 0, vals))
+                continue
+            kept_lines |= line
+            changed_vals = line._get_changed_values(vals)
+            if changed_vals:
+                update_commands.append((1, line.id, changed_vals))
+        return [(2, line.id) for line in self.line_ids - kept_lines] + update_commands
 
     @api.model
     def get_worked_day_lines(self, contracts, date_from, date_to):
@@ -307,20 +605,22 @@ class HrPayslip(models.Model):
         @return: returns a list of dict containing the input that should be
         applied for the given contract between date_from and date_to
         """
+        # lines computed in bulk beforehand, see get_worked_day_lines_batch
+        worked_days = self.env.context.get("payroll_worked_days") or {}
         res = []
         for contract in contracts.filtered(
             lambda contract: contract.resource_calendar_id
         ):
-            day_from = datetime.combine(date_from, time.min)
-            day_to = datetime.combine(date_to, time.max)
-            day_contract_start = datetime.combine(contract.date_start, time.min)
+            if (contract.id, date_from, date_to) in worked_days:
+                res.extend(worked_days[contract.id, date_from, date_to])
+                continue
+            day_from, day_to = self._get_worked_days_period(
+                contract, date_from, date_to
+            )
             # Support for the hr_public_holidays module.
             contract = contract.with_context(
                 employee_id=self.employee_id.id, exclude_public_holidays=True
             )
-            # only use payslip day_from if it's greather than contract start date
-            if day_from < day_contract_start:
-                day_from = day_contract_start
             # == compute leave days == #
             leaves = self._compute_leave_days(contract, day_from, day_to)
             res.extend(leaves)
@@ -329,20 +629,134 @@ class HrPayslip(models.Model):
             res.append(attendances)
         return res
 
+    @api.model
+    def _get_worked_days_period(self, contract, date_from, date_to):
+        """
+        @return: the datetimes between which the worked days of the contract
+                 are computed
+        """
+        day_from = datetime.combine(date_from, time.min)
+        day_to = datetime.combine(date_to, time.max)
+        day_contract_start = datetime.combine(contract.date_start, time.min)
+        # only use payslip day_from if it's greather than contract start date
+        if day_from < day_contract_start:
+            day_from = day_contract_start
+        return day_from, day_to
+
+    @api.model
+    def get_worked_day_lines_batch(self, contract_periods):
+        """
+        Worked days of many contracts at once, with one leave and one work
+        time computation per calendar and period instead of one per contract.
+        @param contract_periods: list of tuples (contract, date_from, date_to)
+        @return: a dict mapping (contract id, date_from, date_to) to the list of
+                 dict returned by get_worked_day_lines for the contract
+        """
+        # work hours by day shared by all the calendars, see _get_leave_days_lines
+        self = self.with_context(
+            payroll_work_hours=self.env.context.get("payroll_work_hours", {})
+        )
+        res = {}
+        can_batch = self._can_batch_worked_days()
+        # the public holidays excluded from the worked days depend on the
+        # employee with the hr_holidays_public module
+        by_employee = "hr.holidays.public" in self.env
+        groups = defaultdict(lambda: self.env["hr.contract"])
+        for contract, date_from, date_to in contract_periods:
+            key = (contract.id, date_from, date_to)
+            if not can_batch:
+                res[key] = self.get_worked_day_lines(contract, date_from, date_to)
+                continue
+            res[key] = []
+            if not contract.resource_calendar_id:
+                continue
+            day_from, day_to = self._get_worked_days_period(
+                contract, date_from, date_to
+            )
+            calendar = contract.resource_calendar_id
+            employee_id = contract.employee_id.id if by_employee else False
+            key = (calendar, day_from, day_to, date_from, date_to, employee_id)
+            groups[key] |= contract
+        for key, contracts in groups.items():
+            calendar, day_from, day_to, date_from, date_to, employee_id = key
+            # Support for the hr_public_holidays module, the intervals are
+            # computed by the calendar
+            context = {"exclude_public_holidays": True, "employee_id": employee_id}
+            contracts = contracts.with_context(**context)
+            calendar = calendar.with_context(**context)
+            leaves = self._compute_leave_days_batch(
+                contracts, calendar, day_from, day_to
+            )
+            worked_days = self._compute_worked_days_batch(
+                contracts, calendar, day_from, day_to
+            )
+            for contract in contracts:
+                res[contract.id, date_from, date_to] = leaves[contract.id] + [
+                    worked_days[contract.id]
+                ]
+        return res
+
+    @api.model
+    def _can_batch_worked_days(self):
+        """get_worked_day_lines_batch reimplements the computation of the
+        leaves and worked days, it is not used when it is overridden."""
+        return all(
+            getattr(type(self), name) is getattr(HrPayslip, name)
+            for name in ("_compute_leave_days", "_compute_worked_days")
+        )
+
     def _compute_leave_days(self, contract, day_from, day_to):
         """
         Leave days computation
         @return: returns a list containing the leave inputs for the period
         of the payslip. One record per leave type.
         """
+        day_leave_intervals = contract.employee_id.list_leaves(
+            day_from, day_to, calendar=contract.resource_calendar_id
+        )
+        return self._get_leave_days_lines(contract, day_leave_intervals)
+
+    @api.model
+    def _compute_leave_days_batch(self, contracts, calendar, day_from, day_to):
+        """
+        Leave days computation of contracts sharing the same calendar, see
+        resource.mixin.list_leaves
+        @return: a dict mapping the contract ids to their leave inputs
+        """
+        resources = contracts.mapped("employee_id.resource_id")
+        from_datetime = utc.localize(day_from)
+        to_datetime = utc.localize(day_to)
+        attendances = calendar._attendance_intervals_batch(
+            from_datetime, to_datetime, resources
+        )
+        leaves = calendar._leave_intervals_batch(from_datetime, to_datetime, resources)
+        res = {}
+        for contract in contracts:
+            resource = contract.employee_id.resource_id
+            intervals = leaves[resource.id] & attendances[resource.id]
+            day_leave_intervals = [
+                (start.date(), (stop - start).total_seconds() / 3600, leave)
+                for start, stop, leave in intervals
+            ]
+            res[contract.id] = self._get_leave_days_lines(
+                contract, day_leave_intervals
+            )
+        return res
+
+    @api.model
+    def _get_leave_days_lines(self, contract, day_leave_intervals):
+        """
+        @param day_leave_intervals: list of tuples (day, hours, leave) as
+                                    returned by list_leaves
+        @return: returns a list containing the leave inputs, one per leave type
+        """
         leaves_positive = (
             self.env["ir.config_parameter"].sudo().get_param("payroll.leaves_positive")
         )
         leaves = {}
         calendar = contract.resource_calendar_id
-        tz = timezone(calendar.tz)
-        day_leave_intervals = contract.employee_id.list_leaves(
-            day_from, day_to, calendar=contract.resource_calendar_id
+        work_hours = self._get_calendar_work_hours(
+            calendar, {day for day, hours, leave in day_leave_intervals}
         )
         for day, hours, leave in day_leave_intervals:
             holiday = leave[:1].holiday_id
@@ -361,17 +775,51 @@ class HrPayslip(models.Model):
                 current_leave_struct["number_of_hours"] += hours
             else:
                 current_leave_struct["number_of_hours"] -= hours
-            work_hours = calendar.get_work_hours_count(
-                tz.localize(datetime.combine(day, time.min)),
-                tz.localize(datetime.combine(day, time.max)),
-                compute_leaves=False,
-            )
-            if work_hours:
+            day_hours = work_hours[calendar.id, calendar.tz, day]
+            if day_hours:
                 if leaves_positive:
-                    current_leave_struct["number_of_days"] += hours / work_hours
+                    current_leave_struct["number_of_days"] += hours / day_hours
                 else:
-                    current_leave_struct["number_of_days"] -= hours / work_hours
-        return leaves.values()
+                    current_leave_struct["number_of_days"] -= hours / day_hours
+        return list(leaves.values())
+
+    @api.model
+    def _get_calendar_work_hours(self, calendar, days):
+        """
+        Expected work hours of the calendar by day, leaves excluded, as
+        computed by get_work_hours_count from the start to the end of the day.
+        The hours are cached in the dict of the payroll_work_hours context key,
+        shared by the payslips of a batch, and the missing days are computed
+        with one attendance query from the first to the last of them.
+        @param days: the days whose work hours are needed
+        @return: a dict mapping (calendar id, timezone, day) to the work hours
+        """
+        work_hours = self.env.context.get("payroll_work_hours", {})
+        missing = {
+            day for day in days if (calendar.id, calendar.tz, day) not in work_hours
+        }
+        if not missing:
+            return work_hours
+        tz = timezone(calendar.tz)
+        first_day, last_day = min(missing), max(missing)
+        hours = {
+            first_day + timedelta(days=offset): 0.0
+            for offset in range((last_day - first_day).days + 1)
+        }
+        intervals = calendar._attendance_intervals_batch(
+            tz.localize(datetime.combine(first_day, time.min)),
+            tz.localize(datetime.combine(last_day, time.max)),
+        )[False]
+        for start, stop, _meta in intervals:
+            # split the intervals spanning midnight between their days
+            while start < stop:
+                day = start.astimezone(tz).date()
+                day_end = tz.localize(datetime.combine(day, time.max))
+                hours[day] += (min(stop, day_end) - start).total_seconds() / 3600
+                start = tz.localize(datetime.combine(day + timedelta(days=1), time.min))
+        for day, day_hours in hours.items():
+            work_hours.setdefault((calendar.id, calendar.tz, day), day_hours)
+        return work_hours
 
     def _compute_worked_days(self, contract, day_from, day_to):
         """
@@ -395,6 +843,27 @@ class HrPayslip(models.Model):
             "contract_id": contract.id,
         }
 
+    @api.model
+    def _compute_worked_days_batch(self, contracts, calendar, day_from, day_to):
+        """
+        Worked days computation of contracts sharing the same calendar
+        @return: a dict mapping the contract ids to their worked days
+        """
+        work_data = contracts.mapped("employee_id")._get_work_days_data_batch(
+            day_from, day_to, calendar=calendar, compute_leaves=False
+        )
+        return {
+            contract.id: {
+                "name": _("Normal Working Days paid at 100%"),
+                "sequence": 1,
+                "code": "WORK100",
+                "number_of_days": work_data[contract.employee_id.id]["days"],
+                "number_of_hours": work_data[contract.employee_id.id]["hours"],
+                "contract_id": contract.id,
+            }
+            for contract in contracts
+        }
+
     @api.model
     def get_inputs(self, contracts, date_from, date_to):
         # TODO: We leave date_from and date_to params here for backwards
@@ -411,19 +880,17 @@ class HrPayslip(models.Model):
         structure_ids = contracts.get_all_structures()
         if current_structure:
             structure_ids = list(set(current_structure._get_parent_structure().ids))
-        rule_ids = (
-            self.env["hr.payroll.structure"].browse(structure_ids).get_all_rules()
-        )
-        sorted_rule_ids = [id for id, sequence in sorted(rule_ids, key=lambda x: x[1])]
-        payslip_inputs = (
-            self.env["hr.salary.rule"].browse(sorted_rule_ids).mapped("input_ids")
+        plan = (
+            self.env["hr.payroll.structure"]
+            .browse(structure_ids)
+            ._get_execution_plan()
         )
         for contract in contracts:
-            for payslip_input in payslip_inputs:
+            for name, code in plan.inputs:
                 res.append(
                     {
-                        "name": payslip_input.name,
-                        "code": payslip_input.code,
+                        "name": name,
+                        "code": code,
                         "contract_id": contract.id,
                     }
                 )
@@ -521,26 +988,53 @@ class HrPayslip(models.Model):
         rule_obj = self.env["hr.salary.rule"]
         sorted_rules = rule_obj
         for payslip in self:
-            contracts = payslip._get_employee_contracts()
-            if len(contracts) == 1 and payslip.struct_id:
-                structure_ids = list(set(payslip.struct_id._get_parent_structure().ids))
-            else:
-                structure_ids = contracts.get_all_structures()
-            rule_ids = (
-                self.env["hr.payroll.structure"].browse(structure_ids).get_all_rules()
-            )
-            sorted_rule_ids = [
-                id for id, sequence in sorted(rule_ids, key=lambda x: x[1])
-            ]
-            sorted_rules |= rule_obj.browse(sorted_rule_ids)
+            sorted_rules |= rule_obj.browse(payslip._get_execution_plan().rule_ids)
         return sorted_rules
 
+    def _get_execution_plan(self, contracts=None):
+        """
+        @param contracts: contracts of the payslip, fetched if not given
+        @return: the cached ExecutionPlan of the structures of the payslip
+        """
+        self.ensure_one()
+        if contracts is None:
+            contracts = self._get_employee_contracts()
+        if len(contracts) == 1 and self.struct_id:
+            structure_ids = self.struct_id._get_parent_structure().ids
+        else:
+            structure_ids = contracts.get_all_structures()
+        return (
+            self.env["hr.payroll.structure"]
+            .browse(structure_ids)
+            ._get_execution_plan()
+        )
+
     def _compute_payslip_line(self, rule, localdict, lines_dict):
         self.ensure_one()
         # check if there is already a rule computed with that code
         previous_amount = rule.code in localdict and localdict[rule.code] or 0.0
         # compute the rule to get some values for the payslip line
-        values = rule._compute_rule(localdict)
+        profiler = self.env.context.get("payroll_profiler")
+        if profiler:
+            values = profiler.compute_rule(self, rule, localdict)
+        else:
+            values = rule._compute_rule(localdict)
+        key = (rule.code or "id" + str(rule.id)) + "-" + str(localdict["contract"].id)
+        return self._get_lines_dict(
+            rule, localdict, lines_dict, key, values, previous_amount
+        )
+
+    def _reuse_payslip_line(self, rule, line, localdict, lines_dict):
+        """Same as _compute_payslip_line(), using the values of an existing
+        payslip line instead of evaluating the rule again."""
+        self.ensure_one()
+        previous_amount = rule.code in localdict and localdict[rule.code] or 0.0
+        values = {
+            "name": line.name,
+            "quantity": line.quantity,
+            "rate": line.rate,
+            "amount": line.amount,
+        }
         key = (rule.code or "id" + str(rule.id)) + "-" + str(localdict["contract"].id)
         return self._get_lines_dict(
             rule, localdict, lines_dict, key, values, previous_amount
@@ -561,30 +1055,37 @@ class HrPayslip(models.Model):
             localdict, rule.category_id, total - previous_amount
         )
         # create/overwrite the line in the temporary results
-        line_dict = {
+        line_dict = dict(
+            self._get_rule_line_values(rule),
+            employee_id=localdict["employee"].id,
+            contract_id=localdict["contract"].id,
+        )
+        line_dict.update(values)
+        lines_dict[key] = line_dict
+        return localdict, lines_dict
+
+    @api.model
+    def _get_rule_line_values(self, rule):
+        """
+        @param rule: Browse record of hr.salary.rule
+        @return: the values of the payslip lines copied from the rule
+        """
+        return {
             "salary_rule_id": rule.id,
-            "employee_id": localdict["employee"].id,
-            "contract_id": localdict["contract"].id,
             "code": rule.code,
             "category_id": rule.category_id.id,
             "sequence": rule.sequence,
             "appears_on_payslip": rule.appears_on_payslip,
             "parent_rule_id": rule.parent_rule_id.id,
             "condition_select": rule.condition_select,
-            "condition_python": rule.condition_python,
-            "condition_range": rule.condition_range,
             "condition_range_min": rule.condition_range_min,
             "condition_range_max": rule.condition_range_max,
             "amount_select": rule.amount_select,
             "amount_fix": rule.amount_fix,
-            "amount_python_compute": rule.amount_python_compute,
             "amount_percentage": rule.amount_percentage,
-            "amount_percentage_base": rule.amount_percentage_base,
+            "revision_id": rule.revision_id.id,
             "register_id": rule.register_id.id,
         }
-        line_dict.update(values)
-        lines_dict[key] = line_dict
-        return localdict, lines_dict
 
     @api.model
     def _get_payslip_lines(self, _contract_ids, payslip_id):
@@ -596,10 +1097,17 @@ class HrPayslip(models.Model):
 
     def get_lines_dict(self):
         lines_dict = {}
-        blacklist = []
+        blacklist = set()
+        profiler = self.env.context.get("payroll_profiler")
+        capture = self.env.context.get("payroll_capture")
         for payslip in self:
             contracts = payslip._get_employee_contracts()
+            plan = payslip._get_execution_plan(contracts)
+            rules = self.env["hr.salary.rule"].browse(plan.rule_ids)
+            incremental = payslip._get_incremental_lines(plan)
             baselocaldict = payslip._get_baselocaldict(contracts)
+            if capture:
+                baselocaldict = capture.wrap_localdict(baselocaldict)
             for contract in contracts:
                 # assign "current_contract" dict
                 baselocaldict["current_contract"] = BrowsableObject(
@@ -614,19 +1122,35 @@ class HrPayslip(models.Model):
                     contract=contract,
                     payslip=payslip,
                 )
-                for rule in payslip._get_salary_rules():
+                if capture:
+                    localdict = capture.wrap_contract_localdict(localdict)
+                for rule in rules:
                     localdict = rule._reset_localdict_values(localdict)
+                    if incremental and rule.id not in incremental[0]:
+                        # the rule does not depend on the modified values,
+                        # reuse its line or skip it as in the last computation
+                        line = incremental[1].get((rule.id, contract.id))
+                        if line and rule.id not in blacklist:
+                            localdict, _dict = payslip._reuse_payslip_line(
+                                rule, line, localdict, lines_dict
+                            )
+                            lines_dict.update(_dict)
+                        else:
+                            blacklist |= plan.blacklists[rule.id]
+                        continue
                     # check if the rule can be applied
-                    if rule._satisfy_condition(localdict) and rule.id not in blacklist:
+                    if profiler:
+                        satisfied = profiler.satisfy_condition(payslip, rule, localdict)
+                    else:
+                        satisfied = rule._satisfy_condition(localdict)
+                    if satisfied and rule.id not in blacklist:
                         localdict, _dict = payslip._compute_payslip_line(
                             rule, localdict, lines_dict
                         )
                         lines_dict.update(_dict)
                     else:
                         # blacklist this rule and its children
-                        blacklist += [
-                            id for id, seq in rule._recursive_search_of_rules()
-                        ]
+                        blacklist |= plan.blacklists[rule.id]
                 # call localdict_hook
                 localdict = payslip.localdict_hook(localdict)
                 # reset "current_contract" dict
@@ -639,6 +1163,7 @@ class HrPayslip(models.Model):
         # and is intedend to be inherited to access localdict from other functions.
         return localdict
 
+    @count_queries("get_payslip_vals")
     def get_payslip_vals(
         self, date_from, date_to, employee_id=False, contract_id=False, struct_id=False
     ):
@@ -659,15 +1184,9 @@ class HrPayslip(models.Model):
             return res
         # We check if contract_id is present, if not we fill with the
         # first contract of the employee. If not contract present, we return.
-        if not self.env.context.get("contract"):
-            contract_ids = employee.contract_id.ids
-        else:
-            if contract_id:
-                contract_ids = [contract_id]
-            else:
-                contract_ids = employee._get_contracts(
-                    date_from=date_from, date_to=date_to
-                ).ids
+        contract_ids = self._get_payslip_contracts(
+            employee, date_from, date_to, contract_id
+        ).ids
         if not contract_ids:
             return res
         contract = self.env["hr.contract"].browse(contract_ids[0])
@@ -693,29 +1212,142 @@ class HrPayslip(models.Model):
         )
         return res
 
+    @api.model
+    def _get_payslip_contracts(self, employee, date_from, date_to, contract_id=False):
+        """
+        @return: the contracts of the payslip of the employee, see
+                 get_payslip_vals
+        """
+        if not self.env.context.get("contract"):
+            return employee.contract_id
+        if contract_id:
+            return self.env["hr.contract"].browse(contract_id)
+        index = self.env.context.get("payroll_contracts")
+        contracts = index and index.get_contracts(employee, date_from, date_to)
+        if contracts is None:
+            contracts = employee._get_contracts(date_from=date_from, date_to=date_to)
+        return contracts
+
+    @api.model
+    def _get_payslip_vals_batch(self, employees, date_from, date_to, struct_id=False):
+        """
+        get_payslip_vals of many employees at once, the contracts, worked days
+        and inputs are resolved in bulk.
+        @return: a dict mapping the employee ids to the values of the payslips,
+                 as in the "value" key returned by get_payslip_vals
+        """
+        self = self.with_context(
+            payroll_contracts=self.env.context.get("payroll_contracts")
+            or ContractIndex(employees, date_from, date_to),
+            payroll_work_hours=self.env.context.get("payroll_work_hours", {}),
+        )
+        contracts = {
+            employee.id: self._get_payslip_contracts(employee, date_from, date_to)
+            for employee in employees
+        }
+        worked_days = self.get_worked_day_lines_batch(
+            [
+                (contract, date_from, date_to)
+                for employee_contracts in contracts.values()
+                if struct_id or employee_contracts[:1].struct_id
+                for contract in employee_contracts
+            ]
+        )
+        self = self.with_context(payroll_worked_days=worked_days)
+        if not self._can_batch_payslip_vals():
+            return {
+                employee.id: self.get_payslip_vals(
+                    date_from, date_to, employee.id, struct_id=struct_id
+                )["value"]
+                for employee in employees
+            }
+        # the inputs only depend on the structures of the contracts
+        inputs = {}
+        res = {}
+        for employee in employees:
+            employee_contracts = contracts[employee.id]
+            value = res[employee.id] = {
+                "line_ids": [],
+                "input_line_ids": [],
+                "worked_days_line_ids": [],
+                "name": "",
+                "contract_id": employee_contracts[:1].id,
+                "struct_id": False,
+            }
+            if employee_contracts:
+                value["struct_id"] = (
+                    struct_id[0] if struct_id else employee_contracts[0].struct_id.id
+                )
+            if not value["struct_id"]:
+                continue
+            value["worked_days_line_ids"] = [
+                line
+                for contract in employee_contracts
+                for line in worked_days[contract.id, date_from, date_to]
+            ]
+            key = tuple(employee_contracts.mapped("struct_id").ids)
+            if key not in inputs:
+                inputs[key] = (
+                    self.env["hr.payroll.structure"]
+                    .browse(employee_contracts.get_all_structures())
+                    ._get_execution_plan()
+                    .inputs
+                )
+            value["input_line_ids"] = [
+                {"name": name, "code": code, "contract_id": contract.id}
+                for contract in employee_contracts
+                for name, code in inputs[key]
+            ]
+        return res
+
+    @api.model
+    def _can_batch_payslip_vals(self):
+        """_get_payslip_vals_batch reimplements get_payslip_vals, it is not
+        used when the methods it replaces are overridden."""
+        return all(
+            getattr(type(self), name) is getattr(HrPayslip, name)
+            for name in ("get_payslip_vals", "get_worked_day_lines", "get_inputs")
+        )
+
     def _sum_salary_rule_category(self, localdict, category, amount):
         self.ensure_one()
-        if category.parent_id:
-            localdict = self._sum_salary_rule_category(
-                localdict, category.parent_id, amount
-            )
-        if category.code:
-            localdict["categories"].dict[category.code] = (
-                localdict["categories"].dict.get(category.code, 0) + amount
+        if not category:
+            return localdict
+        for code in category._get_ancestor_codes():
+            localdict["categories"].dict[code] = (
+                localdict["categories"].dict.get(code, 0) + amount
             )
         return localdict
 
     def _get_employee_contracts(self):
         contracts = self.env["hr.contract"]
+        index = self.env.context.get("payroll_contracts")
         for payslip in self:
             if payslip.contract_id.ids:
                 contracts |= payslip.contract_id
-            else:
-                contracts |= payslip.employee_id._get_contracts(
+                continue
+            employee_contracts = index and index.get_contracts(
+                payslip.employee_id, payslip.date_from, payslip.date_to
+            )
+            if employee_contracts is None:
+                employee_contracts = payslip.employee_id._get_contracts(
                     date_from=payslip.date_from, date_to=payslip.date_to
                 )
+            contracts |= employee_contracts
         return contracts
 
+    def _get_contract_index(self):
+        """
+        @return: a ContractIndex of the employees of the payslips over their
+                 periods, to be set as payroll_contracts context key
+        """
+        payslips = self.filtered(lambda payslip: payslip.date_from and payslip.date_to)
+        return ContractIndex(
+            payslips.mapped("employee_id"),
+            min(payslips.mapped("date_from"), default=date.max),
+            max(payslips.mapped("date_to"), default=date.min),
+        )
+
     @api.onchange("struct_id")
     def onchange_struct_id(self):
         for payslip in self:
@@ -753,6 +1385,11 @@ class HrPayslip(models.Model):
                 or (not payslip.date_to)
             ):
                 continue
+            if "payroll_contracts" not in payslip.env.context:
+                # the contracts are resolved again by the onchange methods below
+                payslip = payslip.with_context(
+                    payroll_contracts=payslip._get_contract_index()
+                )
             # Assign contract_id automatically when the user don't selected one.
             if not payslip.env.context.get("contract") or not payslip.contract_id:
                 contract_ids = payslip._get_employee_contracts().ids
@@ -774,17 +1411,34 @@ class HrPayslip(models.Model):
             payslip.company_id = payslip.employee_id.company_id
 
     def _compute_name(self):
+        months = {}
         for record in self:
-            record.name = _("Salary Slip of %(name)s for %(dt)s") % {
-                "name": record.employee_id.name,
-                "dt": tools.ustr(
-                    babel.dates.format_date(
-                        date=datetime.combine(record.date_from, time.min),
-                        format="MMMM-y",
-                        locale=record.env.context.get("lang") or "en_US",
-                    )
-                ),
-            }
+            record.name = record._get_payslip_name(
+                record.employee_id, record.date_from, months
+            )
+
+    @api.model
+    def _get_payslip_name(self, employee, date_from, months=None):
+        """
+        @param months: dict caching the formatted months by date and language,
+                       shared by the payslips named together
+        @return: the name of the payslip of the employee
+        """
+        if months is None:
+            months = {}
+        lang = self.env.context.get("lang") or "en_US"
+        if (date_from, lang) not in months:
+            months[date_from, lang] = tools.ustr(
+                babel.dates.format_date(
+                    date=datetime.combine(date_from, time.min),
+                    format="MMMM-y",
+                    locale=lang,
+                )
+            )
+        return _("Salary Slip of %(name)s for %(dt)s") % {
+            "name": employee.name,
+            "dt": months[date_from, lang],
+        }
 
     @api.onchange("contract_id")
     def onchange_contract(self):
@@ -800,3 +1454,110 @@ class HrPayslip(models.Model):
             return line[0].total
         else:
             return 0.0
+
+    @api.model
+    def _get_partition_granularity(self):
+        granularity = (
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.partition_granularity")
+        )
+        return granularity if granularity in partitioning.GRANULARITIES else False
+
+    @api.model
+    def _get_partition_blockers(self):
+        """
+        @return: the foreign keys of other tables referencing the tables to
+                 partition, which prevent their partitioning
+        """
+        return [
+            name
+            for table in partitioning.PARTITIONED_TABLES
+            if not partitioning.is_partitioned(self.env.cr, table)
+            for name in partitioning.get_referencing_foreign_keys(self.env.cr, table)
+        ]
+
+    @api.model
+    def _partition_tables(self):
+        """Partition the tables of the payslip lines, worked days and inputs by
+        date_from, according to the partition_granularity setting, and create
+        their partitions up to one year ahead. Called by a daily cron, which
+        is triggered when the setting is saved: the rows of the tables are
+        copied, with the tables locked.
+        """
+        granularity = self._get_partition_granularity()
+        if not granularity:
+            return
+        cr = self.env.cr
+        referencing = self._get_partition_blockers()
+        if referencing:
+            _logger.error(
+                "The payslip lines cannot be partitioned, they are referenced "
+                "by the foreign keys %s",
+                ", ".join(referencing),
+            )
+            return
+        today = fields.Date.context_today(self)
+        date_to = today + relativedelta(years=1)
+        self.env.flush_all()
+        for table in partitioning.PARTITIONED_TABLES:
+            if partitioning.is_partitioned(cr, table):
+                partitioning.create_partitions(cr, table, granularity, today, date_to)
+            else:
+                partitioning.partition_table(cr, table, granularity, date_to)
+        self.env.invalidate_all()
+
+    @api.model
+    def _archive_old_payslips(self):
+        """Archive the confirmed payslips ended for more months than the
+        archive_months setting, see hr.payslip.archive. Called by a daily cron.
+        @return: the archives created
+        """
+        months = int(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("payroll.archive_months", 0)
+        )
+        Archive = self.env["hr.payslip.archive"]
+        if months <= 0:
+            return Archive
+        date_to = fields.Date.context_today(self) - relativedelta(months=months)
+        payslips = self.search([("state", "=", "done"), ("date_to", "<", date_to)])
+        archives = Archive
+        for payslip_ids in split_every(1000, payslips.ids):
+            archives |= Archive._archive_payslips(self.browse(payslip_ids))
+        return archives
+
+    def _capture_computation(self):
+        """Compute the lines of the payslip, without writing them, recording
+        the values read by the rules, see payslip_capture.py
+        @return: the snapshot of the computation, a JSON serializable dict
+        """
+        self.ensure_one()
+        capture = PayslipCapture()
+        contracts = self._get_employee_contracts()
+        plan = self._get_execution_plan(contracts)
+        lines_dict = self.with_context(
+            payroll_capture=capture, payroll_incremental=False
+        ).get_lines_dict()
+        return capture.get_snapshot(
+            self,
+            self.env["hr.salary.rule"].browse(plan.rule_ids),
+            plan.blacklists,
+            lines_dict,
+        )
+
+    def action_capture_computation(self):
+        """Attach the snapshot of the computation of the payslips to them"""
+        for payslip in self:
+            snapshot = payslip._capture_computation()
+            self.env["ir.attachment"].create(
+                {
+                    "name": "%s-capture.json" % (payslip.number or payslip.id),
+                    "res_model": self._name,
+                    "res_id": payslip.id,
+                    "mimetype": "application/json",
+                    "raw": json.dumps(snapshot, indent=1, sort_keys=True).encode(),
+                }
+            )
+        return True
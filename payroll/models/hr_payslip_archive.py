@@ -0,0 +1,179 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import base64
+import json
+import zlib
+from collections import defaultdict
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+# Tables archived with the payslips, and their column referencing the payslip
+ARCHIVED_TABLES = (
+    ("hr_payslip", "id"),
+    ("hr_payslip_worked_days", "payslip_id"),
+    ("hr_payslip_input", "payslip_id"),
+    ("hr_payslip_line", "slip_id"),
+)
+# Tables of the records linked to the payslips by model and id, linked to the
+# archives instead: (table, model column, id column)
+LINKED_TABLES = (
+    ("mail_message", "model", "res_id"),
+    ("ir_attachment", "res_model", "res_id"),
+)
+
+
+class HrPayslipArchive(models.Model):
+    """Confirmed payslip moved out of the payslip tables, with its lines,
+    worked days and inputs kept as compressed rows. The rows of the payslip in
+    hr.payslip.ledger are kept, so all the history lookups of the rules
+    (Payslips, InputLine and WorkedDays) still include the archived payslips,
+    and the contribution register report reads the lines of the archives. The
+    payslip details report only prints payslips, an archive is restored to be
+    printed. The messages and attachments of the payslip are linked to the
+    archive. Restoring an archive inserts the rows back with their ids.
+
+    The payslips are deleted with unlink(): the records of other models
+    referencing them are deleted or prevent the archiving according to
+    their foreign keys, they are not restored."""
+
+    _name = "hr.payslip.archive"
+    _description = "Payslip Archive"
+    _order = "date_to desc, id desc"
+
+    name = fields.Char(readonly=True)
+    number = fields.Char(string="Reference", readonly=True)
+    employee_id = fields.Many2one(
+        "hr.employee", string="Employee", readonly=True, index=True
+    )
+    company_id = fields.Many2one("res.company", string="Company", readonly=True)
+    date_from = fields.Date(readonly=True)
+    date_to = fields.Date(readonly=True)
+    payslip_id = fields.Integer(string="Payslip ID", readonly=True, index=True)
+    data = fields.Binary(attachment=False, readonly=True)
+
+    @api.model
+    def _archive_payslips(self, payslips):
+        """Move the payslips to archives. Payslips refunded by payslips which
+        are not archived with them are kept.
+        @return: the archives of the payslips
+        """
+        refunds = payslips.search([("refunded_id", "in", payslips.ids)])
+        payslips -= (refunds - payslips).refunded_id
+        if not payslips:
+            return self.browse()
+        if payslips.filtered(lambda payslip: payslip.state != "done"):
+            raise UserError(_("Only confirmed payslips can be archived."))
+        self.env.flush_all()
+        cr = self.env.cr
+        payslip_ids = tuple(payslips.ids)
+        rows = defaultdict(dict)
+        for table, column in ARCHIVED_TABLES:
+            cr.execute(
+                'SELECT "%s", json_agg(row_to_json(t)) FROM "%s" AS t '
+                'WHERE "%s" IN %%s GROUP BY "%s"' % (column, table, column, column),
+                (payslip_ids,),
+            )
+            for payslip_id, table_rows in cr.fetchall():
+                rows[payslip_id][table] = table_rows
+        archives = self.sudo().create(
+            [
+                {
+                    "name": payslip.name,
+                    "number": payslip.number,
+                    "employee_id": payslip.employee_id.id,
+                    "company_id": payslip.company_id.id,
+                    "date_from": payslip.date_from,
+                    "date_to": payslip.date_to,
+                    "payslip_id": payslip.id,
+                    "data": base64.b64encode(
+                        zlib.compress(json.dumps(rows[payslip.id]).encode())
+                    ),
+                }
+                for payslip in payslips
+            ]
+        )
+        self.env.flush_all()
+        cr.execute(
+            """
+            UPDATE hr_payslip_ledger AS l SET archive_id = a.id, payslip_id = NULL
+            FROM hr_payslip_archive AS a
+            WHERE a.id IN %s AND l.payslip_id = a.payslip_id""",
+            (tuple(archives.ids),),
+        )
+        archives._move_linked_records()
+        self.env.invalidate_all()
+        # the lines, worked days and inputs are deleted in cascade
+        payslips.with_context(payroll_archive=True).unlink()
+        return archives.with_env(self.env)
+
+    def _move_linked_records(self, restore=False):
+        """Link the messages and attachments of the archived payslips to their
+        archives, or back to the payslips when restoring them"""
+        models = ("hr.payslip", self._name)
+        id_columns = ("payslip_id", "id")
+        if restore:
+            models, id_columns = models[::-1], id_columns[::-1]
+        for table, model_column, id_column in LINKED_TABLES:
+            self.env.cr.execute(
+                'UPDATE "%s" AS t SET "%s" = %%s, "%s" = a."%s" '
+                "FROM hr_payslip_archive AS a "
+                'WHERE a.id IN %%s AND t."%s" = %%s AND t."%s" = a."%s"'
+                % (
+                    table,
+                    model_column,
+                    id_column,
+                    id_columns[1],
+                    model_column,
+                    id_column,
+                    id_columns[0],
+                ),
+                (models[1], tuple(self.ids), models[0]),
+            )
+
+    def _get_rows(self):
+        """
+        @return: the rows of the archived payslip, by table
+        """
+        self.ensure_one()
+        return json.loads(zlib.decompress(base64.b64decode(self.data)))
+
+    def action_restore(self):
+        """Insert the archived payslips back into the payslip tables and
+        delete the archives. The rows are inserted without the access rights
+        of the payslips, restoring is reserved to the users allowed to delete
+        the archives, the payroll managers."""
+        self.check_access_rights("unlink")
+        self.check_access_rule("unlink")
+        self.env.flush_all()
+        cr = self.env.cr
+        for table, _column in ARCHIVED_TABLES:
+            table_rows = [
+                row for archive in self for row in archive._get_rows().get(table, [])
+            ]
+            if table_rows:
+                # the columns missing from the archived rows are left empty
+                cr.execute(
+                    'INSERT INTO "%s" SELECT * FROM json_populate_recordset('
+                    'NULL::"%s", %%s)' % (table, table),
+                    (json.dumps(table_rows),),
+                )
+        cr.execute(
+            """
+            UPDATE hr_payslip_ledger AS l SET payslip_id = a.payslip_id,
+                archive_id = NULL
+            FROM hr_payslip_archive AS a
+            WHERE a.id IN %s AND l.archive_id = a.id""",
+            (tuple(self.ids),),
+        )
+        self._move_linked_records(restore=True)
+        payslip_ids = self.mapped("payslip_id")
+        self.unlink()
+        self.env.invalidate_all()
+        return {
+            "type": "ir.actions.act_window",
+            "name": _("Restored Payslips"),
+            "res_model": "hr.payslip",
+            "view_mode": "tree,form",
+            "domain": [("id", "in", payslip_ids)],
+        }
@@ -0,0 +1,122 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import time
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+
+class HrPayslipComputeQueue(models.Model):
+    _name = "hr.payslip.compute.queue"
+    _description = "Payslip Computation Queue"
+    _order = "id"
+
+    run_id = fields.Many2one(
+        "hr.payslip.run",
+        string="Payslip Batch",
+        required=True,
+        ondelete="cascade",
+        index=True,
+    )
+    payslip_id = fields.Many2one(
+        "hr.payslip", string="Payslip", required=True, ondelete="cascade"
+    )
+    state = fields.Selection(
+        [("pending", "Pending"), ("done", "Done"), ("failed", "Failed")],
+        string="Status",
+        required=True,
+        index=True,
+        default="pending",
+    )
+    error = fields.Text(readonly=True)
+
+    @api.model
+    def _process_queue(self, chunk_size=None, time_limit=None):
+        """Compute the pending payslips in chunks, each chunk is committed.
+
+        Chunks are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+        crons, workers or nodes can process the queue at the same time, see
+        _get_crons(). When a worker is killed, its chunk is rolled back and
+        unlocked, and is claimed again by the next worker.
+        @param chunk_size: number of payslips computed per transaction
+        @param time_limit: seconds after which the processing stops and the
+                           cron is triggered again to continue
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        chunk_size = chunk_size or int(get_param("payroll.queue_chunk_size") or 20)
+        time_limit = time_limit or int(get_param("payroll.queue_time_limit") or 240)
+        start = time.time()
+        while True:
+            jobs = self._claim_jobs(chunk_size)
+            if not jobs:
+                return True
+            jobs._compute_payslips()
+            self.env.cr.commit()
+            if time.time() - start > time_limit:
+                self._trigger_crons()
+                return True
+
+    @api.model
+    def _claim_jobs(self, chunk_size):
+        """
+        @return: at most chunk_size pending jobs, locked until the end of the
+                 transaction. The jobs locked by other transactions are
+                 skipped.
+        """
+        self.env.cr.execute(
+            """
+            SELECT id FROM hr_payslip_compute_queue
+            WHERE state = 'pending'
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (chunk_size,),
+        )
+        return self.browse([row[0] for row in self.env.cr.fetchall()])
+
+    @api.model
+    def _get_crons(self):
+        """
+        @return: the active crons processing the queue. A cron only runs in
+                 one worker at a time, the queue is processed in parallel by
+                 as many workers as crons.
+        """
+        return (
+            self.env["ir.cron"]
+            .sudo()
+            .search([("model_id", "=", self.env["ir.model"]._get_id(self._name))])
+        )
+
+    @api.model
+    def _trigger_crons(self):
+        for cron in self._get_crons():
+            cron._trigger()
+
+    def _compute_payslips(self):
+        """Compute the payslips of the jobs. When the chunk fails, the
+        payslips are computed one by one to only fail the faulty ones."""
+        payslips = self.mapped("payslip_id").filtered(
+            lambda payslip: payslip.state in ("draft", "verify")
+        )
+        try:
+            with self.env.cr.savepoint():
+                payslips.compute_sheet()
+            self.write({"state": "done", "error": False})
+            return
+        except Exception as e:
+            _logger.info("Payslips %s computed one by one: %s", payslips.ids, e)
+        for job in self:
+            try:
+                with self.env.cr.savepoint():
+                    job.payslip_id.filtered(
+                        lambda payslip: payslip.state in ("draft", "verify")
+                    ).compute_sheet()
+                job.write({"state": "done", "error": False})
+            except Exception as e:
+                _logger.warning(
+                    "Payslip %s could not be computed: %s", job.payslip_id.id, e
+                )
+                job.write({"state": "failed", "error": str(e)})
@@ -1,6 +1,6 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class HrPayslipInput(models.Model):
@@ -12,6 +12,8 @@ class HrPayslipInput(models.Model):
     payslip_id = fields.Many2one(
         "hr.payslip", string="Pay Slip", required=True, ondelete="cascade", index=True
     )
+    # key of the partitions of the table, see partitioning.py
+    date_from = fields.Date("Date From", related="payslip_id.date_from", store=True)
     sequence = fields.Integer(required=True, index=True, default=10)
     code = fields.Char(
         required=True, help="The code that can be used in the salary rules"
@@ -30,3 +32,29 @@ class HrPayslipInput(models.Model):
         required=True,
         help="The contract for which applied this input",
     )
+
+    def _get_recompute_keys(self):
+        return {"inputs.%s" % code for code in self.mapped("code")}
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        for record in records:
+            record.payslip_id._add_recompute_keys(record._get_recompute_keys())
+        return records
+
+    def write(self, vals):
+        keys = {record: record._get_recompute_keys() for record in self}
+        res = super().write(vals)
+        for record in self:
+            record.payslip_id._add_recompute_keys(
+                keys[record] | record._get_recompute_keys()
+            )
+        return res
+
+    def unlink(self):
+        keys = [(record.payslip_id, record._get_recompute_keys()) for record in self]
+        res = super().unlink()
+        for payslip, payslip_keys in keys:
+            payslip._add_recompute_keys(payslip_keys)
+        return res
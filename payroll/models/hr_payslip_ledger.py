@@ -0,0 +1,208 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+
+from odoo import api, fields, models
+from odoo.tools.sql import create_index
+
+# Tables the rows are computed from, read from the archived rows for the
+# archived payslips, see _insert_rows
+SOURCE_TABLES = (
+    "hr_payslip",
+    "hr_payslip_line",
+    "hr_payslip_input",
+    "hr_payslip_worked_days",
+)
+
+# Rows of confirmed payslips, the amounts are signed as in the Payslips
+# history lookups of base_browsable.py, the inputs and worked days are summed
+# as in the InputLine and WorkedDays lookups. {owner} is the column of the payslip
+# or of its archive, {owner_id} its value, and the tables are formatted with
+# their source.
+INSERT_QUERY = """
+    INSERT INTO hr_payslip_ledger (
+        {owner}, employee_id, kind, code, date_from, date_to, amount,
+        line_count, max_amount, min_amount, cumulative_amount, cumulative_count,
+        create_uid, create_date, write_uid, write_date
+    )
+    SELECT {owner_id}, employee_id, kind, code, date_from, date_to, sum(total),
+        count(total), max(total), min(total), 0, 0,
+        %(uid)s, now() at time zone 'UTC', %(uid)s, now() at time zone 'UTC'
+    FROM (
+        SELECT hp.id, hp.employee_id, 'rule' AS kind, pl.code, hp.date_from,
+            hp.date_to, case when hp.credit_note = False then
+                (pl.total) else (-pl.total) end AS total
+        FROM {hr_payslip} AS hp
+        JOIN {hr_payslip_line} AS pl ON pl.slip_id = hp.id
+        WHERE hp.id IN %(payslip_ids)s AND hp.state = 'done'
+        AND pl.code IS NOT NULL
+        UNION ALL
+        SELECT hp.id, hp.employee_id, 'category', rc.code, hp.date_from,
+            hp.date_to, case when hp.credit_note is not True then
+                (pl.total) else (-pl.total) end
+        FROM {hr_payslip} AS hp
+        JOIN {hr_payslip_line} AS pl ON pl.slip_id = hp.id
+        JOIN hr_salary_rule_category AS rc ON rc.id = pl.category_id
+        WHERE hp.id IN %(payslip_ids)s AND hp.state = 'done'
+        AND rc.code IS NOT NULL
+        UNION ALL
+        SELECT hp.id, hp.employee_id, 'input', pi.code, hp.date_from,
+            hp.date_to, pi.amount
+        FROM {hr_payslip} AS hp
+        JOIN {hr_payslip_input} AS pi ON pi.payslip_id = hp.id
+        WHERE hp.id IN %(payslip_ids)s AND hp.state = 'done'
+        AND pi.code IS NOT NULL
+        UNION ALL
+        SELECT hp.id, hp.employee_id, kind, wd.code, hp.date_from, hp.date_to,
+            case when kind = 'worked_days' then
+                wd.number_of_days else wd.number_of_hours end
+        FROM {hr_payslip} AS hp
+        JOIN {hr_payslip_worked_days} AS wd ON wd.payslip_id = hp.id
+        CROSS JOIN unnest(ARRAY['worked_days', 'worked_hours']) AS k(kind)
+        WHERE hp.id IN %(payslip_ids)s AND hp.state = 'done'
+        AND wd.code IS NOT NULL
+    ) AS lines
+    GROUP BY id, employee_id, kind, code, date_from, date_to
+    RETURNING employee_id, kind, code"""
+
+# Running totals in (date_to, id) order, per employee, kind and code
+CUMULATIVE_QUERY = """
+    UPDATE hr_payslip_ledger AS l
+    SET cumulative_amount = c.cumulative_amount,
+        cumulative_count = c.cumulative_count
+    FROM (
+        SELECT id,
+            sum(amount) OVER w AS cumulative_amount,
+            sum(line_count) OVER w AS cumulative_count
+        FROM hr_payslip_ledger
+        WHERE (employee_id, kind, code) IN %(keys)s
+        WINDOW w AS (PARTITION BY employee_id, kind, code ORDER BY date_to, id)
+    ) AS c
+    WHERE l.id = c.id
+    AND (l.cumulative_amount, l.cumulative_count)
+        IS DISTINCT FROM (c.cumulative_amount, c.cumulative_count)"""
+
+
+class HrPayslipLedger(models.Model):
+    """Totals of the lines of the confirmed payslips, by payslip and rule or
+    category code, and of their inputs, worked days and worked hours by code,
+    with running totals per employee and code. A sum or an
+    average over any period is read from two rows, whatever the length of
+    the history of the employee (see base_browsable.LEDGER_QUERY). The
+    maximum, minimum and monthly lookups aggregate the rows of the payslips
+    of the period (see base_browsable.LEDGER_RANGE_QUERY). All of them
+    include the archived payslips."""
+
+    _name = "hr.payslip.ledger"
+    _description = "Payslip Ledger"
+    _order = "employee_id, kind, code, date_to, id"
+
+    payslip_id = fields.Many2one(
+        "hr.payslip", string="Payslip", ondelete="cascade", index=True
+    )
+    # rows of the archived payslips are kept, see hr.payslip.archive
+    archive_id = fields.Many2one(
+        "hr.payslip.archive", string="Archive", ondelete="cascade", index=True
+    )
+    employee_id = fields.Many2one("hr.employee", string="Employee", required=True)
+    kind = fields.Selection(
+        [
+            ("rule", "Rule"),
+            ("category", "Category"),
+            ("input", "Input"),
+            ("worked_days", "Worked Days"),
+            ("worked_hours", "Worked Hours"),
+        ],
+        required=True,
+    )
+    code = fields.Char(required=True)
+    date_from = fields.Date(required=True)
+    date_to = fields.Date(required=True)
+    amount = fields.Float(digits="Payroll")
+    line_count = fields.Integer()
+    max_amount = fields.Float(digits="Payroll", help="Greatest line total")
+    min_amount = fields.Float(digits="Payroll", help="Lowest line total")
+    cumulative_amount = fields.Float(digits="Payroll")
+    cumulative_count = fields.Integer()
+
+    def init(self):
+        create_index(
+            self._cr,
+            "hr_payslip_ledger_lookup_index",
+            self._table,
+            ["employee_id", "kind", "code", "date_to", "id"],
+        )
+
+    @api.model
+    def _update_payslips(self, payslips):
+        """Update the rows of the payslips, to be called when payslips are
+        confirmed or cancelled, or when confirmed payslips are modified."""
+        if not payslips:
+            return
+        self.env.flush_all()
+        cr = self.env.cr
+        params = {"payslip_ids": tuple(payslips.ids), "uid": self.env.uid}
+        cr.execute(
+            """
+            DELETE FROM hr_payslip_ledger WHERE payslip_id IN %(payslip_ids)s
+            RETURNING employee_id, kind, code""",
+            params,
+        )
+        keys = set(cr.fetchall())
+        keys |= self._insert_rows(params)
+        self._update_cumulative(keys)
+
+    @api.model
+    def _update_archives(self, archives):
+        """Compute the rows of the archived payslips again from their archived
+        rows"""
+        if not archives:
+            return
+        self.env.flush_all()
+        cr = self.env.cr
+        cr.execute(
+            """
+            DELETE FROM hr_payslip_ledger WHERE archive_id IN %s
+            RETURNING employee_id, kind, code""",
+            (tuple(archives.ids),),
+        )
+        keys = set(cr.fetchall())
+        for archive in archives:
+            params = {"payslip_ids": (archive.payslip_id,), "uid": self.env.uid}
+            keys |= self._insert_rows(params, archive)
+        self._update_cumulative(keys)
+
+    @api.model
+    def _insert_rows(self, params, archive=None):
+        """Insert the rows of the payslips params["payslip_ids"], computed
+        from the payslip tables, or from the archived rows of the archive.
+        @return: the keys (employee id, kind, code) of the inserted rows
+        """
+        if archive:
+            rows = archive._get_rows()
+            params = dict(params, archive_id=archive.id)
+            source = 'json_populate_recordset(NULL::"%s", %%(%s)s)'
+            sources = {}
+            for table in SOURCE_TABLES:
+                params[table] = json.dumps(rows.get(table, []))
+                sources[table] = source % (table, table)
+            owner = {"owner": "archive_id", "owner_id": "%(archive_id)s"}
+        else:
+            sources = {table: table for table in SOURCE_TABLES}
+            owner = {"owner": "payslip_id", "owner_id": "id"}
+        self.env.cr.execute(INSERT_QUERY.format(**owner, **sources), params)
+        return set(self.env.cr.fetchall())
+
+    @api.model
+    def _update_cumulative(self, keys):
+        if keys:
+            self.env.cr.execute(CUMULATIVE_QUERY, {"keys": tuple(keys)})
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild(self):
+        """Build the ledger again from all the confirmed payslips and the
+        archives"""
+        self.env.cr.execute("DELETE FROM hr_payslip_ledger")
+        self._update_payslips(self.env["hr.payslip"].search([("state", "=", "done")]))
+        self._update_archives(self.env["hr.payslip.archive"].search([]))
@@ -1,7 +1,16 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from collections import defaultdict
+
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.models import LOG_ACCESS_COLUMNS
+from odoo.tools import split_every
+
+from .hr_salary_rule_revision import REVISION_FIELDS
+
+# Computed and related stored fields filled by _insert_lines
+INSERT_COMPUTED_FIELDS = ("date_from", "total", "parent_line_id")
 
 
 class HrPayslipLine(models.Model):
@@ -9,6 +18,10 @@ class HrPayslipLine(models.Model):
     _inherit = "hr.salary.rule"
     _description = "Payslip Line"
     _order = "contract_id, sequence"
+    # the hierarchy of the lines is parent_line_id, see _compute_parent_line_id
+    _parent_store = False
+    # inherited from the rules, no column nor index on the lines
+    parent_path = fields.Char(store=False)
 
     slip_id = fields.Many2one(
         "hr.payslip", string="Pay Slip", required=True, ondelete="cascade"
@@ -39,6 +52,11 @@ class HrPayslipLine(models.Model):
         digits="Payroll",
         store=True,
     )
+    # the source of the rule is read from its revision, see _get_rule_line_values
+    condition_python = fields.Text(compute="_compute_revision_fields")
+    condition_range = fields.Char(compute="_compute_revision_fields")
+    amount_python_compute = fields.Text(compute="_compute_revision_fields")
+    amount_percentage_base = fields.Char(compute="_compute_revision_fields")
     allow_edit_payslip_lines = fields.Boolean(
         "Allow editing", compute="_compute_allow_edit_payslip_lines"
     )
@@ -50,15 +68,59 @@ class HrPayslipLine(models.Model):
             .get_param("payroll.allow_edit_payslip_lines")
         )
 
+    def _check_rule_code(self):
+        # Lines keep a copy of the rule code for reference, it is never evaluated.
+        return
+
+    def _clear_rule_caches(self):
+        # Lines do not feed the salary rule caches.
+        return
+
+    def _update_revision(self):
+        # Lines keep the revision of their rule at the time of the computation.
+        return
+
+    def _force_payslips_recompute(self):
+        # Lines are not part of the execution plans, see _update_ledger.
+        return
+
+    @api.depends("revision_id")
+    def _compute_revision_fields(self):
+        for line in self:
+            for name in REVISION_FIELDS:
+                line[name] = line.revision_id[name]
+
+    def _get_changed_values(self, vals):
+        """
+        @return: the values of vals which are different from the line ones,
+                 once converted the way they are stored (e.g. rounded floats)
+        """
+        self.ensure_one()
+        changed_vals = {}
+        for name, value in vals.items():
+            field = self._fields[name]
+            if field.convert_to_cache(value, self) != field.convert_to_cache(
+                self[name], self
+            ):
+                changed_vals[name] = value
+        if "total" in vals and {"quantity", "amount", "rate"} & set(changed_vals):
+            # the total computed by the rule engine is written with its factors,
+            # so that _compute_total is not triggered
+            changed_vals["total"] = vals["total"]
+        return changed_vals
+
     @api.depends("parent_rule_id", "contract_id", "slip_id")
     def _compute_parent_line_id(self):
+        # lines of the payslips by rule and contract, looked up by the children
+        slip_lines = defaultdict(lambda: self.browse())
+        for line in self.filtered("parent_rule_id").slip_id.line_ids:
+            key = (line.slip_id.id, line.salary_rule_id.id, line.contract_id.id)
+            slip_lines[key] |= line
         for line in self:
             if line.parent_rule_id:
-                parent_line = line.slip_id.line_ids.filtered(
-                    lambda l: l.salary_rule_id == line.parent_rule_id
-                    and l.contract_id == line.contract_id
-                    and l.slip_id == line.slip_id
-                )
+                parent_line = slip_lines[
+                    line.slip_id.id, line.parent_rule_id.id, line.contract_id.id
+                ]
                 if parent_line and len(parent_line) > 1:
                     raise UserError(
                         _("Recursion error. Only one line should be parent of %s")
@@ -78,6 +140,11 @@ class HrPayslipLine(models.Model):
     @api.model_create_multi
     def create(self, vals_list):
         for values in vals_list:
+            if "revision_id" not in values and set(REVISION_FIELDS) & set(values):
+                # lines given the source of their rule instead of its revision
+                values["revision_id"] = (
+                    self.env["hr.salary.rule.revision"]._get_revision(values).id
+                )
             if "employee_id" not in values or "contract_id" not in values:
                 payslip = self.env["hr.payslip"].browse(values.get("slip_id"))
                 values["employee_id"] = (
@@ -92,4 +159,125 @@ class HrPayslipLine(models.Model):
                     raise UserError(
                         _("You must set a contract to create a payslip line.")
                     )
-        return super(HrPayslipLine, self).create(vals_list)
+        lines = super(HrPayslipLine, self).create(vals_list)
+        lines._update_ledger(lines.mapped("slip_id"))
+        return lines
+
+    @api.model
+    def _insert_lines(self, vals_list):
+        """Insert lines with multi-row INSERT queries instead of create, for
+        the lines computed by the rule engine. The defaults are read once for
+        all the lines, date_from, total and parent_line_id are filled directly
+        and the caches of the lines and of their payslips are invalidated.
+        The values must only contain stored fields of the lines.
+        @return: the inserted lines
+        """
+        if not vals_list:
+            return self.browse()
+        self.check_access_rights("create")
+        payslips = self.env["hr.payslip"].browse(
+            list({vals["slip_id"] for vals in vals_list})
+        )
+        # the record rules are not applied by the INSERT, the lines are
+        # allowed on the payslips the user can modify
+        payslips.check_access_rule("write")
+        self.env.flush_all()
+        cr = self.env.cr
+        columns = [
+            name
+            for name, field in self._fields.items()
+            if field.store
+            and field.column_type
+            and name not in ("id",) + LOG_ACCESS_COLUMNS
+            and (not field.compute or name in INSERT_COMPUTED_FIELDS)
+        ]
+        defaults = self.default_get(
+            [name for name in columns if name not in INSERT_COMPUTED_FIELDS]
+        )
+        date_from = {payslip.id: payslip.date_from for payslip in payslips}
+        rows = []
+        for vals in vals_list:
+            values = dict(defaults, **vals)
+            values["date_from"] = date_from[values["slip_id"]]
+            # same as _compute_total, from the values rounded as stored
+            quantity, amount, rate = (
+                self._fields[name].convert_to_cache(values[name], self)
+                for name in ("quantity", "amount", "rate")
+            )
+            values["total"] = float(quantity) * amount * rate / 100
+            values["parent_line_id"] = False
+            rows.append(
+                tuple(
+                    self._fields[name].convert_to_column(values.get(name), self, values)
+                    for name in columns
+                )
+                + (self.env.uid, self.env.uid)
+            )
+        query = 'INSERT INTO "%s" (%s, create_uid, write_uid, create_date, write_date)'
+        query %= (self._table, ", ".join('"%s"' % name for name in columns))
+        row_format = "(%s, now() at time zone 'UTC', now() at time zone 'UTC')"
+        row_format %= ", ".join(["%s"] * (len(columns) + 2))
+        ids = []
+        for chunk in split_every(1000, rows):
+            cr.execute(
+                "%s VALUES %s RETURNING id"
+                % (query, ", ".join([row_format] * len(chunk))),
+                [value for row in chunk for value in row],
+            )
+            ids.extend(row[0] for row in cr.fetchall())
+        # same as _compute_parent_line_id; the lines of a payslip share its
+        # date_from, which restricts the update and the join to the partitions
+        # of the payslips
+        cr.execute(
+            """
+            UPDATE hr_payslip_line AS line
+            SET parent_line_id = parent.id
+            FROM hr_payslip_line AS parent
+            WHERE line.id IN %s
+            AND line.date_from IN %s
+            AND parent.date_from = line.date_from
+            AND parent.slip_id = line.slip_id
+            AND parent.contract_id = line.contract_id
+            AND parent.salary_rule_id = line.parent_rule_id""",
+            (tuple(ids), tuple(set(date_from.values()))),
+        )
+        lines = self.browse(ids)
+        self.invalidate_model()
+        payslips.invalidate_recordset()
+        # recompute what depends on the lines, but not the fields filled above
+        lines.modified(columns, create=True)
+        for field in self._fields.values():
+            if field.name in INSERT_COMPUTED_FIELDS:
+                self.env.remove_to_compute(field, lines)
+            elif field.store and field.compute:
+                self.env.add_to_compute(field, lines)
+        return lines
+
+    def unlink(self):
+        # the children lines are detached here rather than by the foreign key,
+        # which cannot do it on partitioned tables before PostgreSQL 15, see
+        # partitioning.get_ondelete()
+        children = self.search([("parent_line_id", "in", self.ids)]) - self
+        if children:
+            children.write({"parent_line_id": False})
+        payslips = self.mapped("slip_id")
+        res = super().unlink()
+        self._update_ledger(payslips)
+        return res
+
+    def write(self, vals):
+        res = super().write(vals)
+        self._update_ledger(self.mapped("slip_id"))
+        return res
+
+    def _update_ledger(self, payslips):
+        """Update the ledger of the confirmed payslips whose lines were
+        created, modified or removed, see allow_edit_payslip_lines"""
+        payslips = payslips.exists().filtered(lambda payslip: payslip.state == "done")
+        if not payslips:
+            return
+        self.env["hr.payslip.ledger"]._update_payslips(payslips)
+        # the confirmed payslips are read by the rules (payslips.sum...)
+        self.env["hr.payslip"]._force_full_recompute(
+            [("employee_id", "in", payslips.mapped("employee_id").ids)]
+        )
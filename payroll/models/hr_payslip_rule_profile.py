@@ -0,0 +1,113 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo import api, fields, models
+from odoo.tools.sql import create_unique_index
+
+from .rule_profiler import STAT_NAMES
+
+
+class HrPayslipRuleProfile(models.Model):
+    """Measures of the evaluations of a salary rule in the payslips of a
+    batch, accumulated over the computations of the batch, see
+    rule_profiler.RuleProfiler. The measures of the payslips without batch
+    are accumulated on rows without batch."""
+
+    _name = "hr.payslip.rule.profile"
+    _description = "Salary Rule Profile"
+    _order = "total_time desc, id"
+
+    run_id = fields.Many2one(
+        "hr.payslip.run",
+        string="Payslip Batch",
+        readonly=True,
+        ondelete="cascade",
+        index=True,
+    )
+    rule_id = fields.Many2one(
+        "hr.salary.rule",
+        string="Rule",
+        required=True,
+        readonly=True,
+        ondelete="cascade",
+    )
+    code = fields.Char(related="rule_id.code")
+    evaluation_count = fields.Integer(
+        string="Evaluations", readonly=True, help="Number of condition evaluations"
+    )
+    compute_count = fields.Integer(
+        string="Computations",
+        readonly=True,
+        help="Number of amount computations, for the satisfied conditions",
+    )
+    condition_time = fields.Float(
+        string="Condition Time (s)", digits=(16, 6), readonly=True
+    )
+    amount_time = fields.Float(string="Amount Time (s)", digits=(16, 6), readonly=True)
+    total_time = fields.Float(string="Total Time (s)", digits=(16, 6), readonly=True)
+    max_time = fields.Float(
+        string="Max Time (s)",
+        digits=(16, 6),
+        readonly=True,
+        help="Longest evaluation of the rule, condition and amount",
+    )
+    average_time = fields.Float(
+        string="Average Time (s)",
+        digits=(16, 6),
+        compute="_compute_average_time",
+    )
+    query_count = fields.Integer(
+        string="SQL Queries", readonly=True, help="Number of SQL queries issued"
+    )
+
+    def init(self):
+        # a rule is profiled once per batch, and once for the payslips without
+        # batch, which unique(run_id, rule_id) would not enforce
+        create_unique_index(
+            self._cr,
+            "hr_payslip_rule_profile_run_rule_index",
+            self._table,
+            ["COALESCE(run_id, 0)", "rule_id"],
+        )
+
+    @api.depends("total_time", "evaluation_count")
+    def _compute_average_time(self):
+        for profile in self:
+            profile.average_time = (
+                profile.evaluation_count
+                and profile.total_time / profile.evaluation_count
+            )
+
+    @api.model
+    def _add_profiler(self, profiler):
+        """Add the measures of the profiler to the rows of their batch and
+        rule, created if needed.
+        @param profiler: a rule_profiler.RuleProfiler
+        """
+        if not profiler.stats:
+            return
+        profiles = self.sudo().search(
+            [
+                ("run_id", "in", list({run_id for run_id, _ in profiler.stats})),
+                ("rule_id", "in", list({rule_id for _, rule_id in profiler.stats})),
+            ]
+        )
+        profiles = {
+            (profile.run_id.id, profile.rule_id.id): profile for profile in profiles
+        }
+        vals_list = []
+        for (run_id, rule_id), stats in profiler.stats.items():
+            profile = profiles.get((run_id, rule_id))
+            vals = dict(
+                stats, total_time=stats["condition_time"] + stats["amount_time"]
+            )
+            if not profile:
+                vals_list.append(dict(vals, run_id=run_id, rule_id=rule_id))
+                continue
+            for name in STAT_NAMES + ("total_time",):
+                if name == "max_time":
+                    vals[name] = max(vals[name], profile[name])
+                else:
+                    vals[name] += profile[name]
+            profile.write(vals)
+        self.sudo().create(vals_list)
+        profiler.stats.clear()
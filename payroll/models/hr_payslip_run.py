@@ -1,8 +1,16 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import logging
+from contextlib import contextmanager
+
 from dateutil.relativedelta import relativedelta
 
-from odoo import fields, models
+from odoo import _, fields, models
+
+from .parallel_compute import can_fork
+from .run_profiler import MODES, RunProfiler
+
+_logger = logging.getLogger(__name__)
 
 
 class HrPayslipRun(models.Model):
@@ -69,9 +77,216 @@ class HrPayslipRun(models.Model):
         "applied will be all the rules set on the structure of all contracts "
         "of the employee valid for the chosen period",
     )
+    compute_queue_ids = fields.One2many(
+        "hr.payslip.compute.queue", "run_id", string="Computation Queue"
+    )
+    compute_queued = fields.Boolean(
+        compute="_compute_compute_progress",
+        help="Payslips of the batch are being computed in the background",
+    )
+    compute_progress = fields.Float(
+        compute="_compute_compute_progress",
+        help="Percentage of the payslips computed in the background",
+    )
+    compute_failed_count = fields.Integer(
+        compute="_compute_compute_progress",
+        help="Number of payslips that could not be computed in the background",
+    )
+    rule_profile_ids = fields.One2many(
+        "hr.payslip.rule.profile", "run_id", string="Rule Profiles"
+    )
+    rule_profile_count = fields.Integer(compute="_compute_rule_profile_count")
+    profile_mode = fields.Selection(
+        MODES,
+        string="Profiling",
+        copy=False,
+        help="Profile the generation and the computation of the payslips of "
+        "the batch. The profiles are attached to the batch. Deterministic "
+        "profiling records every Python call, sampling profiling reads the "
+        "stack at a fixed interval and slows down the computation less.",
+    )
+    profile_interval = fields.Integer(
+        string="Sampling Interval (ms)",
+        default=10,
+        help="Milliseconds between two samples of the sampling profiling",
+    )
+    profile_depth = fields.Integer(
+        string="Maximum Stack Depth",
+        default=0,
+        help="Number of frames kept in the samples of the sampling profiling, "
+        "below the profiled operation. No limit when 0.",
+    )
+
+    def _compute_compute_progress(self):
+        counts = {}
+        for group in self.env["hr.payslip.compute.queue"].read_group(
+            [("run_id", "in", self.ids)],
+            ["run_id", "state"],
+            ["run_id", "state"],
+            lazy=False,
+        ):
+            counts[(group["run_id"][0], group["state"])] = group["__count"]
+        for run in self:
+            pending = counts.get((run.id, "pending"), 0)
+            done = counts.get((run.id, "done"), 0)
+            failed = counts.get((run.id, "failed"), 0)
+            total = pending + done + failed
+            run.compute_queued = bool(pending)
+            run.compute_progress = total and 100.0 * (done + failed) / total
+            run.compute_failed_count = failed
+
+    def _compute_rule_profile_count(self):
+        for run in self:
+            run.rule_profile_count = len(run.rule_profile_ids)
+
+    def action_open_rule_profiles(self):
+        self.ensure_one()
+        action = self.env["ir.actions.act_window"]._for_xml_id(
+            "payroll.hr_payslip_rule_profile_action"
+        )
+        action["domain"] = [("run_id", "=", self.id)]
+        return action
 
     def draft_payslip_run(self):
         return self.write({"state": "draft"})
 
     def close_payslip_run(self):
         return self.write({"state": "close"})
+
+    def _reset_rule_profiles(self):
+        """Remove the rule profiles of the batches which are about to be
+        profiled again, see hr.payslip.rule.profile. They are kept when the
+        rules are not profiled, as the last measures of the batches."""
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        if get_param("payroll.profile_rules"):
+            self.rule_profile_ids.sudo().unlink()
+
+    def compute_sheets(self):
+        self._reset_rule_profiles()
+        for run in self:
+            with run._profile("compute_sheets"):
+                run._compute_payslips(
+                    run.slip_ids.filtered(
+                        lambda slip: slip.state in ("draft", "verify")
+                    )
+                )
+        return True
+
+    @contextmanager
+    def _profile(self, operation):
+        """Profile the block with the profiling mode of the batch, if any,
+        see run_profiler.py. The profiles are attached to the batch.
+        @param operation: the name of the profiled operation
+        """
+        self.ensure_one()
+        if not self.profile_mode:
+            yield
+            return
+        profiler = RunProfiler(
+            self.profile_mode, self.profile_interval, self.profile_depth
+        )
+        with profiler:
+            yield
+        self._attach_profile(operation, profiler)
+
+    def _attach_profile(self, operation, profiler):
+        name = "%s-%s-%s" % (
+            self.id,
+            operation,
+            fields.Datetime.now().strftime("%Y%m%d%H%M%S"),
+        )
+        files = [(name + ".pstats", profiler.get_pstats(), "application/octet-stream")]
+        if profiler.mode == "sampling":
+            files.append(
+                (name + ".collapsed", profiler.get_collapsed_stacks(), "text/plain")
+            )
+        attachments = self.env["ir.attachment"].create(
+            [
+                {
+                    "name": filename,
+                    "res_model": self._name,
+                    "res_id": self.id,
+                    "mimetype": mimetype,
+                    "raw": raw,
+                }
+                for filename, raw, mimetype in files
+            ]
+        )
+        self.message_post(
+            body=_("Profile of %(operation)s: %(seconds).2f seconds")
+            % {"operation": operation, "seconds": profiler.elapsed},
+            attachment_ids=attachments.ids,
+        )
+        return attachments
+
+    def action_compute_background(self):
+        """Queue the payslips of the batches to be computed by the
+        payslip computation cron, see hr.payslip.compute.queue"""
+        queue = self.env["hr.payslip.compute.queue"]
+        self._reset_rule_profiles()
+        for run in self:
+            jobs = run.compute_queue_ids
+            jobs.filtered(lambda job: job.state != "pending").unlink()
+            pending_payslips = jobs.exists().mapped("payslip_id")
+            payslips = run.slip_ids.filtered(
+                lambda slip: slip.state in ("draft", "verify")
+            )
+            queue.create(
+                [
+                    {"run_id": run.id, "payslip_id": payslip.id}
+                    for payslip in payslips - pending_payslips
+                ]
+            )
+        queue._trigger_crons()
+        return True
+
+    def _get_parallel_settings(self):
+        """
+        @return: a tuple (number of worker processes, number of payslips per
+                 chunk) of the parallel computation
+        """
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        workers = int(get_param("payroll.parallel_workers") or 0)
+        chunk_size = int(get_param("payroll.parallel_chunk_size") or 100)
+        return workers, chunk_size
+
+    def _compute_payslips(self, payslips):
+        """Compute the payslips of the batch, in parallel worker processes
+        when enabled in the settings. The workers read the payslips with
+        their own connections, so they are only used when the current
+        transaction has not written anything: nothing has to be committed,
+        and the whole computation is rolled back on errors. Otherwise, e.g.
+        when the payslips were just generated, they are computed serially.
+        """
+        self.ensure_one()
+        workers, chunk_size = self._get_parallel_settings()
+        if workers < 2 or len(payslips) <= chunk_size or not can_fork():
+            return payslips.compute_sheet()
+        self.env.flush_all()
+        self.env.cr.execute("SELECT txid_current_if_assigned()")
+        if self.env.cr.fetchone()[0]:
+            _logger.info(
+                "Payslips of batch %s computed serially, the transaction has "
+                "uncommitted changes",
+                self.id,
+            )
+            return payslips.compute_sheet()
+        failures = payslips._compute_sheet_parallel(workers, chunk_size)
+        for failed_payslips, error in failures:
+            _logger.warning(
+                "Payslips %s of batch %s could not be computed: %s",
+                failed_payslips.ids,
+                self.id,
+                error,
+            )
+            self.message_post(
+                body=_(
+                    "The following payslips could not be computed: "
+                    "%(payslips)s. Error: %(error)s"
+                )
+                % {
+                    "payslips": ", ".join(failed_payslips.mapped("name")),
+                    "error": error,
+                }
+            )
+        return True
@@ -1,6 +1,6 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models
+from odoo import api, fields, models
 
 
 class HrRuleInput(models.Model):
@@ -14,3 +14,21 @@ class HrRuleInput(models.Model):
     input_id = fields.Many2one(
         "hr.salary.rule", string="Salary Rule Input", required=True
     )
+
+    # rule inputs are part of the cached execution plans
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        self.clear_caches()
+        return res
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
@@ -1,14 +1,36 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import _, api, fields, models
+from collections import defaultdict
+
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import UserError, ValidationError
-from odoo.tools.safe_eval import safe_eval
+from odoo.tools.safe_eval import (
+    _BUILTINS,
+    _SAFE_OPCODES,
+    check_values,
+    test_expr,
+    test_python_expr,
+    unsafe_eval,
+)
+
+from .hr_salary_rule_revision import REVISION_FIELDS
+
+# Rule fields containing python source and the mode they are evaluated with.
+RULE_CODE_FIELDS = {
+    "quantity": "eval",
+    "condition_range": "eval",
+    "condition_python": "exec",
+    "amount_percentage_base": "eval",
+    "amount_python_compute": "exec",
+}
 
 
 class HrSalaryRule(models.Model):
     _name = "hr.salary.rule"
     _order = "sequence, id"
     _description = "Salary Rule"
+    _parent_name = "parent_rule_id"
+    _parent_store = True
 
     name = fields.Char(required=True, translate=True)
     code = fields.Char(
@@ -39,6 +61,7 @@ class HrSalaryRule(models.Model):
     parent_rule_id = fields.Many2one(
         "hr.salary.rule", string="Parent Salary Rule", index=True
     )
+    parent_path = fields.Char(index=True, unaccent=False)
     company_id = fields.Many2one(
         "res.company",
         string="Company",
@@ -158,6 +181,13 @@ class HrSalaryRule(models.Model):
         help="Eventual third party involved in the salary payment of the employees.",
     )
     input_ids = fields.One2many("hr.rule.input", "input_id", string="Inputs", copy=True)
+    revision_id = fields.Many2one(
+        "hr.salary.rule.revision",
+        string="Revision",
+        readonly=True,
+        copy=False,
+        ondelete="restrict",
+    )
     note = fields.Text(string="Description")
     require_code_and_category = fields.Boolean(
         "Require code and category",
@@ -172,15 +202,136 @@ class HrSalaryRule(models.Model):
                 _("Error! You cannot create recursive hierarchy of Salary Rules.")
             )
 
+    @api.constrains("condition_select", "amount_select", *RULE_CODE_FIELDS.keys())
+    def _check_rule_code(self):
+        for rule in self:
+            for fname in rule._get_rule_code_fields():
+                msg = test_python_expr(rule[fname] or "", mode=RULE_CODE_FIELDS[fname])
+                if msg:
+                    raise ValidationError(
+                        _(
+                            "Wrong python code in field %(field)s of salary rule "
+                            "%(nm)s (%(code)s):\n%(msg)s"
+                        )
+                        % {
+                            "field": rule._fields[fname].string,
+                            "nm": rule.name,
+                            "code": rule.code,
+                            "msg": msg,
+                        }
+                    )
+
+    def _get_rule_code_fields(self):
+        """
+        @return: the names of the fields holding python code that are used
+                 by the rule, according to its condition and amount types
+        """
+        self.ensure_one()
+        fnames = []
+        if self.condition_select == "range":
+            fnames.append("condition_range")
+        elif self.condition_select == "python":
+            fnames.append("condition_python")
+        if self.amount_select in ("fix", "percentage"):
+            fnames.append("quantity")
+        if self.amount_select == "percentage":
+            fnames.append("amount_percentage_base")
+        elif self.amount_select == "code":
+            fnames.append("amount_python_compute")
+        return fnames
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        res = super().create(vals_list)
+        res._update_revision()
+        res._clear_rule_caches()
+        res._force_payslips_recompute()
+        return res
+
+    @api.model
+    def _get_rule_code_mode(self, fname):
+        return RULE_CODE_FIELDS[fname]
+
+    def write(self, vals):
+        res = super().write(vals)
+        if set(REVISION_FIELDS) & set(vals):
+            self._update_revision()
+        self._clear_rule_caches()
+        self._force_payslips_recompute()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self._clear_rule_caches()
+        self._force_payslips_recompute()
+        return res
+
+    def _force_payslips_recompute(self):
+        # the rules are part of the execution plans, see hr.payslip.recompute_keys
+        self.env["hr.payslip"]._force_full_recompute()
+
+    def _update_revision(self):
+        """Point the rules to the revision of their current source"""
+        Revision = self.env["hr.salary.rule.revision"]
+        for rule in self:
+            revision = Revision._get_revision(
+                {name: rule[name] for name in REVISION_FIELDS}
+            )
+            if rule.revision_id != revision:
+                rule.revision_id = revision
+
+    def _clear_rule_caches(self):
+        # compiled rule code and execution plans are cached per registry, see
+        # _get_rule_code() and hr.payroll.structure._get_execution_plan()
+        self.clear_caches()
+
+    @api.model
+    @tools.ormcache("rule_id", "write_date", "fname")
+    def _get_rule_code(self, rule_id, write_date, fname):
+        """Compile and validate the python code of a rule field.
+        The code object is cached per registry, so the source is only parsed
+        and checked against the safe opcodes once instead of once per payslip.
+        """
+        return self._compile_rule_code(self.browse(rule_id)[fname], fname)
+
+    @api.model
+    def _compile_rule_code(self, source, fname):
+        return test_expr(source or "", _SAFE_OPCODES, mode=RULE_CODE_FIELDS[fname])
+
+    def _eval_rule_code(self, fname, localdict):
+        """Run the compiled code of field ``fname`` with restricted builtins.
+        Expressions are evaluated on a copy of ``localdict`` and return their
+        value, statements are executed directly in ``localdict``.
+        """
+        self.ensure_one()
+        if self.id:
+            code = self._get_rule_code(self.id, self.write_date, fname)
+        else:
+            code = self._compile_rule_code(self[fname], fname)
+        if RULE_CODE_FIELDS[fname] == "eval":
+            localdict = dict(localdict)
+        check_values(localdict)
+        localdict["__builtins__"] = _BUILTINS
+        return unsafe_eval(code, localdict)
+
     def _recursive_search_of_rules(self):
         """
         @return: returns a list of tuple (id, sequence) which are all the
                  children of the passed rule_ids
         """
-        children_rules = []
-        for rule in self.filtered(lambda rule: rule.child_ids):
-            children_rules += rule.child_ids._recursive_search_of_rules()
-        return [(rule.id, rule.sequence) for rule in self] + children_rules
+        # fetch all the descendants at once, then walk the hierarchy in memory
+        children = defaultdict(list)
+        for rule in self.search([("id", "child_of", self.ids)]):
+            children[rule.parent_rule_id.id].append(rule)
+
+        def search_children(rules):
+            children_rules = []
+            for rule in rules:
+                if children[rule.id]:
+                    children_rules += search_children(children[rule.id])
+            return [(rule.id, rule.sequence) for rule in rules] + children_rules
+
+        return search_children(self)
 
     def _reset_localdict_values(self, localdict):
         localdict["result_name"] = None
@@ -217,7 +368,7 @@ class HrSalaryRule(models.Model):
         try:
             return {
                 "name": self.name,
-                "quantity": float(safe_eval(self.quantity, localdict)),
+                "quantity": float(self._eval_rule_code("quantity", localdict)),
                 "rate": 100.0,
                 "amount": self.amount_fix,
             }
@@ -234,9 +385,11 @@ class HrSalaryRule(models.Model):
         try:
             return {
                 "name": self.name,
-                "quantity": float(safe_eval(self.quantity, localdict)),
+                "quantity": float(self._eval_rule_code("quantity", localdict)),
                 "rate": self.amount_percentage,
-                "amount": float(safe_eval(self.amount_percentage_base, localdict)),
+                "amount": float(
+                    self._eval_rule_code("amount_percentage_base", localdict)
+                ),
             }
         except Exception as ex:
             raise UserError(
@@ -249,7 +402,7 @@ class HrSalaryRule(models.Model):
 
     def _compute_rule_code(self, localdict):
         try:
-            safe_eval(self.amount_python_compute, localdict, mode="exec", nocopy=True)
+            self._eval_rule_code("amount_python_compute", localdict)
             return self._get_rule_dict(localdict)
         except Exception as ex:
             raise UserError(
@@ -299,7 +452,7 @@ Here is the error received:
 
     def _satisfy_condition_range(self, localdict):
         try:
-            result = safe_eval(self.condition_range, localdict)
+            result = self._eval_rule_code("condition_range", localdict)
             return (
                 self.condition_range_min <= result <= self.condition_range_max or False
             )
@@ -314,7 +467,7 @@ Here is the error received:
 
     def _satisfy_condition_python(self, localdict):
         try:
-            safe_eval(self.condition_python, localdict, mode="exec", nocopy=True)
+            self._eval_rule_code("condition_python", localdict)
             return "result" in localdict and localdict["result"] or False
         except Exception as ex:
             raise UserError(
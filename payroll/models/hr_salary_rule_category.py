@@ -1,12 +1,13 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import _, api, fields, models
+from odoo import _, api, fields, models, tools
 from odoo.exceptions import ValidationError
 
 
 class HrSalaryRuleCategory(models.Model):
     _name = "hr.salary.rule.category"
     _description = "Salary Rule Category"
+    _parent_store = True
 
     name = fields.Char(required=True, translate=True)
     code = fields.Char()
@@ -16,6 +17,7 @@ class HrSalaryRuleCategory(models.Model):
         help="Linking a salary category to its parent is used only for the "
         "reporting purpose.",
     )
+    parent_path = fields.Char(index=True, unaccent=False)
     children_ids = fields.One2many(
         "hr.salary.rule.category", "parent_id", string="Children"
     )
@@ -43,6 +45,33 @@ class HrSalaryRuleCategory(models.Model):
         self.require_code = require
         return require
 
+    def write(self, vals):
+        res = super().write(vals)
+        if {"code", "parent_id"} & set(vals):
+            # category hierarchies are part of the cached execution plans
+            self.clear_caches()
+            self.env["hr.payslip"]._force_full_recompute()
+        if "code" in vals:
+            lines = self.env["hr.payslip.line"].search(
+                [("category_id", "in", self.ids), ("slip_id.state", "=", "done")]
+            )
+            self.env["hr.payslip.ledger"]._update_payslips(lines.mapped("slip_id"))
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    @tools.ormcache("self.id")
+    def _get_ancestor_codes(self):
+        """
+        @return: the codes of the category and of all its parents
+        """
+        self.ensure_one()
+        ids = [int(id) for id in self.parent_path.split("/")[:-1]]
+        return tuple(code for code in self.browse(ids).mapped("code") if code)
+
     @api.constrains("parent_id")
     def _check_parent_id(self):
         if not self._check_recursion():
@@ -0,0 +1,65 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import hashlib
+import json
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+# Source fields of the salary rules kept by the revisions instead of being
+# copied on every payslip line
+REVISION_FIELDS = (
+    "condition_python",
+    "condition_range",
+    "amount_python_compute",
+    "amount_percentage_base",
+)
+
+
+class HrSalaryRuleRevision(models.Model):
+    """Immutable snapshot of the source of a salary rule, identified by the
+    hash of its content. Payslip lines reference the revision their rule had
+    when they were computed, so identical sources are stored once."""
+
+    _name = "hr.salary.rule.revision"
+    _description = "Salary Rule Revision"
+    _rec_name = "digest"
+
+    digest = fields.Char(required=True, readonly=True, index=True)
+    condition_python = fields.Text(string="Python Condition", readonly=True)
+    condition_range = fields.Char(string="Range Based on", readonly=True)
+    amount_python_compute = fields.Text(string="Python Code", readonly=True)
+    amount_percentage_base = fields.Char(string="Percentage based on", readonly=True)
+
+    _sql_constraints = [
+        ("digest_uniq", "unique(digest)", "The revision of a rule must be unique."),
+    ]
+
+    @api.model
+    def _get_digest(self, values):
+        """
+        @param values: the values of the REVISION_FIELDS
+        @return: the hash identifying these values
+        """
+        content = json.dumps([values.get(name) or False for name in REVISION_FIELDS])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @api.model
+    def _get_revision(self, values):
+        """
+        @param values: the values of the REVISION_FIELDS of a rule or a line
+        @return: the revision with these values, created if it does not exist
+        """
+        digest = self._get_digest(values)
+        revision = self.sudo().search([("digest", "=", digest)], limit=1)
+        if not revision:
+            revision = self.sudo().create(
+                dict(
+                    {name: values.get(name) or False for name in REVISION_FIELDS},
+                    digest=digest,
+                )
+            )
+        return revision.with_env(self.env)
+
+    def write(self, vals):
+        raise UserError(_("The revisions of the salary rules cannot be modified."))
@@ -0,0 +1,116 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import odoo
+from odoo import api, sql_db
+
+from .rule_profiler import RuleProfiler
+
+_logger = logging.getLogger(__name__)
+
+# connection pools inherited from the parent process, see _init_worker()
+_parent_pools = []
+
+
+def can_fork():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def split_chunks(ids, chunk_size):
+    """
+    @return: a list of tuples of at most chunk_size ids, in the order of ids
+    """
+    chunk_size = max(chunk_size, 1)
+    return [tuple(ids[i : i + chunk_size]) for i in range(0, len(ids), chunk_size)]
+
+
+def _init_worker(dbname):
+    """Give the forked worker its own database connections.
+
+    The sockets of the connections of the parent process are inherited by
+    the workers, through the global pool and the pool of the registry: they
+    must neither be used (the sessions of the parent would be corrupted) nor
+    closed (the parent would lose them) by the workers. The pools are kept
+    referenced, so that their connections are never garbage collected, the
+    workers ending with os._exit(). The registry of the database, inherited
+    too, gets a new pool.
+    """
+    registry = odoo.registry(dbname)
+    _parent_pools.extend([sql_db._Pool, registry._db])
+    sql_db._Pool = None
+    registry._db = sql_db.db_connect(dbname)
+
+
+def compute_chunk(dbname, uid, context, payslip_ids):
+    """Compute payslips in a worker process, with its own cursor, see
+    _init_worker(). Nothing is written in the database.
+
+    The rules are profiled by a new profiler of the worker, whose measures
+    are sent back to the parent process.
+    @return: a tuple (lines dicts, stats) where lines dicts is a dict
+             {payslip id: lines dict} and stats the stats of the profiler of
+             the worker, None when the rules are not profiled
+    """
+    profiler = None
+    if context.get("payroll_profiler"):
+        profiler = RuleProfiler()
+        context = dict(context, payroll_profiler=profiler)
+    registry = odoo.registry(dbname)
+    with registry.cursor() as cr:
+        env = api.Environment(cr, uid, context)
+        try:
+            lines_dicts = env["hr.payslip"].browse(payslip_ids)._compute_lines_dicts()
+        finally:
+            cr.rollback()
+    return lines_dicts, profiler and profiler.stats
+
+
+def compute_chunks(env, payslip_ids, workers, chunk_size):
+    """Compute payslips in chunks with a pool of worker processes. The
+    payslips must be committed, as workers use their own cursors.
+
+    A chunk failing does not stop the others. When a worker process dies,
+    the chunks lost with the process pool are computed again with a new
+    pool, as long as some chunks succeed. The measures of the rules
+    profiled by the workers are merged in the payroll_profiler of the
+    context, see rule_profiler.RuleProfiler.
+    @return: a list of tuples (payslip ids, result), one per chunk in the
+             order of payslip_ids. result is a dict {payslip id: lines dict},
+             or the exception raised when computing the chunk.
+    """
+    chunks = split_chunks(payslip_ids, chunk_size)
+    profiler = env.context.get("payroll_profiler")
+    results = {}
+    pending = chunks
+    while pending:
+        broken = []
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(pending)),
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(env.cr.dbname,),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    compute_chunk, env.cr.dbname, env.uid, dict(env.context), chunk
+                )
+                for chunk in pending
+            ]
+            for chunk, future in zip(pending, futures):
+                try:
+                    results[chunk], stats = future.result()
+                except BrokenProcessPool as e:
+                    results[chunk] = e
+                    broken.append(chunk)
+                except Exception as e:
+                    _logger.warning("Payslips %s could not be computed: %s", chunk, e)
+                    results[chunk] = e
+                else:
+                    if profiler and stats:
+                        profiler.merge(stats)
+        pending = broken if len(broken) < len(pending) else []
+    return [(chunk, results[chunk]) for chunk in chunks]
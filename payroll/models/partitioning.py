@@ -0,0 +1,195 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Declarative partitioning of the payslip detail tables by date_from.
+
+The tables of the payslip lines, worked days and inputs can be converted to
+tables partitioned by range of date_from, one partition per year or month
+plus a default partition. Queries bounded on date_from only scan the
+partitions of the period, and old partitions can be detached.
+
+The ORM does not create foreign keys on partitioned tables (they are not
+ordinary tables), the foreign keys of the tables are created again by
+partition_table(). The primary key includes date_from, as required by
+PostgreSQL, so the foreign keys referencing the partitioned tables include
+it: the self-referencing foreign keys (e.g. hr_payslip_line.parent_line_id,
+whose line has the date_from of its parent) are created again on (column,
+date_from). Tables referenced by the foreign keys of other tables are not
+partitioned, see get_referencing_foreign_keys().
+"""
+
+import logging
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+
+_logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = (
+    "hr_payslip_line",
+    "hr_payslip_worked_days",
+    "hr_payslip_input",
+)
+GRANULARITIES = {
+    "year": (relativedelta(years=1), "%Y"),
+    "month": (relativedelta(months=1), "%Y_%m"),
+}
+
+
+def is_partitioned(cr, table):
+    cr.execute("SELECT relkind FROM pg_class WHERE relname = %s", (table,))
+    row = cr.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+def get_referencing_foreign_keys(cr, table):
+    """
+    @return: the names of the foreign keys of the other tables referencing
+             the table, as "table.constraint". They prevent the table from
+             being partitioned.
+    """
+    cr.execute(
+        """
+        SELECT conrelid::regclass::text || '.' || conname FROM pg_constraint
+        WHERE confrelid = %s::regclass AND conrelid != confrelid
+        AND contype = 'f'
+        ORDER BY 1""",
+        (table,),
+    )
+    return [row[0] for row in cr.fetchall()]
+
+
+def get_period_start(day, granularity):
+    """
+    @return: the first day of the partition containing the day
+    """
+    if granularity == "year":
+        return date(day.year, 1, 1)
+    return date(day.year, day.month, 1)
+
+
+def create_partitions(cr, table, granularity, date_from, date_to):
+    """Create the missing partitions of the table for the periods between the
+    dates. Rows of the default partition belonging to a new partition are
+    moved to it.
+    @return: the names of the created partitions
+    """
+    step, suffix = GRANULARITIES[granularity]
+    default = "%s_default" % table
+    created = []
+    start = get_period_start(date_from, granularity)
+    while start <= date_to:
+        end = start + step
+        name = "%s_%s" % (table, start.strftime(suffix))
+        cr.execute("SELECT 1 FROM pg_class WHERE relname = %s", (name,))
+        if not cr.fetchone():
+            cr.execute(
+                'SELECT 1 FROM "%s" WHERE date_from >= %%s AND date_from < %%s '
+                "LIMIT 1" % default,
+                (start, end),
+            )
+            moved = bool(cr.fetchone())
+            if moved:
+                cr.execute(
+                    'ALTER TABLE "%s" DETACH PARTITION "%s"' % (table, default)
+                )
+            cr.execute(
+                'CREATE TABLE "%s" PARTITION OF "%s" '
+                "FOR VALUES FROM (%%s) TO (%%s)" % (name, table),
+                (start, end),
+            )
+            if moved:
+                cr.execute(
+                    'WITH moved AS (DELETE FROM "%s" WHERE date_from >= %%s '
+                    'AND date_from < %%s RETURNING *) INSERT INTO "%s" '
+                    "SELECT * FROM moved" % (default, table),
+                    (start, end),
+                )
+                cr.execute(
+                    'ALTER TABLE "%s" ATTACH PARTITION "%s" DEFAULT' % (table, default)
+                )
+            created.append(name)
+        start = end
+    return created
+
+
+def get_ondelete(cr, column, ondelete):
+    """
+    @param ondelete: the confdeltype of a foreign key on the column
+    @return: the ON DELETE clause of the foreign key on (column, date_from)
+    """
+    if ondelete == "c":
+        return " ON DELETE CASCADE"
+    if ondelete == "r":
+        return " ON DELETE RESTRICT"
+    if ondelete == "n" and cr._cnx.server_version >= 150000:
+        # date_from is kept, it is part of the primary key of the line
+        return ' ON DELETE SET NULL ("%s")' % column
+    # SET NULL of some columns only is not supported before PostgreSQL 15:
+    # the deletion of a referenced row fails, see hr.payslip.line.unlink()
+    return ""
+
+
+def partition_table(cr, table, granularity, date_to):
+    """Convert the table to a table partitioned by date_from, with partitions
+    from its first row to date_to. Runs in the current transaction, the
+    table is locked during the copy of its rows.
+    """
+    referencing = get_referencing_foreign_keys(cr, table)
+    if referencing:
+        raise ValueError(
+            "%s cannot be partitioned, it is referenced by %s"
+            % (table, ", ".join(referencing))
+        )
+    old = "%s_unpartitioned" % table
+    cr.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = %s::regclass AND contype = 'f'
+        AND confrelid != %s::regclass""",
+        (table, table),
+    )
+    foreign_keys = cr.fetchall()
+    cr.execute(
+        """
+        SELECT conname, attname, confdeltype FROM pg_constraint
+        JOIN pg_attribute ON attrelid = conrelid AND attnum = conkey[1]
+        WHERE conrelid = %s::regclass AND confrelid = conrelid
+        AND contype = 'f'""",
+        (table,),
+    )
+    self_foreign_keys = cr.fetchall()
+    cr.execute(
+        """
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE tablename = %s AND indexdef NOT LIKE 'CREATE UNIQUE %%'""",
+        (table,),
+    )
+    indexes = cr.fetchall()
+    cr.execute('ALTER TABLE "%s" RENAME TO "%s"' % (table, old))
+    for name, definition in indexes:
+        cr.execute('ALTER INDEX "%s" RENAME TO "%s_unpartitioned"' % (name, name))
+    cr.execute(
+        'CREATE TABLE "%s" (LIKE "%s" INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        "PARTITION BY RANGE (date_from)" % (table, old)
+    )
+    cr.execute('ALTER TABLE "%s" ADD PRIMARY KEY (id, date_from)' % table)
+    cr.execute('ALTER SEQUENCE "%s_id_seq" OWNED BY "%s".id' % (table, table))
+    cr.execute('CREATE TABLE "%s_default" PARTITION OF "%s" DEFAULT' % (table, table))
+    cr.execute('SELECT min(date_from) FROM "%s"' % old)
+    date_from = cr.fetchone()[0] or date_to
+    create_partitions(cr, table, granularity, date_from, date_to)
+    cr.execute('INSERT INTO "%s" SELECT * FROM "%s"' % (table, old))
+    cr.execute('DROP TABLE "%s"' % old)
+    for name, definition in indexes:
+        cr.execute(definition)
+    for name, definition in foreign_keys:
+        cr.execute(
+            'ALTER TABLE "%s" ADD CONSTRAINT "%s" %s' % (table, name, definition)
+        )
+    for name, column, ondelete in self_foreign_keys:
+        cr.execute(
+            'ALTER TABLE "%s" ADD CONSTRAINT "%s" FOREIGN KEY ("%s", date_from) '
+            'REFERENCES "%s" (id, date_from)%s'
+            % (table, name, column, table, get_ondelete(cr, column, ondelete))
+        )
+    _logger.info("Table %s partitioned by %s of date_from", table, granularity)
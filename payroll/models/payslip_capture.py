@@ -0,0 +1,442 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Capture of the evaluation context of a payslip computation, and its replay
+without database.
+
+A computation is captured by hr.payslip._capture_computation(): the objects
+of the localdict of the rules (contract, employee, payslip, worked days,
+inputs, payroll and current_contract dicts, payslips history...) are wrapped
+in recorders keeping the values read by the rules, by access path, and the
+results of the methods called (e.g. payslips.sum_rule(...)). The snapshot
+also holds the source of the rules and their hierarchy.
+
+replay() evaluates the rules again on the snapshot, the same way as
+hr.payslip.get_lines_dict() with the standard condition and amount types.
+A captured payslip can be replayed and profiled on any machine with Odoo and
+this module in the addons path:
+
+    python -m cProfile -s cumtime -m odoo.addons.payroll.models.payslip_capture \
+        capture.json [repeat]
+"""
+
+import json
+import math
+import sys
+import time
+from datetime import date, datetime
+
+from odoo.tools.safe_eval import _BUILTINS, _SAFE_OPCODES, test_expr, unsafe_eval
+
+from .base_browsable import BaseBrowsableObject, BrowsableObject
+from .hr_salary_rule import RULE_CODE_FIELDS
+
+SNAPSHOT_VERSION = 1
+
+# Rule fields kept in the snapshots
+RULE_FIELDS = (
+    "id",
+    "name",
+    "code",
+    "sequence",
+    "condition_select",
+    "condition_range_min",
+    "condition_range_max",
+    "amount_select",
+    "amount_fix",
+    "amount_percentage",
+    "appears_on_payslip",
+) + tuple(RULE_CODE_FIELDS)
+
+# Entries of the base localdict recorded by the capture. The categories,
+# rules and result_rules are filled by the evaluation, tools are the python
+# modules of hr.payslip._get_tools_dict()
+CAPTURED_KEYS = ("payslips", "worked_days", "inputs", "payroll")
+CONTRACT_KEYS = ("employee", "contract", "payslip", "current_contract")
+
+PRIMITIVE_TYPES = (bool, int, float, str, type(None))
+
+
+class ReplayError(Exception):
+    """The snapshot does not contain a value read by the replayed rules"""
+
+
+def encode(value):
+    """
+    @return: the JSON value of a primitive value, a date or a recorded object
+    """
+    if isinstance(value, PRIMITIVE_TYPES):
+        return value
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, (Recorder, ReplayObject)):
+        return {"__path__": value._path}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    return {"__repr__": repr(value)}
+
+
+def decode(value):
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    if isinstance(value, dict):
+        if "__datetime__" in value:
+            return datetime.fromisoformat(value["__datetime__"])
+        if "__date__" in value:
+            return date.fromisoformat(value["__date__"])
+        return {key: decode(item) for key, item in value.items()}
+    return value
+
+
+def is_primitive(value):
+    return isinstance(value, PRIMITIVE_TYPES + (date,))
+
+
+def get_call_path(path, args, kwargs):
+    return "%s(%s)" % (path, json.dumps(encode([args, kwargs]), sort_keys=True))
+
+
+class Recorder(object):
+    """Proxy of an object of the localdict, recording the values read through
+    it in the PayslipCapture"""
+
+    def __init__(self, capture, path, value):
+        self.__dict__.update(_capture=capture, _path=path, _value=value)
+        capture.values[path] = {"__object__": bool(value)}
+
+    def __getattr__(self, name):
+        path = "%s.%s" % (self._path, name)
+        value = getattr(self._value, name)
+        if callable(value):
+            self._capture.calls[path] = True
+            return CallRecorder(self._capture, path, value)
+        return self._capture.record(path, value)
+
+    def __bool__(self):
+        return bool(self._value)
+
+    def __len__(self):
+        return len(self.__iter_items())
+
+    def __iter__(self):
+        return iter(self.__iter_items())
+
+    def __iter_items(self):
+        items = list(self._value)
+        self._capture.values["%s[]" % self._path] = len(items)
+        return [
+            self._capture.record("%s[%s]" % (self._path, index), item)
+            for index, item in enumerate(items)
+        ]
+
+    def __str__(self):
+        return str(self._value)
+
+
+class CallRecorder(object):
+    """Method of a recorded object, recording its results by arguments"""
+
+    def __init__(self, capture, path, method):
+        self.capture = capture
+        self.path = path
+        self.method = method
+
+    def __call__(self, *args, **kwargs):
+        path = get_call_path(self.path, args, kwargs)
+        args = [arg._value if isinstance(arg, Recorder) else arg for arg in args]
+        return self.capture.record(path, self.method(*args, **kwargs))
+
+
+class PayslipCapture(object):
+    """Values read by the rules during the computation of a payslip, set in
+    the payroll_capture context key, see hr.payslip._capture_computation()"""
+
+    def __init__(self):
+        self.values = {}
+        self.calls = {}
+        self.contract_count = 0
+
+    def record(self, path, value):
+        """
+        @return: the value, wrapped in a Recorder if it is not primitive
+        """
+        if is_primitive(value):
+            self.values[path] = encode(value)
+            return value
+        return Recorder(self, path, value)
+
+    def wrap_localdict(self, localdict):
+        """
+        @return: the base localdict of the payslip with its captured entries
+                 wrapped in recorders
+        """
+        return dict(
+            localdict,
+            **{key: Recorder(self, key, localdict[key]) for key in CAPTURED_KEYS}
+        )
+
+    def wrap_contract_localdict(self, localdict):
+        """
+        @return: the localdict of the next contract of the payslip with its
+                 contract entries wrapped in recorders
+        """
+        index = self.contract_count
+        self.contract_count += 1
+        # the keys of the lines hold the contract id
+        self.values["%s:contract.id" % index] = localdict["contract"].id
+        return dict(
+            localdict,
+            **{
+                key: Recorder(self, "%s:%s" % (index, key), localdict[key])
+                for key in CONTRACT_KEYS
+            }
+        )
+
+    def get_snapshot(self, payslip, rules, blacklists, lines_dict):
+        """
+        @param rules: the salary rules of the payslip, in evaluation order
+        @param blacklists: the rules skipped with each rule, by rule id
+        @param lines_dict: the result of the captured computation
+        @return: a JSON serializable dict
+        """
+        return {
+            "version": SNAPSHOT_VERSION,
+            "payslip": {
+                "id": payslip.id,
+                "name": payslip.name,
+                "number": payslip.number,
+                "employee": payslip.employee_id.name,
+                "date_from": encode(payslip.date_from),
+                "date_to": encode(payslip.date_to),
+            },
+            "contract_count": self.contract_count,
+            "values": self.values,
+            "calls": sorted(self.calls),
+            "rules": [
+                dict(
+                    {name: rule[name] for name in RULE_FIELDS},
+                    parent_rule_id=rule.parent_rule_id.id,
+                    category_codes=list(rule.category_id._get_ancestor_codes()),
+                    revision=rule.revision_id.digest,
+                )
+                for rule in rules
+            ],
+            "blacklists": {
+                str(rule_id): sorted(rule_ids)
+                for rule_id, rule_ids in blacklists.items()
+            },
+            "lines": {
+                key: {
+                    name: line[name]
+                    for name in ("code", "quantity", "rate", "amount", "total")
+                }
+                for key, line in lines_dict.items()
+            },
+        }
+
+
+class ReplayObject(object):
+    """Object of the localdict of a replayed computation, returning the values
+    recorded by the capture"""
+
+    def __init__(self, snapshot, path):
+        self.__dict__.update(_snapshot=snapshot, _path=path)
+
+    def __getattr__(self, name):
+        path = "%s.%s" % (self._path, name)
+        if path in self._snapshot["calls"]:
+            return ReplayCall(self._snapshot, path)
+        return get_value(self._snapshot, path)
+
+    def __bool__(self):
+        return self._snapshot["values"][self._path]["__object__"]
+
+    def __len__(self):
+        return get_value(self._snapshot, "%s[]" % self._path)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield get_value(self._snapshot, "%s[%s]" % (self._path, index))
+
+    def __str__(self):
+        return "<ReplayObject %s>" % self._path
+
+
+class ReplayCall(object):
+    def __init__(self, snapshot, path):
+        self.snapshot = snapshot
+        self.path = path
+
+    def __call__(self, *args, **kwargs):
+        return get_value(self.snapshot, get_call_path(self.path, args, kwargs))
+
+
+def get_value(snapshot, path):
+    if path not in snapshot["values"]:
+        raise ReplayError("%s was not read during the capture" % path)
+    value = snapshot["values"][path]
+    if isinstance(value, dict) and "__object__" in value:
+        return ReplayObject(snapshot, path)
+    return decode(value)
+
+
+class ReplayRule(object):
+    """Salary rule of a snapshot, evaluated as hr.salary.rule"""
+
+    def __init__(self, values, code_cache):
+        self.__dict__.update(values)
+        self.code_cache = code_cache
+
+    def eval_code(self, fname, localdict):
+        key = (self.id, fname)
+        if key not in self.code_cache:
+            self.code_cache[key] = test_expr(
+                getattr(self, fname) or "", _SAFE_OPCODES, mode=RULE_CODE_FIELDS[fname]
+            )
+        if RULE_CODE_FIELDS[fname] == "eval":
+            localdict = dict(localdict)
+        localdict["__builtins__"] = _BUILTINS
+        return unsafe_eval(self.code_cache[key], localdict)
+
+    def satisfy_condition(self, localdict, rules):
+        if self.condition_select == "none":
+            result = True
+        elif self.condition_select == "range":
+            value = self.eval_code("condition_range", localdict)
+            result = self.condition_range_min <= value <= self.condition_range_max
+        else:
+            self.eval_code("condition_python", localdict)
+            result = localdict.get("result") or False
+        if self.parent_rule_id:
+            # evaluated even when the rule is not satisfied, as by the rules
+            parent_result = rules[self.parent_rule_id].satisfy_condition(
+                localdict, rules
+            )
+            return result and parent_result
+        return result
+
+    def compute_rule(self, localdict):
+        if self.amount_select == "fix":
+            return {
+                "name": self.name,
+                "quantity": float(self.eval_code("quantity", localdict)),
+                "rate": 100.0,
+                "amount": self.amount_fix,
+            }
+        if self.amount_select == "percentage":
+            return {
+                "name": self.name,
+                "quantity": float(self.eval_code("quantity", localdict)),
+                "rate": self.amount_percentage,
+                "amount": float(self.eval_code("amount_percentage_base", localdict)),
+            }
+        self.eval_code("amount_python_compute", localdict)
+        return {
+            "name": localdict.get("result_name") or self.name,
+            "quantity": float(localdict.get("result_qty", 1.0)),
+            "rate": float(localdict.get("result_rate", 100.0)),
+            "amount": float(localdict["result"]),
+        }
+
+
+def replay(snapshot):
+    """Evaluate the rules of a snapshot, as hr.payslip.get_lines_dict()
+    @return: the lines computed, as a dict {key: values}
+    """
+    snapshot = dict(snapshot, calls=set(snapshot["calls"]))
+    code_cache = {}
+    rules = [ReplayRule(values, code_cache) for values in snapshot["rules"]]
+    rules_by_id = {rule.id: rule for rule in rules}
+    blacklists = {
+        int(rule_id): set(rule_ids)
+        for rule_id, rule_ids in snapshot["blacklists"].items()
+    }
+    # the same objects for all the contracts, as in hr.payslip._get_baselocaldict()
+    base = dict(
+        {key: ReplayObject(snapshot, key) for key in CAPTURED_KEYS},
+        categories=BrowsableObject(None, {}, None),
+        rules=BrowsableObject(None, {}, None),
+        result_rules=BrowsableObject(None, {}, None),
+        tools=BrowsableObject(None, {"math": math, "datetime": datetime}, None),
+    )
+    lines_dict = {}
+    blacklist = set()
+    for index in range(snapshot["contract_count"]):
+        localdict = dict(
+            base,
+            **{
+                key: ReplayObject(snapshot, "%s:%s" % (index, key))
+                for key in CONTRACT_KEYS
+            }
+        )
+        contract_id = localdict["contract"].id
+        for rule in rules:
+            localdict.update(
+                result_name=None, result_qty=1.0, result_rate=100, result=None
+            )
+            if (
+                not rule.satisfy_condition(localdict, rules_by_id)
+                or rule.id in blacklist
+            ):
+                blacklist |= blacklists.get(rule.id, set())
+                continue
+            previous_amount = rule.code and localdict.get(rule.code) or 0.0
+            values = rule.compute_rule(localdict)
+            total = values["quantity"] * values["rate"] * values["amount"] / 100.0
+            values["total"] = total
+            if rule.code:
+                localdict[rule.code] = total
+                localdict["rules"].dict[rule.code] = rule
+                localdict["result_rules"].dict[rule.code] = BaseBrowsableObject(
+                    values
+                )
+            for code in rule.category_codes:
+                localdict["categories"].dict[code] = (
+                    localdict["categories"].dict.get(code, 0) + total - previous_amount
+                )
+            key = "%s-%s" % (rule.code or "id%s" % rule.id, contract_id)
+            lines_dict[key] = dict(values, code=rule.code)
+    return lines_dict
+
+
+def compare(snapshot, lines_dict, precision=1e-6):
+    """
+    @return: the keys of the lines of the snapshot that are different or
+             missing in lines_dict, and of the lines not in the snapshot
+    """
+    expected = snapshot["lines"]
+    return sorted(
+        key
+        for key in set(expected) | set(lines_dict)
+        if key not in expected
+        or key not in lines_dict
+        or abs(expected[key]["total"] - lines_dict[key]["total"]) > precision
+    )
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.stderr.write("usage: %s capture.json [repeat]\n" % argv[0])
+        return 2
+    with open(argv[1]) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+    repeat = int(argv[2]) if len(argv) > 2 else 1
+    start = time.perf_counter()
+    for _iteration in range(repeat):
+        lines_dict = replay(snapshot)
+    elapsed = (time.perf_counter() - start) / repeat
+    for key, line in sorted(lines_dict.items()):
+        sys.stdout.write("%-30s %16.2f\n" % (key, line["total"]))
+    differences = compare(snapshot, lines_dict)
+    sys.stdout.write(
+        "%s rules replayed in %.6fs, %s different lines %s\n"
+        % (len(snapshot["rules"]), elapsed, len(differences), differences)
+    )
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,84 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Number of SQL queries of the operations of the payroll hot path.
+
+The operations decorated with count_queries() log their number of queries,
+per payslip and per payslip line, when the logger of this module is at the
+DEBUG level, and report them to the collect_query_counts() blocks (see
+TestPayslipBase.assertQueryBudget()). Otherwise they are called directly.
+"""
+
+import functools
+import logging
+from contextlib import contextmanager
+
+_logger = logging.getLogger(__name__)
+
+# lists receiving the measures of the operations, see collect_query_counts()
+_collectors = []
+
+
+@contextmanager
+def collect_query_counts():
+    """Collect the measures of the operations executed in the block, as
+    dicts with the operation, query_count, payslip_count and line_count keys.
+    """
+    counts = []
+    _collectors.append(counts)
+    try:
+        yield counts
+    finally:
+        _collectors.remove(counts)
+
+
+def count_queries(operation, get_payslips=None):
+    """Decorator counting the SQL queries of a method.
+    @param operation: the name of the operation in the measures
+    @param get_payslips: a function called with the arguments of the method,
+                         returning the payslips of the operation
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not _collectors and not _logger.isEnabledFor(logging.DEBUG):
+                return method(self, *args, **kwargs)
+            # the pending writes are flushed, so that the queries are counted
+            # in the operation issuing them
+            cr = self.env.cr
+            self.env.flush_all()
+            query_count = cr.sql_log_count
+            res = method(self, *args, **kwargs)
+            self.env.flush_all()
+            query_count = cr.sql_log_count - query_count
+            payslips = self.env["hr.payslip"]
+            if get_payslips:
+                payslips = get_payslips(self, *args, **kwargs)
+            line_count = 0
+            if payslips:
+                line_count = self.env["hr.payslip.line"].search_count(
+                    [("slip_id", "in", payslips.ids)]
+                )
+            measure = {
+                "operation": operation,
+                "query_count": query_count,
+                "payslip_count": len(payslips),
+                "line_count": line_count,
+            }
+            for counts in _collectors:
+                counts.append(measure)
+            _logger.debug(
+                "%s: %d queries, %d payslips (%.1f per payslip), "
+                "%d lines (%.2f per line)",
+                operation,
+                query_count,
+                len(payslips),
+                query_count / (len(payslips) or 1),
+                line_count,
+                query_count / (line_count or 1),
+            )
+            return res
+
+        return wrapper
+
+    return decorator
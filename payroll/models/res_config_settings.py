@@ -1,6 +1,9 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
-from odoo import fields, models
+from odoo import _, fields, models
+from odoo.exceptions import UserError
+
+from .partitioning import PARTITIONED_TABLES, is_partitioned
 
 
 class ResConfigSettings(models.TransientModel):
@@ -35,3 +38,98 @@ class ResConfigSettings(models.TransientModel):
         help="Require rule.code, rule.category, category.code, structure.code",
         default=False,
     )
+    incremental_recompute = fields.Boolean(
+        config_parameter="payroll.incremental_recompute",
+        string="Only recompute rules affected by modified inputs",
+        help="When inputs or worked days of a computed payslip are modified, "
+        "only the salary rules depending on them are computed again",
+        default=False,
+    )
+    batch_engine = fields.Boolean(
+        config_parameter="payroll.batch_engine",
+        string="Vectorized computation of payslip batches",
+        help="When several payslips are computed at once, fixed and percentage "
+        "rules are computed for all of them together. Requires the numpy "
+        "python library.",
+        default=False,
+    )
+    bulk_insert_lines = fields.Boolean(
+        config_parameter="payroll.bulk_insert_lines",
+        string="Bulk insertion of payslip lines",
+        help="The lines of payslips computed for the first time are inserted "
+        "with multi-row SQL queries instead of being created one by one",
+        default=False,
+    )
+    partition_granularity = fields.Selection(
+        [("year", "Yearly"), ("month", "Monthly")],
+        config_parameter="payroll.partition_granularity",
+        string="Partitioning of payslip lines",
+        help="The tables of the payslip lines, worked days and inputs are "
+        "partitioned by period of the payslips. Once set, the tables cannot be "
+        "converted back.",
+    )
+    archive_months = fields.Integer(
+        config_parameter="payroll.archive_months",
+        string="Archive payslips after (months)",
+        help="Confirmed payslips ended for more months are moved to archives, "
+        "which can be restored. Payslips are not archived when 0.",
+        default=0,
+    )
+    profile_rules = fields.Boolean(
+        config_parameter="payroll.profile_rules",
+        string="Profile the salary rules",
+        help="Record the time and the SQL queries of the evaluations of each "
+        "salary rule, per payslip batch",
+        default=False,
+    )
+    parallel_workers = fields.Integer(
+        config_parameter="payroll.parallel_workers",
+        string="Parallel workers",
+        help="Number of worker processes computing the payslips of a batch. "
+        "Payslips are computed serially with less than 2 workers.",
+        default=0,
+    )
+    parallel_chunk_size = fields.Integer(
+        config_parameter="payroll.parallel_chunk_size",
+        string="Payslips per chunk",
+        help="Number of payslips computed at once by a worker process",
+        default=100,
+    )
+    queue_chunk_size = fields.Integer(
+        config_parameter="payroll.queue_chunk_size",
+        string="Payslips per background transaction",
+        help="Number of payslips computed and committed at once when a batch "
+        "is computed in the background",
+        default=20,
+    )
+
+    def set_values(self):
+        get_param = self.env["ir.config_parameter"].sudo().get_param
+        granularity = get_param("payroll.partition_granularity")
+        incremental_recompute = get_param("payroll.incremental_recompute")
+        if granularity and self.partition_granularity != granularity:
+            if any(is_partitioned(self.env.cr, table) for table in PARTITIONED_TABLES):
+                raise UserError(
+                    _(
+                        "The payslip lines are already partitioned, their "
+                        "partitioning cannot be changed."
+                    )
+                )
+        if self.partition_granularity and self.partition_granularity != granularity:
+            referencing = self.env["hr.payslip"]._get_partition_blockers()
+            if referencing:
+                raise UserError(
+                    _(
+                        "The payslip lines cannot be partitioned, they are "
+                        "referenced by the foreign keys %s."
+                    )
+                    % ", ".join(referencing)
+                )
+        res = super().set_values()
+        if self.partition_granularity != granularity:
+            # the tables are converted by the cron, not in this request
+            self.env.ref("payroll.ir_cron_payslip_partitions")._trigger()
+        if self.incremental_recompute and not incremental_recompute:
+            # the changes made while it was disabled were not tracked
+            self.env["hr.payslip"]._force_full_recompute()
+        return res
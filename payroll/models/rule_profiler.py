@@ -0,0 +1,82 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import time
+
+# Measures of a rule, see RuleProfiler.stats
+STAT_NAMES = (
+    "evaluation_count",
+    "compute_count",
+    "condition_time",
+    "amount_time",
+    "max_time",
+    "query_count",
+)
+
+
+class RuleProfiler(object):
+    """Timings of the salary rules evaluated by hr.payslip.get_lines_dict(),
+    shared by the payslips computed together through the payroll_profiler
+    context key when the profile_rules setting is enabled (see
+    hr.payslip._get_compute_context()). The measures are saved in
+    hr.payslip.rule.profile once the payslips are computed."""
+
+    def __init__(self):
+        # {(payslip batch id, rule id): {stat name: value}}
+        self.stats = {}
+        # time of the last condition of each key, added to the time of the
+        # amount of the rule for max_time
+        self.condition_times = {}
+
+    def _get_stats(self, key):
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = dict.fromkeys(STAT_NAMES, 0)
+        return stats
+
+    def satisfy_condition(self, payslip, rule, localdict):
+        """Same as rule._satisfy_condition(localdict), measured"""
+        cr = rule.env.cr
+        query_count = cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            return rule._satisfy_condition(localdict)
+        finally:
+            elapsed = time.perf_counter() - start
+            key = (payslip.payslip_run_id.id, rule.id)
+            stats = self._get_stats(key)
+            stats["evaluation_count"] += 1
+            stats["condition_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            stats["query_count"] += cr.sql_log_count - query_count
+            self.condition_times[key] = elapsed
+
+    def compute_rule(self, payslip, rule, localdict):
+        """Same as rule._compute_rule(localdict), measured"""
+        cr = rule.env.cr
+        query_count = cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            return rule._compute_rule(localdict)
+        finally:
+            elapsed = time.perf_counter() - start
+            key = (payslip.payslip_run_id.id, rule.id)
+            stats = self._get_stats(key)
+            stats["compute_count"] += 1
+            stats["amount_time"] += elapsed
+            stats["max_time"] = max(
+                stats["max_time"], self.condition_times.pop(key, 0.0) + elapsed
+            )
+            stats["query_count"] += cr.sql_log_count - query_count
+
+    def merge(self, stats):
+        """Add measures taken by another profiler, e.g. in a worker process
+        computing payslips in parallel (see parallel_compute.compute_chunk())
+        @param stats: the stats of the other profiler
+        """
+        for key, values in stats.items():
+            target = self._get_stats(key)
+            for name in STAT_NAMES:
+                if name == "max_time":
+                    target[name] = max(target[name], values[name])
+                else:
+                    target[name] += values[name]
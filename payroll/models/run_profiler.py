@@ -0,0 +1,157 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+"""Python profiling of the operations of a payslip batch.
+
+The operations of the batches with a profiling mode (see
+hr.payslip.run._profile()) run under a RunProfiler, whose results are
+attached to the batch:
+
+- deterministic mode: cProfile, saved in the pstats format, to be read with
+  pstats.Stats(path) or a viewer such as snakeviz;
+- sampling mode: the stack of the profiled thread is read by a background
+  thread at a fixed interval, saved in the pstats format (the numbers of
+  calls are numbers of samples) and in the collapsed stack format of
+  flamegraph.pl and speedscope. The sampler needs the GIL, so the actual
+  interval is at least the switch interval of the interpreter
+  (sys.getswitchinterval(), 5 ms by default).
+
+Both only use the standard library, and do not need any extra service.
+"""
+
+import cProfile
+import marshal
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+MODES = [("deterministic", "Deterministic"), ("sampling", "Sampling")]
+
+
+def get_function_key(code):
+    """
+    @return: the key of the function in the pstats format
+    """
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def get_function_label(key):
+    filename, lineno, name = key
+    return "%s (%s:%s)" % (name, os.path.basename(filename), lineno)
+
+
+class RunProfiler(object):
+    """Profile of the block of a with statement, in the current thread"""
+
+    def __init__(self, mode, interval=10, depth=0):
+        """
+        @param mode: deterministic or sampling, see MODES
+        @param interval: milliseconds between two samples of the stack
+        @param depth: maximum number of frames of the sampled stacks, below
+                      the profiled block; the deeper frames are counted in
+                      the last one. No limit when 0.
+        """
+        self.mode = mode
+        self.interval = max(interval, 1) / 1000.0
+        self.depth = depth
+        self.elapsed = 0.0
+        # sampling mode: {stack of function keys: [samples, seconds]}
+        self.stacks = defaultdict(lambda: [0, 0.0])
+        self.profile = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        if self.mode == "deterministic":
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            return self
+        self.thread_id = threading.get_ident()
+        # the frames of the callers of the block, where the samples stop
+        self.outer_frames = set()
+        frame = sys._getframe(1)
+        while frame:
+            self.outer_frames.add(id(frame))
+            frame = frame.f_back
+        self.stopped = threading.Event()
+        self.sampler = threading.Thread(
+            target=self._run_sampler, name="payroll-profiler", daemon=True
+        )
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.mode == "deterministic":
+            self.profile.disable()
+        else:
+            self.stopped.set()
+            self.sampler.join()
+        self.elapsed = time.perf_counter() - self.start
+
+    def _run_sampler(self):
+        last = time.perf_counter()
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None and not self.stopped.is_set():
+                self._add_sample(frame, now - last)
+            last = now
+
+    def _add_sample(self, frame, elapsed):
+        stack = []
+        while frame is not None:
+            stack.append(get_function_key(frame.f_code))
+            if id(frame) in self.outer_frames:
+                # the frame running the block
+                break
+            frame = frame.f_back
+        stack.reverse()
+        if self.depth:
+            stack = stack[: self.depth]
+        stats = self.stacks[tuple(stack)]
+        stats[0] += 1
+        stats[1] += elapsed
+
+    def get_pstats(self):
+        """
+        @return: the profile in the pstats format, as bytes
+        """
+        if self.profile:
+            self.profile.create_stats()
+            return marshal.dumps(self.profile.stats)
+        # {function: [samples, own seconds, total seconds]}
+        functions = defaultdict(lambda: [0, 0.0, 0.0])
+        # {function: {caller: [samples, seconds]}}
+        callers = defaultdict(lambda: defaultdict(lambda: [0, 0.0]))
+        for stack, (samples, seconds) in self.stacks.items():
+            # recursive functions are counted once per sample
+            for key in set(stack):
+                functions[key][0] += samples
+                functions[key][2] += seconds
+            functions[stack[-1]][1] += seconds
+            for caller, key in zip(stack, stack[1:]):
+                callers[key][caller][0] += samples
+                callers[key][caller][1] += seconds
+        stats = {}
+        for key, (samples, own, total) in functions.items():
+            stats[key] = (
+                samples,
+                samples,
+                own,
+                total,
+                {
+                    caller: (count, count, seconds, seconds)
+                    for caller, (count, seconds) in callers[key].items()
+                },
+            )
+        return marshal.dumps(stats)
+
+    def get_collapsed_stacks(self):
+        """
+        @return: the samples in the collapsed stack format, as bytes, one line
+                 "root;...;function samples" per stack
+        """
+        return "".join(
+            "%s %d\n" % (";".join(get_function_label(key) for key in stack), samples)
+            for stack, (samples, _seconds) in sorted(self.stacks.items())
+        ).encode()
@@ -7,30 +7,75 @@ from dateutil.relativedelta import relativedelta
 from odoo import _, api, fields, models
 from odoo.exceptions import UserError
 
+from ..models.base_browsable import BaseBrowsableObject
+from ..models.query_count import count_queries
+
+# Fields of the payslip lines printed by the report, read from the archives
+LINE_FIELDS = ("code", "quantity", "amount", "total")
+
 
 class ContributionRegisterReport(models.AbstractModel):
     _name = "report.payroll.report_contributionregister"
     _description = "Payroll Contribution Register Report"
 
     def _get_payslip_lines(self, register_ids, date_from, date_to):
+        """
+        @return: a dict mapping the registers to the list of their lines, the
+                 lines of the archived payslips included
+        """
         result = {}
         self.env.cr.execute(
             """
             SELECT pl.id from hr_payslip_line as pl
             LEFT JOIN hr_payslip AS hp on (pl.slip_id = hp.id)
-            WHERE (hp.date_from >= %s) AND (hp.date_to <= %s)
+            WHERE (pl.date_from >= %s) AND (pl.date_from <= %s)
+            AND (hp.date_to <= %s)
             AND pl.register_id in %s
             AND hp.state = 'done'
             ORDER BY pl.slip_id, pl.sequence""",
-            (date_from, date_to, tuple(register_ids)),
+            (date_from, date_to, date_to, tuple(register_ids)),
         )
         line_ids = [x[0] for x in self.env.cr.fetchall()]
         for line in self.env["hr.payslip.line"].browse(line_ids):
-            result.setdefault(line.register_id.id, self.env["hr.payslip.line"])
-            result[line.register_id.id] += line
+            result.setdefault(line.register_id.id, []).append(line)
+        for register_id, line in self._get_archived_lines(
+            register_ids, date_from, date_to
+        ):
+            result.setdefault(register_id, []).append(line)
         return result
 
+    def _get_archived_lines(self, register_ids, date_from, date_to):
+        """
+        @return: a list of tuples (register id, line) of the lines of the
+                 archived payslips of the period, the lines being objects with
+                 the attributes of the payslip lines used by the report
+        """
+        archives = self.env["hr.payslip.archive"].search(
+            [
+                ("date_from", ">=", date_from),
+                ("date_from", "<=", date_to),
+                ("date_to", "<=", date_to),
+            ],
+            order="payslip_id",
+        )
+        res = []
+        for archive in archives:
+            payslip = BaseBrowsableObject({"name": archive.name})
+            rows = archive._get_rows().get("hr_payslip_line", [])
+            for row in sorted(rows, key=lambda row: row["sequence"] or 0):
+                if row["register_id"] not in register_ids:
+                    continue
+                name = row["name"]
+                if isinstance(name, dict):
+                    # translated names are stored by language
+                    name = name.get(self.env.lang) or name.get("en_US")
+                values = {field: row[field] for field in LINE_FIELDS}
+                line = BaseBrowsableObject(dict(values, name=name, slip_id=payslip))
+                res.append((row["register_id"], line))
+        return res
+
     @api.model
+    @count_queries("report_contributionregister")
     def _get_report_values(self, docids, data=None):
         if not data.get("form"):
             raise UserError(
@@ -48,7 +93,7 @@ class ContributionRegisterReport(models.AbstractModel):
         lines_total = {}
         for register in contrib_registers:
             lines = lines_data.get(register.id)
-            lines_total[register.id] = lines and sum(lines.mapped("total")) or 0.0
+            lines_total[register.id] = sum(line.total for line in lines or [])
         return {
             "doc_ids": register_ids,
             "doc_model": "hr.contribution.register",
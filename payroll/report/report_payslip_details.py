@@ -2,6 +2,8 @@
 
 from odoo import api, models
 
+from ..models.query_count import count_queries
+
 
 class PayslipDetailsReport(models.AbstractModel):
     _name = "report.payroll.report_payslipdetails"
@@ -99,6 +101,10 @@ class PayslipDetailsReport(models.AbstractModel):
         return res
 
     @api.model
+    @count_queries(
+        "report_payslipdetails",
+        lambda self, docids, data=None: self.env["hr.payslip"].browse(docids),
+    )
     def _get_report_values(self, docids, data=None):
         payslips = self.env["hr.payslip"].browse(docids)
         return {
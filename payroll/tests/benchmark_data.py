@@ -0,0 +1,316 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from datetime import date, datetime, time, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+# Amount types of the generated rules, in turn
+AMOUNT_SELECTS = ("fix", "percentage", "code")
+
+
+class PayrollDataGenerator(object):
+    """Synthetic payroll data of a company, for the benchmarks of
+    test_benchmark.py. Can also be used from an Odoo shell to size hardware:
+
+        generator = PayrollDataGenerator(env, employees=100000)
+        generator.generate()
+        env.cr.commit()
+    """
+
+    def __init__(
+        self,
+        env,
+        employees=100,
+        contracts=1,
+        rules=30,
+        category_depth=3,
+        calendars=2,
+        leaves=1,
+        history_months=3,
+        prefix="BENCH",
+    ):
+        """
+        @param employees: number of employees
+        @param contracts: number of consecutive contracts per employee, over
+                          the history
+        @param rules: number of salary rules of the structure, every fifth rule
+                      is the child of the previous one
+        @param category_depth: depth of the nested categories of the rules
+        @param calendars: number of working time calendars of the contracts
+        @param leaves: number of leave days per employee in the current month
+        @param history_months: number of months of confirmed payslip batches
+                               before the current month
+        """
+        self.env = env
+        self.employee_count = employees
+        self.contract_count = max(contracts, 1)
+        self.rule_count = max(rules, 3)
+        self.category_depth = max(category_depth, 1)
+        self.calendar_count = max(calendars, 1)
+        self.leave_count = leaves
+        self.history_months = history_months
+        self.prefix = prefix
+        self.date_from = date.today().replace(day=1)
+        self.date_to = self.date_from + relativedelta(months=1, days=-1)
+        self.history_start = self.date_from - relativedelta(months=history_months)
+
+    def generate(self):
+        """Create the records of the company, and its history of confirmed
+        payslip batches
+        @return: the generator
+        """
+        self.company = self.env["res.company"].create(
+            {"name": "%s Company" % self.prefix}
+        )
+        self.env = self.env(
+            context=dict(
+                self.env.context,
+                allowed_company_ids=[self.company.id] + self.env.companies.ids,
+            )
+        )
+        self._generate_structure()
+        self._generate_calendars()
+        self._generate_employees()
+        self._generate_contracts()
+        self._generate_leaves()
+        self._generate_history()
+        return self
+
+    def _generate_structure(self):
+        Category = self.env["hr.salary.rule.category"]
+        Rule = self.env["hr.salary.rule"]
+        self.categories = Category.browse()
+        parent = Category
+        for level in range(self.category_depth):
+            parent = Category.create(
+                {
+                    "name": "%s Allowance %s" % (self.prefix, level),
+                    "code": "%s_ALW%s" % (self.prefix, level),
+                    "parent_id": parent.id,
+                    "company_id": self.company.id,
+                }
+            )
+            self.categories |= parent
+        root_code = self.categories[0].code
+        deduction, net = Category.create(
+            [
+                {
+                    "name": "%s %s" % (self.prefix, name),
+                    "code": "%s_%s" % (self.prefix, code),
+                    "company_id": self.company.id,
+                }
+                for name, code in (("Deduction", "DED"), ("Net", "NET"))
+            ]
+        )
+        self.categories |= deduction | net
+        rules = Rule.browse()
+        top_rules = Rule.browse()
+        for index in range(self.rule_count - 2):
+            vals = self._get_rule_vals(index)
+            vals["category_id"] = self.categories[index % self.category_depth].id
+            if index % 5 == 4:
+                # child of the previous rule, computed when the wage is high
+                vals.update(
+                    parent_rule_id=rules[-1].id,
+                    condition_select="python",
+                    condition_python="result = contract.wage > 3000",
+                )
+            rule = Rule.create(vals)
+            rules |= rule
+            if not rule.parent_rule_id:
+                top_rules |= rule
+        top_rules |= Rule.create(
+            [
+                {
+                    "name": "%s Deduction" % self.prefix,
+                    "code": "%s_DED" % self.prefix,
+                    "sequence": 900,
+                    "category_id": deduction.id,
+                    "amount_select": "percentage",
+                    "amount_percentage": -10.0,
+                    "amount_percentage_base": "categories.%s" % root_code,
+                    "company_id": self.company.id,
+                },
+                {
+                    "name": "%s Net" % self.prefix,
+                    "code": "%s_NET" % self.prefix,
+                    "sequence": 1000,
+                    "category_id": net.id,
+                    "amount_select": "code",
+                    "amount_python_compute": "result = categories.%s + categories.%s"
+                    % (root_code, deduction.code),
+                    "company_id": self.company.id,
+                },
+            ]
+        )
+        self.rules = rules | top_rules
+        self.structure = self.env["hr.payroll.structure"].create(
+            {
+                "name": "%s Structure" % self.prefix,
+                "code": self.prefix,
+                "company_id": self.company.id,
+                "rule_ids": [(6, 0, top_rules.ids)],
+            }
+        )
+
+    def _get_rule_vals(self, index):
+        """
+        @return: the values of the index-th generated rule, the amount types
+                 are used in turn
+        """
+        vals = {
+            "name": "%s Rule %s" % (self.prefix, index),
+            "code": "%s_R%s" % (self.prefix, index),
+            "sequence": 10 + index,
+            "amount_select": AMOUNT_SELECTS[index % len(AMOUNT_SELECTS)],
+            "company_id": self.company.id,
+        }
+        if vals["amount_select"] == "fix":
+            vals.update(
+                amount_fix=10.0 + index,
+                quantity="worked_days.WORK100 and worked_days.WORK100.number_of_days",
+            )
+        elif vals["amount_select"] == "percentage":
+            vals.update(amount_percentage=1.0, amount_percentage_base="contract.wage")
+        elif index % 10 == 2:
+            # history lookup over the last year
+            vals["amount_python_compute"] = (
+                "result = payslips.sum_rule('%s_NET', "
+                "payslip.date_from.replace(year=payslip.date_from.year - 1), "
+                "payslip.date_from) * 0.001" % self.prefix
+            )
+        else:
+            vals["amount_python_compute"] = (
+                "result = contract.wage * 0.001 + categories.%s_ALW0 * 0.01"
+                % self.prefix
+            )
+        return vals
+
+    def _generate_calendars(self):
+        Calendar = self.env["resource.calendar"]
+        self.calendars = Calendar.browse()
+        for index in range(self.calendar_count):
+            hours = 8 - index % 3
+            self.calendars |= Calendar.create(
+                {
+                    "name": "%s Calendar %s" % (self.prefix, index),
+                    "tz": "UTC",
+                    "company_id": self.company.id,
+                    "attendance_ids": [
+                        (
+                            0,
+                            0,
+                            {
+                                "name": "Day %s" % day,
+                                "dayofweek": str(day),
+                                "hour_from": 8,
+                                "hour_to": 8 + hours,
+                            },
+                        )
+                        for day in range(5)
+                    ],
+                }
+            )
+
+    def _generate_employees(self):
+        self.employees = self.env["hr.employee"].create(
+            [
+                {
+                    "name": "%s Employee %s" % (self.prefix, index),
+                    "company_id": self.company.id,
+                    "resource_calendar_id": self.calendars[
+                        index % self.calendar_count
+                    ].id,
+                }
+                for index in range(self.employee_count)
+            ]
+        )
+
+    def _generate_contracts(self):
+        """Consecutive contracts of the employees, the last one is running"""
+        days = (self.date_to - self.history_start).days + 1
+        length = days // self.contract_count
+        vals_list = []
+        for index, employee in enumerate(self.employees):
+            for number in range(self.contract_count):
+                date_start = self.history_start + timedelta(days=number * length)
+                last = number == self.contract_count - 1
+                vals_list.append(
+                    {
+                        "name": "%s Contract %s-%s" % (self.prefix, index, number),
+                        "employee_id": employee.id,
+                        "company_id": self.company.id,
+                        "struct_id": self.structure.id,
+                        "resource_calendar_id": employee.resource_calendar_id.id,
+                        "wage": 2000.0 + (index % 50) * 100.0,
+                        "date_start": date_start,
+                        "date_end": not last
+                        and date_start + timedelta(days=length - 1),
+                        "state": "open" if last else "close",
+                    }
+                )
+        self.contracts = self.env["hr.contract"].create(vals_list)
+
+    def _generate_leaves(self):
+        if not self.leave_count:
+            return
+        self.leave_type = self.env["hr.leave.type"].create(
+            {
+                "name": "%s Leave" % self.prefix,
+                "code": "%s_LV" % self.prefix,
+                "allocation_validation_type": "no",
+                "leave_validation_type": "no_validation",
+                "company_id": self.company.id,
+            }
+        )
+        days = []
+        day = self.date_from
+        while len(days) < self.leave_count and day <= self.date_to:
+            if day.weekday() < 5:
+                days.append(day)
+            day += timedelta(days=1)
+        self.leaves = self.env["hr.leave"].create(
+            [
+                {
+                    "name": "%s Leave" % self.prefix,
+                    "employee_id": employee.id,
+                    "holiday_status_id": self.leave_type.id,
+                    "date_from": datetime.combine(day, time(8)),
+                    "date_to": datetime.combine(day, time(12)),
+                    "number_of_days": 1,
+                }
+                for employee in self.employees
+                for day in days
+            ]
+        )
+
+    def create_run(self, date_from, date_to, name=None):
+        """
+        @return: a payslip batch of the company, with the payslips of all the
+                 employees, not computed
+        """
+        run = self.env["hr.payslip.run"].create(
+            {
+                "name": name or "%s %s" % (self.prefix, date_from),
+                "company_id": self.company.id,
+                "date_start": date_from,
+                "date_end": date_to,
+            }
+        )
+        [run_data] = run.read(["date_start", "date_end", "credit_note", "struct_id"])
+        self.env["hr.payslip.employees"]._create_payslips(
+            self.employees, run_data, run.id
+        )
+        return run
+
+    def _generate_history(self):
+        """Confirmed payslip batches of the months before the current one"""
+        self.history_runs = self.env["hr.payslip.run"]
+        for month in range(self.history_months, 0, -1):
+            date_from = self.date_from - relativedelta(months=month)
+            date_to = date_from + relativedelta(months=1, days=-1)
+            run = self.create_run(date_from, date_to)
+            run.slip_ids.compute_sheet()
+            run.slip_ids.with_context(without_compute_sheet=True).action_payslip_done()
+            run.close_payslip_run()
+            self.history_runs |= run
@@ -1,9 +1,12 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from contextlib import contextmanager
 
 from odoo.fields import Date
 from odoo.tests.common import TransactionCase
 
+from odoo.addons.payroll.models.query_count import collect_query_counts
+
 
 class TestPayslipBase(TransactionCase):
     def setUp(self):
@@ -262,3 +265,27 @@ class TestPayslipBase(TransactionCase):
         self.env.ref(
             "hr_contract.ir_cron_data_contract_update_state"
         ).method_direct_trigger()
+
+    @contextmanager
+    def assertQueryBudget(self, operation, per_call, per_payslip=0, per_line=0):
+        """Fail when an operation of the payroll hot path executed in the
+        block (see query_count.count_queries()) issues more SQL queries than
+        per_call + per_payslip * payslips + per_line * payslip lines.
+        @return: the list of the measures of the operations of the block
+        """
+        with collect_query_counts() as counts:
+            yield counts
+        measures = [measure for measure in counts if measure["operation"] == operation]
+        self.assertTrue(measures, "%s was not executed" % operation)
+        for measure in measures:
+            budget = (
+                per_call
+                + per_payslip * measure["payslip_count"]
+                + per_line * measure["line_count"]
+            )
+            self.assertLessEqual(
+                measure["query_count"],
+                budget,
+                "%(operation)s issued %(query_count)s queries for "
+                "%(payslip_count)s payslips and %(line_count)s lines" % measure,
+            )
@@ -0,0 +1,108 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from odoo.tests import tagged
+from odoo.tests.common import TransactionCase
+
+from .benchmark_data import PayrollDataGenerator
+
+_logger = logging.getLogger(__name__)
+
+# Parameters of the generator, read from PAYROLL_BENCHMARK_<NAME> variables
+PARAMETERS = {
+    "employees": 50,
+    "contracts": 2,
+    "rules": 30,
+    "category_depth": 3,
+    "calendars": 2,
+    "leaves": 1,
+    "history_months": 3,
+}
+
+
+@tagged("-standard", "payroll_benchmark")
+class TestPayrollBenchmark(TransactionCase):
+    """Timings of the payroll operations on a generated company. Not run with
+    the standard tests, run with --test-tags payroll_benchmark. The size of
+    the company is set with the PAYROLL_BENCHMARK_EMPLOYEES, ..._CONTRACTS,
+    ..._RULES, ..._CATEGORY_DEPTH, ..._CALENDARS, ..._LEAVES and
+    ..._HISTORY_MONTHS environment variables. The results are logged as JSON,
+    and written to the file of PAYROLL_BENCHMARK_OUTPUT if set."""
+
+    def setUp(self):
+        super().setUp()
+        self.parameters = {
+            name: int(os.environ.get("PAYROLL_BENCHMARK_%s" % name.upper(), default))
+            for name, default in PARAMETERS.items()
+        }
+        self.results = {}
+
+    @contextmanager
+    def measure(self, operation, payslip_count=0):
+        """Time the block, with its number of SQL queries"""
+        cr = self.env.cr
+        self.env.flush_all()
+        query_count = cr.sql_log_count
+        start = time.perf_counter()
+        yield
+        self.env.flush_all()
+        elapsed = time.perf_counter() - start
+        self.results[operation] = {
+            "seconds": round(elapsed, 6),
+            "queries": cr.sql_log_count - query_count,
+            "payslips": payslip_count,
+            "seconds_per_payslip": payslip_count
+            and round(elapsed / payslip_count, 6),
+        }
+
+    def write_results(self):
+        module = self.env["ir.module.module"].search([("name", "=", "payroll")])
+        output = {
+            "version": module.latest_version,
+            "parameters": self.parameters,
+            "results": self.results,
+        }
+        _logger.info("Payroll benchmark: %s", json.dumps(output, sort_keys=True))
+        path = os.environ.get("PAYROLL_BENCHMARK_OUTPUT")
+        if path:
+            with open(path, "w") as output_file:
+                json.dump(output, output_file, indent=2, sort_keys=True)
+
+    def test_benchmark(self):
+        generator = PayrollDataGenerator(self.env, **self.parameters)
+        with self.measure("generate_company"):
+            generator.generate()
+        employee_count = len(generator.employees)
+
+        with self.measure("generate_batch", employee_count):
+            run = generator.create_run(generator.date_from, generator.date_to)
+        payslips = run.slip_ids
+        self.assertEqual(len(payslips), employee_count)
+
+        with self.measure("compute_sheet", employee_count):
+            run.compute_sheets()
+        self.assertEqual(set(payslips.mapped("state")), {"verify"})
+
+        with self.measure("recompute_sheet", employee_count):
+            run.compute_sheets()
+
+        with self.measure("confirm", employee_count):
+            payslips.action_payslip_done()
+        self.assertEqual(set(payslips.mapped("state")), {"done"})
+
+        reports = ("payroll.action_report_payslip", "payroll.payslip_details_report")
+        for xmlid in reports:
+            report = self.env.ref(xmlid)
+            with self.measure(report.report_name, employee_count):
+                report._render_qweb_html(report, payslips.ids)
+
+        with self.measure("refund", employee_count):
+            payslips.refund_sheet()
+        self.assertEqual(len(payslips.mapped("refunded_id")), employee_count)
+
+        self.write_results()
@@ -1,7 +1,25 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from datetime import timedelta
 
-from odoo.addons.payroll.models.hr_payslip import BaseBrowsableObject, BrowsableObject
+from odoo.exceptions import AccessError
+from odoo.tests import new_test_user
+from odoo.tools import mute_logger
+
+from odoo.addons.payroll.models.base_browsable import (
+    CATEGORY_MONTHLY_QUERY,
+    CATEGORY_QUERY,
+    RULE_MONTHLY_QUERY,
+    RULE_QUERY,
+)
+from odoo.addons.payroll.models.hr_payslip import (
+    BaseBrowsableObject,
+    BrowsableObject,
+    Payslips,
+    PayslipsHistory,
+    WorkedDays,
+)
+from odoo.addons.payroll.models.partitioning import PARTITIONED_TABLES, is_partitioned
 
 from .common import TestPayslipBase
 
@@ -71,3 +89,228 @@ class TestBrowsableObject(TestPayslipBase):
             350.0,
             "Updating of attribute using dot ('.') notation succeeded",
         )
+
+    def test_payslips_history(self):
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [{"employee_id": self.richard_emp.id}, {"employee_id": self.sally.id}]
+        )
+        for payslip in payslips:
+            payslip.onchange_employee()
+        payslips.compute_sheet()
+        payslips.action_payslip_done()
+        date_from = payslips[0].date_from
+
+        expected = [
+            (
+                Payslips(payslip.employee_id.id, payslip, self.env).sum_rule(
+                    "NET", date_from
+                ),
+                Payslips(payslip.employee_id.id, payslip, self.env).max_category(
+                    "GROSS", date_from
+                ),
+            )
+            for payslip in payslips
+        ]
+        self.assertTrue(all(net for net, gross in expected))
+
+        history = PayslipsHistory(payslips.mapped("employee_id").ids)
+        env = self.env(context=dict(self.env.context, payroll_history=history))
+        results = [
+            (
+                Payslips(payslip.employee_id.id, payslip, env).sum_rule(
+                    "NET", date_from
+                ),
+                Payslips(payslip.employee_id.id, payslip, env).max_category(
+                    "GROSS", date_from
+                ),
+            )
+            for payslip in payslips
+        ]
+        self.assertEqual(results, expected, "Same results with the batch lookups")
+        self.assertEqual(
+            len([key for key in history.results if key[0] != "hierarchy_codes"]),
+            2,
+            "One query per lookup for all the employees",
+        )
+
+    def test_payslip_ledger(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        ledger = self.env["hr.payslip.ledger"].search([("payslip_id", "=", payslip.id)])
+        self.assertIn(("rule", "NET"), [(row.kind, row.code) for row in ledger])
+
+        obj = Payslips(self.richard_emp.id, payslip, self.env)
+        date_from, date_to = payslip.date_from, payslip.date_to
+        params = {"code": "NET", "date_from": date_from, "date_to": date_to}
+        expected = obj._get_history(RULE_QUERY, "sum", params)
+        self.assertTrue(expected)
+        self.assertEqual(obj.sum_rule("NET", date_from, date_to), expected)
+        self.assertEqual(
+            obj.average_rule("NET", date_from, date_to),
+            obj._get_history(RULE_QUERY, "avg", params),
+        )
+        codes = obj._get_hierarchy_codes("GROSS")
+        category_params = {"codes": codes, "date_from": date_from, "date_to": date_to}
+        self.assertEqual(
+            obj.sum_category("GROSS", date_from, date_to),
+            obj._get_history(CATEGORY_QUERY, "sum", category_params),
+        )
+        # the other lookups are read from the rows of the payslips as well
+        for aggregate in ("max", "min"):
+            self.assertEqual(
+                getattr(obj, "%s_rule" % aggregate)("NET", date_from, date_to),
+                obj._get_history(RULE_QUERY, aggregate, params),
+            )
+            self.assertEqual(
+                getattr(obj, "%s_category" % aggregate)("GROSS", date_from, date_to),
+                obj._get_history(CATEGORY_QUERY, aggregate, category_params),
+            )
+        for aggregate, name in (("avg", "average"), ("max", "max"), ("min", "min")):
+            self.assertEqual(
+                getattr(obj, "%s_rule_monthly" % name)("NET", date_from, date_to),
+                obj._get_history(RULE_MONTHLY_QUERY, aggregate, params),
+            )
+            self.assertEqual(
+                getattr(obj, "%s_category_monthly" % name)(
+                    "GROSS", date_from, date_to
+                ),
+                obj._get_history(CATEGORY_MONTHLY_QUERY, aggregate, category_params),
+            )
+        self.assertEqual(
+            obj.sum_rule("NET", date_from + timedelta(days=1), date_to),
+            0.0,
+            "Payslips starting before the period are not counted",
+        )
+
+        # lines added to or removed from the confirmed payslip are in the ledger
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.allow_edit_payslip_lines", True
+        )
+        net_line = payslip.line_ids.filtered(lambda line: line.code == "NET")
+        net_copy = net_line.copy()
+        self.assertEqual(obj.sum_rule("NET", date_from, date_to), expected * 2)
+        net_copy.unlink()
+        self.assertEqual(obj.sum_rule("NET", date_from, date_to), expected)
+
+        payslip.write({"state": "cancel"})
+        self.assertEqual(obj.sum_rule("NET", date_from, date_to), 0.0)
+        self.assertFalse(ledger.exists())
+
+    def test_partition_tables(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        obj = Payslips(self.richard_emp.id, payslip, self.env)
+        date_from, date_to = payslip.date_from, payslip.date_to
+        params = {"code": "NET", "date_from": date_from, "date_to": date_to}
+        expected = obj._get_history(RULE_QUERY, "sum", params)
+        self.assertTrue(expected)
+
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.partition_granularity", "month"
+        )
+        # tables referenced by the foreign keys of other tables are not
+        # partitioned, their foreign keys would be lost
+        self.env.cr.execute(
+            "CREATE TABLE payroll_test_line_ref "
+            "(line_id integer REFERENCES hr_payslip_line (id))"
+        )
+        self.assertEqual(
+            self.Payslip._get_partition_blockers(),
+            ["payroll_test_line_ref.payroll_test_line_ref_line_id_fkey"],
+        )
+        with mute_logger("odoo.addons.payroll.models.hr_payslip"):
+            self.Payslip._partition_tables()
+        self.assertFalse(is_partitioned(self.env.cr, "hr_payslip_line"))
+        self.env.cr.execute("DROP TABLE payroll_test_line_ref")
+
+        self.Payslip._partition_tables()
+        for table in PARTITIONED_TABLES:
+            self.assertTrue(is_partitioned(self.env.cr, table))
+        self.env.cr.execute(
+            """
+            SELECT count(*) FROM pg_constraint
+            WHERE conrelid = 'hr_payslip_line'::regclass
+            AND confrelid = conrelid AND array_length(conkey, 1) = 2"""
+        )
+        self.assertEqual(
+            self.env.cr.fetchone()[0], 1, "parent_line_id is still a foreign key"
+        )
+        self.env.cr.execute(
+            "SELECT count(*) FROM hr_payslip_line_%s" % date_from.strftime("%Y_%m")
+        )
+        self.assertEqual(self.env.cr.fetchone()[0], len(payslip.line_ids))
+        self.assertEqual(obj._get_history(RULE_QUERY, "sum", params), expected)
+
+        # the payslips are still computed and deleted through the ORM
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        self.assertTrue(payslip.line_ids)
+        payslip.unlink()
+
+    def test_payslip_archive(self):
+        self.apply_contract_cron()
+        self.rule_basic.register_id = self.register_hra
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.action_payslip_done()
+        payslip_id, line_count = payslip.id, len(payslip.line_ids)
+        obj = Payslips(self.richard_emp.id, payslip, self.env)
+        worked_days = WorkedDays(self.richard_emp.id, {}, self.env)
+        work_code = payslip.worked_days_line_ids[0].code
+        date_from, date_to = payslip.date_from, payslip.date_to
+        Report = self.env["report.payroll.report_contributionregister"]
+
+        def lookups():
+            lines = Report._get_payslip_lines(
+                [self.register_hra.id], date_from, date_to
+            )
+            return (
+                obj.sum_rule("NET", date_from, date_to),
+                obj.max_rule("NET", date_from, date_to),
+                obj.sum_category("GROSS", date_from, date_to),
+                worked_days.sum(work_code, date_from, date_to),
+                [line.total for line in lines[self.register_hra.id]],
+            )
+
+        expected = lookups()
+        self.assertTrue(expected[0])
+        self.assertTrue(expected[3])
+        basic = payslip.line_ids.filtered(lambda line: line.code == "BASIC")
+        self.assertEqual(expected[4], basic.mapped("total"))
+
+        message = payslip.message_post(body="Kept with the archive")
+        archive = self.env["hr.payslip.archive"]._archive_payslips(payslip)
+        self.assertEqual(archive.payslip_id, payslip_id)
+        self.assertFalse(payslip.exists())
+        self.assertEqual(
+            (message.model, message.res_id), ("hr.payslip.archive", archive.id)
+        )
+        self.assertEqual(
+            lookups(), expected, "The archived payslip is still in the lookups"
+        )
+
+        # restoring bypasses the access rights of the payslips
+        officer = new_test_user(
+            self.env, login="payroll_officer", groups="payroll.group_payroll_user"
+        )
+        with self.assertRaises(AccessError):
+            archive.with_user(officer).action_restore()
+
+        archive.action_restore()
+        self.assertFalse(archive.exists())
+        payslip = self.Payslip.browse(payslip_id)
+        self.assertEqual(payslip.state, "done")
+        self.assertIn(message, payslip.message_ids)
+        self.assertEqual(len(payslip.line_ids), line_count)
+        ledger = self.env["hr.payslip.ledger"].search([("payslip_id", "=", payslip_id)])
+        self.assertIn(("rule", "NET"), [(row.kind, row.code) for row in ledger])
+        self.assertEqual(lookups(), expected)
@@ -1,6 +1,9 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
 from datetime import date, datetime
+from unittest.mock import patch
+
+from dateutil.relativedelta import relativedelta
 
 from odoo.tests.common import Form
 
@@ -136,3 +139,69 @@ class TestWorkedDays(TestPayslipBase):
             8.0,
             "The hours worked value is a POSITIVE number",
         )
+
+    def test_worked_days_batch(self):
+
+        self._common_contract_leave_setup()
+
+        date_from = date.today().replace(day=1)
+        date_to = date_from + relativedelta(months=1, days=-1)
+        contracts = self.richard_emp.contract_ids | self.sally.contract_ids
+        Calendar = type(self.env["resource.calendar"])
+        attendance_intervals_batch = Calendar._attendance_intervals_batch
+        contexts = []
+
+        def record_context(calendar, *args, **kwargs):
+            contexts.append(
+                (
+                    calendar.env.context.get("exclude_public_holidays"),
+                    "employee_id" in calendar.env.context,
+                )
+            )
+            return attendance_intervals_batch(calendar, *args, **kwargs)
+
+        with patch.object(
+            Calendar, "_attendance_intervals_batch", autospec=True
+        ) as mock:
+            mock.side_effect = record_context
+            worked_days = self.Payslip.get_worked_day_lines_batch(
+                [(contract, date_from, date_to) for contract in contracts]
+            )
+        self.assertIn(
+            (True, True),
+            contexts,
+            "The calendar computes the intervals without the public holidays",
+        )
+        self.assertNotIn((None, False), contexts)
+        for contract in contracts:
+            payslip = self.Payslip.new({"employee_id": contract.employee_id.id})
+            self.assertEqual(
+                worked_days[contract.id, date_from, date_to],
+                payslip.get_worked_day_lines(contract, date_from, date_to),
+                "The batch returns the same lines as get_worked_day_lines",
+            )
+        codes = [
+            line["code"]
+            for line in worked_days[self.richard_contract.id, date_from, date_to]
+        ]
+        self.assertIn("TESTLV", codes, "The leave is in the 'Worked Days' list")
+
+    def test_calendar_work_hours(self):
+        date_from = date.today().replace(day=1)
+        days = {date_from + relativedelta(days=offset) for offset in range(10)}
+        work_hours = self.Payslip._get_calendar_work_hours(self.full_calendar, days)
+        for day in days:
+            self.assertEqual(
+                work_hours[self.full_calendar.id, "UTC", day],
+                self.full_calendar.get_work_hours_count(
+                    datetime.combine(day, datetime.min.time()),
+                    datetime.combine(day, datetime.max.time()),
+                    compute_leaves=False,
+                ),
+            )
+
+        # the hours are shared through the context
+        work_hours = {}
+        Payslip = self.Payslip.with_context(payroll_work_hours=work_hours)
+        Payslip._get_calendar_work_hours(self.full_calendar, {date_from})
+        self.assertEqual(work_hours, {(self.full_calendar.id, "UTC", date_from): 8.0})
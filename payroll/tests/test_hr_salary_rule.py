@@ -1,5 +1,7 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+from odoo.exceptions import ValidationError
+
 from .common import TestPayslipBase
 
 
@@ -96,6 +98,107 @@ class TestSalaryRule(TestPayslipBase):
         self.assertEqual(line.rate, 100.0, "The rate is zero")
         self.assertEqual(line.quantity, 1.0, "The quantity is zero")
 
+    def test_python_code_checked_on_save(self):
+        with self.assertRaises(ValidationError):
+            self.test_rule.amount_python_compute = "result = "
+        with self.assertRaises(ValidationError):
+            self.test_rule.write(
+                {"amount_select": "percentage", "amount_percentage_base": "import os"}
+            )
+        # Code of unused fields is not checked
+        self.test_rule.condition_range = "contract.wage +"
+
+    def test_python_code_cache(self):
+        code = self.Rule._get_rule_code(
+            self.test_rule.id, self.test_rule.write_date, "amount_python_compute"
+        )
+        self.assertIs(
+            code,
+            self.Rule._get_rule_code(
+                self.test_rule.id, self.test_rule.write_date, "amount_python_compute"
+            ),
+            "The compiled code is reused",
+        )
+
+        self.test_rule.amount_python_compute = "result = 3"
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        line = payslip.line_ids.filtered(lambda l: l.code == "TEST")
+        self.assertEqual(line.amount, 3.0, "The modified code is evaluated")
+
+    def test_execution_plan(self):
+        plan = self.developer_pay_structure._get_execution_plan()
+        self.assertIs(
+            plan,
+            self.developer_pay_structure._get_execution_plan(),
+            "The execution plan is reused",
+        )
+        self.assertIn(
+            self.child_test_rule.id,
+            plan.blacklists[self.test_rule.id],
+            "Child rules are blacklisted with their parent",
+        )
+        self.assertIn(("Sales to Europe", "SALEURO"), plan.inputs)
+        self.assertEqual(plan.category_codes[self.categ_alw.id], ("ALW",))
+        self.assertEqual(
+            plan.get_affected_rule_ids(["inputs.SALEURO"]),
+            frozenset(
+                (
+                    self.rule_commission
+                    | self.rule_gross
+                    | self.rule_net
+                    | self.rule_child
+                ).ids
+            ),
+            "Rules depending on the input directly or through categories",
+        )
+
+        self.child_test_rule.sequence = 0
+        new_plan = self.developer_pay_structure._get_execution_plan()
+        self.assertIsNot(plan, new_plan, "Writing a rule invalidates the plan")
+        self.assertEqual(
+            new_plan.rule_ids[0], self.child_test_rule.id, "Rules are sorted again"
+        )
+
+    def test_execution_plan_shared_variables(self):
+        # rules share their variables through the localdict
+        rule_set = self.Rule.create(
+            {
+                "name": "Set variable",
+                "code": "SETVAR",
+                "sequence": 1,
+                "category_id": self.categ_alw.id,
+                "amount_select": "code",
+                "amount_python_compute": "bonus = 10\nresult = bonus",
+            }
+        )
+        rule_get = self.Rule.create(
+            {
+                "name": "Get variable",
+                "code": "GETVAR",
+                "sequence": 2,
+                "category_id": self.categ_alw.id,
+                "amount_select": "code",
+                "amount_python_compute": "result = bonus * 2",
+            }
+        )
+        self.developer_pay_structure.rule_ids = [(4, rule_set.id), (4, rule_get.id)]
+        plan = self.developer_pay_structure._get_execution_plan()
+        self.assertEqual(plan.dependencies[rule_set.id], frozenset(["*"]))
+        self.assertEqual(plan.dependencies[rule_get.id], frozenset(["*"]))
+        self.assertEqual(
+            plan.dependencies[self.rule_basic.id],
+            frozenset(),
+            "Values of the contract are not tracked by keys",
+        )
+        self.assertLessEqual(
+            set((rule_set | rule_get).ids),
+            plan.get_affected_rule_ids(["worked_days.WORK100"]),
+            "Rules sharing variables are always computed again",
+        )
+
     def test_parent_child_order(self):
         # Open contracts
         cc = self.env["hr.contract"].search([("employee_id", "=", self.richard_emp.id)])
@@ -140,6 +243,50 @@ class TestSalaryRule(TestPayslipBase):
         self.assertEqual(len(parent_line), 0, "No parent line found")
         self.assertEqual(len(child_line), 0, "No child line found")
 
+    def test_parent_line(self):
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        payslip.compute_sheet()
+        parent_line = payslip.line_ids.filtered(lambda l: l.code == "TEST")
+        for code in ("PARENT_TEST", "CHILD_TEST"):
+            line = payslip.line_ids.filtered(lambda l: l.code == code)
+            self.assertEqual(line.parent_line_id, parent_line)
+            self.assertEqual(line.total, line.quantity * line.amount * line.rate / 100)
+
+    def test_rule_revision(self):
+        revision = self.test_rule.revision_id
+        self.assertTrue(revision, "Rules reference the revision of their source")
+        self.assertEqual(
+            self.parent_test_rule.revision_id,
+            self.child_test_rule.revision_id,
+            "Rules with the same source share their revision",
+        )
+
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": self.developer_pay_structure.id,
+            }
+        )
+        payslip.compute_sheet()
+        line = payslip.line_ids.filtered(lambda l: l.code == "TEST")
+        self.assertEqual(line.revision_id, revision)
+        self.assertEqual(line.amount_python_compute, "result = 0")
+
+        self.test_rule.amount_python_compute = "result = 1"
+        self.assertNotEqual(self.test_rule.revision_id, revision)
+        self.assertEqual(
+            line.amount_python_compute,
+            "result = 0",
+            "Lines keep the source of the rule at the time of the computation",
+        )
+
     def test_rule_and_category_with_and_without_code(self):
         rule_test_code = self.SalaryRule.create(
             {
@@ -194,3 +341,71 @@ class TestSalaryRule(TestPayslipBase):
         self.assertEqual(len(line), 1, "Line found: rule without code")
         line = payslip.line_ids.filtered(lambda l: l.name == "rule without category")
         self.assertEqual(len(line), 1, "Line found: rule without category")
+
+    def test_hierarchy_closure(self):
+        grand_parent = self.SalaryRuleCateg.create({"name": "Grand", "code": "GRAND"})
+        parent = self.SalaryRuleCateg.create(
+            {"name": "Parent", "code": "PARENT", "parent_id": grand_parent.id}
+        )
+        child = self.SalaryRuleCateg.create(
+            {"name": "Child", "code": "CHILD", "parent_id": parent.id}
+        )
+        self.assertEqual(child._get_ancestor_codes(), ("GRAND", "PARENT", "CHILD"))
+
+        # Rules of the child category are summed in all its parents
+        grand_child_rule = self.Rule.create(
+            {
+                "name": "Grand Child Test Rule",
+                "code": "GRAND_CHILD_TEST",
+                "category_id": child.id,
+                "sequence": 8,
+                "parent_rule_id": self.child_test_rule.id,
+                "amount_select": "fix",
+                "amount_fix": 10,
+            }
+        )
+        total_rule = self.Rule.create(
+            {
+                "name": "Grand Total",
+                "code": "GRAND_TOTAL",
+                "category_id": self.categ_alw.id,
+                "sequence": 200,
+                "amount_select": "code",
+                "amount_python_compute": "result = categories.GRAND",
+            }
+        )
+        self.assertEqual(
+            self.test_rule._recursive_search_of_rules(),
+            [
+                (self.test_rule.id, 6),
+                (self.parent_test_rule.id, 6),
+                (self.child_test_rule.id, 7),
+                (grand_child_rule.id, 8),
+            ],
+        )
+        plan = self.developer_pay_structure._get_execution_plan()
+        self.assertIn(grand_child_rule.id, plan.blacklists[self.test_rule.id])
+        self.assertEqual(plan.category_codes[child.id], ("CHILD", "PARENT", "GRAND"))
+
+        structure = self.PayrollStructure.create(
+            {
+                "name": "Child Structure",
+                "parent_id": self.developer_pay_structure.id,
+                "rule_ids": [(4, total_rule.id)],
+            }
+        )
+        self.assertEqual(
+            structure._get_parent_structure(),
+            self.developer_pay_structure._get_parent_structure() + structure,
+        )
+
+        payslip = self.Payslip.create(
+            {
+                "employee_id": self.richard_emp.id,
+                "contract_id": self.richard_contract.id,
+                "struct_id": structure.id,
+            }
+        )
+        payslip.compute_sheet()
+        line = payslip.line_ids.filtered(lambda l: l.code == "GRAND_TOTAL")
+        self.assertEqual(line.total, 10, "Grand child category summed at full depth")
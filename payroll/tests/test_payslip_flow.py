@@ -1,11 +1,25 @@
 # Part of Odoo. See LICENSE file for full copyright and licensing details.
 
+import json
+import marshal
+import unittest
 from datetime import timedelta
 
+from odoo import SUPERUSER_ID, api
+from odoo.exceptions import AccessError
 from odoo.fields import Date
-from odoo.tests import Form
+from odoo.tests import Form, new_test_user
 from odoo.tools import test_reports
 
+from odoo.addons.payroll.models.batch_engine import numpy
+from odoo.addons.payroll.models.parallel_compute import (
+    can_fork,
+    compute_chunks,
+    split_chunks,
+)
+from odoo.addons.payroll.models.payslip_capture import compare, replay
+from odoo.addons.payroll.models.rule_profiler import STAT_NAMES, RuleProfiler
+
 from .common import TestPayslipBase
 
 
@@ -212,6 +226,429 @@ class TestPayslipFlow(TestPayslipBase):
             payslips[1].number, "The second payslip as been assigned a number"
         )
 
+    def test_incremental_recompute(self):
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.incremental_recompute", True
+        )
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        self.assertFalse(payslip.recompute_keys, "Nothing changed since computation")
+        net = payslip.get_salary_line_total("NET")
+
+        # Modify an input, only the rules depending on it are computed
+        payslip.input_line_ids.filtered(lambda l: l.code == "SALEURO").amount = 500.0
+        self.assertEqual(payslip.recompute_keys, "inputs.SALEURO")
+        payslip.compute_sheet()
+        self.assertEqual(payslip.get_salary_line_total("BASIC"), 5000.0)
+        self.assertEqual(payslip.get_salary_line_total("SALE"), 5.0)
+        self.assertEqual(
+            payslip.get_salary_line_total("NET"),
+            net + 5.0,
+            "Rules depending on the input through categories are computed",
+        )
+
+        # Modifying the contract computes all rules again
+        self.richard_contract.wage = 6000.0
+        self.assertEqual(payslip.recompute_keys, "*")
+        payslip.compute_sheet()
+        self.assertEqual(payslip.get_salary_line_total("BASIC"), 6000.0)
+
+        # and so does modifying a rule
+        self.rule_basic.amount_python_compute = "result = contract.wage * 2"
+        self.assertEqual(payslip.recompute_keys, "*")
+        payslip.compute_sheet()
+        self.assertEqual(payslip.get_salary_line_total("BASIC"), 12000.0)
+
+        # Modifying the payslip period computes all rules again
+        payslip.write({"date_to": payslip.date_to})
+        self.assertEqual(payslip.recompute_keys, "*")
+
+        # Nothing is tracked while the incremental recomputation is disabled,
+        # and all rules are computed again once it is enabled
+        payslip.compute_sheet()
+        self.assertFalse(payslip.recompute_keys, "Lines do not mark the payslips")
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.incremental_recompute", False
+        )
+        self.richard_contract.wage = 7000.0
+        self.assertFalse(payslip.recompute_keys)
+        self.env["res.config.settings"].create(
+            {"incremental_recompute": True}
+        ).set_values()
+        self.assertEqual(payslip.recompute_keys, "*")
+
+    def test_compute_sheet_updates_lines(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        line_ids = payslip.line_ids.ids
+
+        self.richard_contract.wage = 6000.0
+        self.developer_pay_structure.rule_ids = [(3, self.rule_meal.id)]
+        payslip.compute_sheet()
+        self.assertEqual(
+            payslip.get_salary_line_total("BASIC"), 6000.0, "Modified line updated"
+        )
+        self.assertNotIn("MA", payslip.line_ids.mapped("code"), "Line deleted")
+        self.assertTrue(
+            set(payslip.line_ids.ids) < set(line_ids),
+            "Lines are updated instead of being created again",
+        )
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_batch_engine(self):
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [{"employee_id": self.richard_emp.id}, {"employee_id": self.sally.id}]
+        )
+        for payslip in payslips:
+            payslip.onchange_employee()
+        expected = {
+            payslip.id: {
+                key: line["total"] for key, line in payslip.get_lines_dict().items()
+            }
+            for payslip in payslips
+        }
+        self.assertFalse(
+            payslips._get_batch_lines_dicts(), "The batch engine is disabled"
+        )
+
+        self.env["ir.config_parameter"].sudo().set_param("payroll.batch_engine", True)
+        batch_lines = payslips._get_batch_lines_dicts()
+        self.assertEqual(set(batch_lines), set(payslips.ids))
+        for payslip in payslips:
+            self.assertEqual(
+                {key: line["total"] for key, line in batch_lines[payslip.id].items()},
+                expected[payslip.id],
+                "The batch engine gives the same results as the row computation",
+            )
+        payslips.compute_sheet()
+        self.assertEqual(
+            payslips[0].get_salary_line_total("BASIC"),
+            expected[payslips[0].id]["BASIC-%s" % payslips[0].contract_id.id],
+        )
+
+    def test_bulk_insert_lines(self):
+        self.apply_contract_cron()
+
+        def compute_payslips():
+            payslips = self.Payslip.create(
+                [{"employee_id": self.richard_emp.id}, {"employee_id": self.sally.id}]
+            )
+            for payslip in payslips:
+                payslip.onchange_employee()
+            payslips.compute_sheet()
+            return [
+                sorted(
+                    (
+                        line.code,
+                        line.total,
+                        line.date_from,
+                        line.parent_line_id.code,
+                        line.employee_id,
+                    )
+                    for line in payslip.line_ids
+                )
+                for payslip in payslips
+            ]
+
+        expected = compute_payslips()
+        self.env["ir.config_parameter"].sudo().set_param(
+            "payroll.bulk_insert_lines", True
+        )
+        self.assertEqual(
+            compute_payslips(),
+            expected,
+            "Inserted lines have the same values as created lines",
+        )
+
+        # the record rules of the payslips apply to the inserted lines: a
+        # payroll officer cannot add lines to the payslip of an employee of
+        # another department
+        officer = new_test_user(
+            self.env, login="payroll_officer", groups="payroll.group_payroll_user"
+        )
+        self.richard_emp.department_id = self.env["hr.department"].create(
+            {"name": "Other department"}
+        )
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        with self.assertRaises(AccessError):
+            self.env["hr.payslip.line"].with_user(officer)._insert_lines(
+                [
+                    {
+                        "slip_id": payslip.id,
+                        "salary_rule_id": self.test_rule.id,
+                        "employee_id": self.richard_emp.id,
+                        "contract_id": payslip.contract_id.id,
+                        "name": "Test",
+                        "code": "TEST",
+                        "category_id": self.test_rule.category_id.id,
+                        "amount": 1.0,
+                    }
+                ]
+            )
+
+    def test_payslip_run_compute_sheets(self):
+        self.apply_contract_cron()
+        payslip_run = self.env["hr.payslip.run"].create({"name": "Test batch"})
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id, "payslip_run_id": payslip_run.id},
+                {"employee_id": self.sally.id, "payslip_run_id": payslip_run.id},
+            ]
+        )
+        for payslip in payslips:
+            payslip.onchange_employee()
+
+        # batches smaller than a chunk are computed serially
+        set_param = self.env["ir.config_parameter"].sudo().set_param
+        set_param("payroll.parallel_workers", 4)
+        set_param("payroll.parallel_chunk_size", 10)
+        payslip_run.compute_sheets()
+        self.assertEqual(set(payslips.mapped("state")), {"verify"})
+        self.assertTrue(all(payslip.line_ids for payslip in payslips))
+
+        # the transaction has uncommitted changes, the workers would not see
+        # them: the payslips are computed serially, nothing is committed
+        set_param("payroll.parallel_chunk_size", 1)
+        payslips.action_payslip_draft()
+        payslip_run.compute_sheets()
+        self.assertEqual(set(payslips.mapped("state")), {"verify"})
+
+        self.assertEqual(
+            split_chunks([1, 2, 3, 4, 5], 2),
+            [(1, 2), (3, 4), (5,)],
+            "Chunks keep the order of the payslips",
+        )
+
+    @unittest.skipUnless(can_fork(), "Worker processes are forked")
+    def test_compute_chunks_parallel(self):
+        # the workers read committed payslips with their own connections
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            employee = env["hr.employee"].create({"name": "Parallel Employee"})
+            payslips = env["hr.payslip"].create(
+                [{"employee_id": employee.id} for _index in range(3)]
+            )
+            employee_id, payslip_ids = employee.id, payslips.ids
+        try:
+            results = compute_chunks(self.env, payslip_ids, 2, 1)
+            self.assertEqual(
+                [chunk for chunk, _result in results],
+                [(payslip_id,) for payslip_id in payslip_ids],
+            )
+            for chunk, result in results:
+                self.assertNotIsInstance(result, Exception)
+                self.assertEqual(list(result), list(chunk))
+            # the connection of the parent process is still usable
+            self.env.cr.execute(
+                "SELECT count(*) FROM hr_payslip WHERE id IN %s", [tuple(payslip_ids)]
+            )
+            self.assertEqual(self.env.cr.fetchone()[0], 3)
+        finally:
+            with self.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env["hr.payslip"].browse(payslip_ids).unlink()
+                env["hr.employee"].browse(employee_id).unlink()
+
+    def test_rule_profiles(self):
+        self.apply_contract_cron()
+        payslip_run = self.env["hr.payslip.run"].create({"name": "Test batch"})
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id, "payslip_run_id": payslip_run.id},
+                {"employee_id": self.sally.id, "payslip_run_id": payslip_run.id},
+            ]
+        )
+        for payslip in payslips:
+            payslip.onchange_employee()
+        payslip_run.compute_sheets()
+        self.assertFalse(payslip_run.rule_profile_ids, "Rules are not profiled")
+
+        self.env["ir.config_parameter"].sudo().set_param("payroll.profile_rules", True)
+        payslip_run.compute_sheets()
+        profiles = payslip_run.rule_profile_ids
+        self.assertEqual(payslip_run.rule_profile_count, len(profiles))
+        net = profiles.filtered(lambda profile: profile.code == "NET")
+        self.assertEqual(net.evaluation_count, 2, "One evaluation per payslip")
+        self.assertEqual(net.compute_count, 2)
+        self.assertAlmostEqual(
+            net.total_time, net.condition_time + net.amount_time, places=6
+        )
+        self.assertLessEqual(net.max_time, net.total_time)
+
+        # the measures of the worker processes are merged in the profiler
+        profiler = RuleProfiler()
+        key = (payslip_run.id, net.rule_id.id)
+        stats = dict.fromkeys(STAT_NAMES, 1)
+        profiler.merge({key: stats})
+        profiler.merge({key: dict(stats, max_time=2)})
+        self.assertEqual(
+            profiler.stats[key],
+            dict.fromkeys(STAT_NAMES, 2),
+            "The measures are added, the greatest time is kept",
+        )
+
+        # the measures of the payslips computed again are accumulated
+        payslips[0].compute_sheet()
+        self.assertEqual(net.evaluation_count, 3)
+        payslip_run.compute_sheets()
+        net = payslip_run.rule_profile_ids.filtered(
+            lambda profile: profile.code == "NET"
+        )
+        self.assertEqual(net.evaluation_count, 2, "The batch is profiled again")
+
+        # the last measures are kept once the rules are not profiled anymore
+        self.env["ir.config_parameter"].sudo().set_param("payroll.profile_rules", False)
+        payslip_run.compute_sheets()
+        self.assertEqual(net.exists().evaluation_count, 2)
+
+        # the payslips without batch are profiled on one row per rule
+        self.env["ir.config_parameter"].sudo().set_param("payroll.profile_rules", True)
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        payslip.compute_sheet()
+        net = self.env["hr.payslip.rule.profile"].search(
+            [("run_id", "=", False), ("code", "=", "NET")]
+        )
+        self.assertEqual(len(net), 1)
+        self.assertEqual(net.evaluation_count, 2)
+
+    def test_capture_computation(self):
+        self.apply_contract_cron()
+        payslip = self.Payslip.create({"employee_id": self.richard_emp.id})
+        payslip.onchange_employee()
+        payslip.compute_sheet()
+        snapshot = json.loads(json.dumps(payslip._capture_computation()))
+        self.assertEqual(
+            {line["code"]: line["total"] for line in snapshot["lines"].values()},
+            {line.code: line.total for line in payslip.line_ids},
+        )
+
+        # the rules are evaluated again without database
+        with self.assertQueryCount(0):
+            lines_dict = replay(snapshot)
+        self.assertEqual(compare(snapshot, lines_dict), [])
+
+        payslip.action_capture_computation()
+        attachment = self.env["ir.attachment"].search(
+            [("res_model", "=", "hr.payslip"), ("res_id", "=", payslip.id)]
+        )
+        self.assertEqual(attachment.mimetype, "application/json")
+        self.assertEqual(json.loads(attachment.raw)["lines"], snapshot["lines"])
+
+    def test_payslip_run_profile(self):
+        self.apply_contract_cron()
+        payslip_run = self.env["hr.payslip.run"].create({"name": "Test batch"})
+        self.env["hr.payslip.employees"].with_context(
+            active_id=payslip_run.id
+        ).create({"employee_ids": [(6, 0, self.richard_emp.ids)]}).compute_sheet()
+        Attachment = self.env["ir.attachment"]
+        domain = [("res_model", "=", "hr.payslip.run"), ("res_id", "=", payslip_run.id)]
+        self.assertFalse(Attachment.search(domain), "The batch is not profiled")
+
+        payslip_run.profile_mode = "deterministic"
+        payslip_run.compute_sheets()
+        attachment = Attachment.search(domain)
+        self.assertRegex(attachment.name, r"-compute_sheets-\d+\.pstats$")
+        functions = {key[2] for key in marshal.loads(attachment.raw)}
+        self.assertIn("compute_sheet", functions)
+
+        payslip_run.write({"profile_mode": "sampling", "profile_interval": 1})
+        self.env["hr.payslip.employees"].with_context(
+            active_id=payslip_run.id
+        ).create({"employee_ids": [(6, 0, self.sally.ids)]}).compute_sheet()
+        attachments = Attachment.search(domain) - attachment
+        self.assertEqual(
+            sorted(name.rsplit(".")[-1] for name in attachments.mapped("name")),
+            ["collapsed", "pstats"],
+        )
+        self.assertEqual(len(payslip_run.slip_ids), 2)
+
+    def test_payslip_run_compute_background(self):
+        self.apply_contract_cron()
+        payslip_run = self.env["hr.payslip.run"].create({"name": "Test batch"})
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id, "payslip_run_id": payslip_run.id},
+                {"employee_id": self.sally.id, "payslip_run_id": payslip_run.id},
+            ]
+        )
+        for payslip in payslips:
+            payslip.onchange_employee()
+
+        payslip_run.action_compute_background()
+        jobs = payslip_run.compute_queue_ids
+        self.assertEqual(jobs.mapped("payslip_id"), payslips)
+        self.assertTrue(payslip_run.compute_queued)
+        self.assertEqual(payslip_run.compute_progress, 0.0)
+        payslip_run.action_compute_background()
+        self.assertEqual(
+            payslip_run.compute_queue_ids, jobs, "Pending payslips are not queued twice"
+        )
+
+        jobs[0]._compute_payslips()
+        payslip_run.invalidate_recordset()
+        self.assertEqual(payslip_run.compute_progress, 50.0)
+        jobs[1]._compute_payslips()
+        payslip_run.invalidate_recordset()
+        self.assertFalse(payslip_run.compute_queued)
+        self.assertEqual(payslip_run.compute_progress, 100.0)
+        self.assertEqual(set(payslips.mapped("state")), {"verify"})
+        self.assertEqual(set(jobs.mapped("state")), {"done"})
+
+    def test_compute_queue_concurrent_claims(self):
+        self.assertGreater(
+            len(self.env["hr.payslip.compute.queue"]._get_crons()),
+            1,
+            "The queue is processed by several crons",
+        )
+        # the jobs are claimed by concurrent transactions, they are committed
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            employee = env["hr.employee"].create({"name": "Queue Employee"})
+            payslip_run = env["hr.payslip.run"].create({"name": "Queue batch"})
+            payslips = env["hr.payslip"].create(
+                [
+                    {"employee_id": employee.id, "payslip_run_id": payslip_run.id}
+                    for _index in range(4)
+                ]
+            )
+            jobs = env["hr.payslip.compute.queue"].create(
+                [
+                    {"run_id": payslip_run.id, "payslip_id": payslip.id}
+                    for payslip in payslips
+                ]
+            )
+            employee_id, run_id = employee.id, payslip_run.id
+            job_ids = set(jobs.ids)
+        try:
+            with self.registry.cursor() as cr1, self.registry.cursor() as cr2:
+                queue1 = api.Environment(cr1, SUPERUSER_ID, {})[
+                    "hr.payslip.compute.queue"
+                ]
+                queue2 = api.Environment(cr2, SUPERUSER_ID, {})[
+                    "hr.payslip.compute.queue"
+                ]
+                claimed1 = set(queue1._claim_jobs(2).ids) & job_ids
+                claimed2 = set(queue2._claim_jobs(len(job_ids) + 100).ids) & job_ids
+                cr1.rollback()
+                cr2.rollback()
+            self.assertEqual(len(claimed1), 2)
+            self.assertFalse(claimed1 & claimed2, "Locked jobs are skipped")
+            self.assertEqual(claimed1 | claimed2, job_ids)
+        finally:
+            with self.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env["hr.payslip.run"].browse(run_id).slip_ids.unlink()
+                env["hr.payslip.run"].browse(run_id).unlink()
+                env["hr.employee"].browse(employee_id).unlink()
+
     def test_get_contracts_singleton(self):
 
         payslip = self.Payslip.create({"employee_id": self.sally.id})
@@ -272,6 +709,66 @@ class TestPayslipFlow(TestPayslipBase):
             len(contracts), 3, "There are 3 open contracts in the payslips"
         )
 
+    def test_get_contracts_index(self):
+        self.apply_contract_cron()
+        payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id},
+                {"employee_id": self.sally.id},
+            ]
+        )
+        index = payslips._get_contract_index()
+        for payslip in payslips:
+            self.assertEqual(
+                payslip.with_context(payroll_contracts=index)._get_employee_contracts(),
+                payslip._get_employee_contracts(),
+                "The index returns the contracts of the employee",
+            )
+        self.assertIsNone(
+            index.get_contracts(
+                self.richard_emp,
+                payslips[0].date_from - timedelta(days=1),
+                payslips[0].date_to,
+            ),
+            "Periods out of the index are not answered",
+        )
+
+    def test_get_payslip_vals_batch(self):
+        self.apply_contract_cron()
+        employees = self.richard_emp | self.sally
+        date_from = Date.today().replace(day=1)
+        date_to = date_from + timedelta(days=27)
+        slips_vals = self.Payslip._get_payslip_vals_batch(employees, date_from, date_to)
+        for employee in employees:
+            self.assertEqual(
+                slips_vals[employee.id],
+                self.Payslip.get_payslip_vals(date_from, date_to, employee.id)["value"],
+                "The batch returns the same values as get_payslip_vals",
+            )
+
+    def test_payslip_employees_domain(self):
+        self.apply_contract_cron()
+        self.sally.contract_ids.state = "close"
+        wizard = self.env["hr.payslip.employees"].create(
+            {
+                "selection_mode": "domain",
+                "employee_domain": str(
+                    [("id", "in", (self.richard_emp | self.sally).ids)]
+                ),
+            }
+        )
+        date_from = Date.today().replace(day=1)
+        date_to = date_from + timedelta(days=27)
+        self.assertEqual(
+            wizard._get_employees(date_from, date_to), self.richard_emp | self.sally
+        )
+        wizard.running_contract = True
+        self.assertEqual(
+            wizard._get_employees(date_from, date_to),
+            self.richard_emp,
+            "Only the employees with a running contract are selected",
+        )
+
     def test_compute_sheet_no_valid_contract(self):
 
         frm = Form(self.Payslip)
@@ -0,0 +1,89 @@
+# Part of Odoo. See LICENSE file for full copyright and licensing details.
+
+from odoo.addons.payroll.models.query_count import collect_query_counts
+
+from .common import TestPayslipBase
+
+
+class TestQueryBudget(TestPayslipBase):
+    """Ceilings of the number of SQL queries of the payroll hot path on the
+    fixtures of TestPayslipBase. A query issued per payslip line or per rule
+    evaluation exceeds the per payslip budget."""
+
+    def setUp(self):
+        super().setUp()
+        self.apply_contract_cron()
+        self.payslips = self.Payslip.create(
+            [
+                {"employee_id": self.richard_emp.id},
+                {"employee_id": self.sally.id},
+            ]
+        )
+        for payslip in self.payslips:
+            payslip.onchange_employee()
+
+    def test_compute_sheet(self):
+        with self.assertQueryBudget("compute_sheet", per_call=120, per_payslip=40):
+            self.payslips.compute_sheet()
+        self.assertTrue(all(payslip.line_ids for payslip in self.payslips))
+
+        # computing the lines again only updates the modified ones
+        with self.assertQueryBudget("compute_sheet", per_call=80, per_payslip=30):
+            self.payslips.compute_sheet()
+
+    def test_compute_sheet_scaling(self):
+        # a rule with 6 history lookups, each one issues one query for all the
+        # payslips computed together
+        lookup_rule = self.SalaryRule.create(
+            {
+                "name": "History lookups",
+                "code": "LOOKUPS",
+                "category_id": self.categ_alw.id,
+                "sequence": 6,
+                "amount_select": "code",
+                "amount_python_compute": "\n".join(
+                    [
+                        "date_from = payslip.date_from.replace(day=1)",
+                        "result = inputs.sum('SALEURO', date_from)",
+                        "result += worked_days.sum('WORK100', date_from)",
+                        "result += worked_days.sum_hours('WORK100', date_from)",
+                        "result += payslips.average_rule_monthly('NET', date_from)",
+                        "result += payslips.max_rule_monthly('NET', date_from)",
+                        "result += payslips.min_rule_monthly('NET', date_from)",
+                    ]
+                ),
+            }
+        )
+        (self.developer_pay_structure | self.sales_pay_structure).write(
+            {"rule_ids": [(4, lookup_rule.id)]}
+        )
+        payslips = self.payslips.copy()
+        for payslip in payslips:
+            payslip.onchange_employee()
+        with collect_query_counts() as counts:
+            self.payslips[0].compute_sheet()
+            self.payslips[1].compute_sheet()
+            payslips.compute_sheet()
+        one, other, both = (measure["query_count"] for measure in counts)
+        self.assertIn("LOOKUPS", payslips[0].line_ids.mapped("code"))
+        self.assertLessEqual(
+            both,
+            one + other - 6,
+            "Payslips computed together do not issue more queries than "
+            "computed one by one, and the history lookups are shared",
+        )
+
+    def test_get_payslip_vals(self):
+        payslip = self.payslips[0]
+        with self.assertQueryBudget("get_payslip_vals", per_call=60):
+            self.Payslip.get_payslip_vals(
+                payslip.date_from, payslip.date_to, payslip.employee_id.id
+            )
+
+    def test_report_payslip_details(self):
+        self.payslips.compute_sheet()
+        report = self.env["report.payroll.report_payslipdetails"]
+        with self.assertQueryBudget(
+            "report_payslipdetails", per_call=30, per_payslip=10
+        ):
+            report._get_report_values(self.payslips.ids)
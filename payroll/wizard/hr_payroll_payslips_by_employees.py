@@ -1,5 +1,7 @@
-from odoo import _, fields, models
+from odoo import _, api, fields, models
 from odoo.exceptions import UserError
+from odoo.osv import expression
+from odoo.tools.safe_eval import safe_eval
 
 
 class HrPayslipEmployees(models.TransientModel):
@@ -9,10 +11,46 @@ class HrPayslipEmployees(models.TransientModel):
     employee_ids = fields.Many2many(
         "hr.employee", "hr_employee_group_rel", "payslip_id", "employee_id", "Employees"
     )
+    selection_mode = fields.Selection(
+        [
+            ("employees", "Selected employees"),
+            ("domain", "Employees matching a domain"),
+        ],
+        string="Employees to pay",
+        required=True,
+        default="employees",
+    )
+    employee_domain = fields.Char(string="Employees Domain", default="[]")
+    running_contract = fields.Boolean(
+        string="With a running contract",
+        help="Only the employees with a running contract in the period of the "
+        "payslip batch.",
+    )
+
+    def _get_employees(self, date_from, date_to):
+        """
+        @return: the employees to generate payslips for. Domains are resolved
+                 by the database, the employees are never stored in the wizard.
+        """
+        self.ensure_one()
+        if self.selection_mode == "employees":
+            return self.employee_ids
+        domain = safe_eval(self.employee_domain or "[]")
+        if self.running_contract:
+            contracts = self.env["hr.contract"]._search(
+                [
+                    ("state", "=", "open"),
+                    ("date_start", "<=", date_to),
+                    "|",
+                    ("date_end", "=", False),
+                    ("date_end", ">=", date_from),
+                ]
+            )
+            contract_employees = contracts.subselect('"hr_contract"."employee_id"')
+            domain = expression.AND([domain, [("id", "inselect", contract_employees)]])
+        return self.env["hr.employee"].search(domain)
 
     def compute_sheet(self):
-        payslips = self.env["hr.payslip"]
-        [data] = self.read()
         active_id = self.env.context.get("active_id")
         if active_id:
             [run_data] = (
@@ -22,31 +60,56 @@ class HrPayslipEmployees(models.TransientModel):
             )
         from_date = run_data.get("date_start")
         to_date = run_data.get("date_end")
-        struct_id = run_data.get("struct_id")
-        if not data["employee_ids"]:
+        employees = self._get_employees(from_date, to_date)
+        if not employees:
             raise UserError(_("You must select employee(s) to generate payslip(s)."))
-        for employee in self.env["hr.employee"].browse(data["employee_ids"]):
-            slip_data = self.env["hr.payslip"].get_payslip_vals(
-                from_date, to_date, employee.id, contract_id=False, struct_id=struct_id
-            )
-            res = {
-                "employee_id": employee.id,
-                "name": slip_data["value"].get("name"),
-                "struct_id": slip_data["value"].get("struct_id"),
-                "contract_id": slip_data["value"].get("contract_id"),
-                "payslip_run_id": active_id,
-                "input_line_ids": [
-                    (0, 0, x) for x in slip_data["value"].get("input_line_ids")
-                ],
-                "worked_days_line_ids": [
-                    (0, 0, x) for x in slip_data["value"].get("worked_days_line_ids")
-                ],
-                "date_from": from_date,
-                "date_to": to_date,
-                "credit_note": run_data.get("credit_note"),
-                "company_id": employee.company_id.id,
-            }
-            payslips += self.env["hr.payslip"].create(res)
-        payslips._compute_name()
-        payslips.compute_sheet()
+        if active_id:
+            run = self.env["hr.payslip.run"].browse(active_id)
+            with run._profile("generate"):
+                payslips = self._create_payslips(employees, run_data, active_id)
+                run._compute_payslips(payslips)
+        else:
+            payslips = self._create_payslips(employees, run_data)
+            payslips.compute_sheet()
         return {"type": "ir.actions.act_window_close"}
+
+    @api.model
+    def _create_payslips(self, employees, run_data, run_id=False):
+        """
+        @param run_data: the date_start, date_end, credit_note and struct_id
+                         values of the payslip batch
+        @return: the payslips of the employees, not computed yet
+        """
+        from_date = run_data.get("date_start")
+        to_date = run_data.get("date_end")
+        struct_id = run_data.get("struct_id")
+        Payslip = self.env["hr.payslip"]
+        # contracts, worked days and inputs of all the employees at once
+        slips_data = Payslip._get_payslip_vals_batch(
+            employees, from_date, to_date, struct_id=struct_id
+        )
+        months = {}
+        vals_list = []
+        for employee in employees:
+            slip_data = slips_data[employee.id]
+            vals_list.append(
+                {
+                    "employee_id": employee.id,
+                    "name": Payslip._get_payslip_name(employee, from_date, months),
+                    "struct_id": slip_data.get("struct_id"),
+                    "contract_id": slip_data.get("contract_id"),
+                    "payslip_run_id": run_id,
+                    "input_line_ids": [
+                        (0, 0, x) for x in slip_data.get("input_line_ids")
+                    ],
+                    "worked_days_line_ids": [
+                        (0, 0, x) for x in slip_data.get("worked_days_line_ids")
+                    ],
+                    "date_from": from_date,
+                    "date_to": to_date,
+                    "credit_note": run_data.get("credit_note"),
+                    "company_id": employee.company_id.id,
+                }
+            )
+        # a single create inserts the payslips and their lines in batches
+        return Payslip.create(vals_list)